@@ -1,12 +1,26 @@
-from commands.init_project import init_project
-from commands.fit_pca import fit_pca
-from commands.fit_arhmm import fit_arhmm
-from commands.fit_keypoint import fit_keypoint
-from commands.kappa_scan import kappa_scan
-from commands.noise_calibration import noise_calibration
-from commands.kappa_scan_metrics import kappa_scan_metrics
-from commands.results import results
-from commands.outliers import outliers
-from commands.validation import validation
-from commands.apply import apply
-from commands.stats import stats
\ No newline at end of file
+import importlib
+
+# Cada comando é importado só quando usado (as dependências pesadas, como JAX, cv2 e sklearn,
+# ficam nos módulos dos comandos)
+COMMAND_MODULES = {
+    "init_project": "commands.init_project",
+    "fit_pca": "commands.fit_pca",
+    "fit_arhmm": "commands.fit_arhmm",
+    "fit_keypoint": "commands.fit_keypoint",
+    "fit_full_model": "commands.fit_full_model",
+    "kappa_scan": "commands.kappa_scan",
+    "kappa_search": "commands.kappa_search",
+    "noise_calibration": "commands.noise_calibration",
+    "kappa_scan_metrics": "commands.kappa_scan_metrics",
+    "results": "commands.results",
+    "outliers": "commands.outliers",
+    "validation": "commands.validation",
+    "apply": "commands.apply",
+    "stats": "commands.stats",
+}
+
+
+def __getattr__(name):
+    if name in COMMAND_MODULES:
+        return getattr(importlib.import_module(COMMAND_MODULES[name]), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
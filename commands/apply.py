@@ -2,7 +2,7 @@ import keypoint_moseq as kpms  # type: ignore
 import h5py
 import os
 
-from utils.load_data_and_config import load_data_and_config
+from utils.project_context import ProjectContext
 from utils.print_legal import print_legal
 from utils.overwrite_results import prevent_overwrite_error
 
@@ -16,11 +16,10 @@ def apply(project_dir, model_name):
     # Sample
     new_data = ['./projects/elm_ms/data/vids/S1', './projects/elm_ms/data/vids/S2']
 
-    data, metadata, config, coordinates, video_frame_indexes, _ = load_data_and_config(
-        project_dir, video_dir=new_data
-    )
+    project = ProjectContext(project_dir, video_dir=new_data)
+    data, metadata, config = project.data, project.metadata, project.config
 
-    prevent_overwrite_error(project_dir, model_name, coordinates.keys())
+    prevent_overwrite_error(project_dir, model_name, project.coordinates.keys())
 
     results = kpms.apply_model(
         model, data, metadata, project_dir, model_name, parallel_message_passing=False, **config
@@ -1,24 +1,27 @@
 import keypoint_moseq as kpms  # type: ignore
 import numpy as np
 from scipy.ndimage import median_filter
-from utils.load_data_and_config import load_data_and_config
+from utils.early_stopping import fit_model_with_early_stopping
+from utils.project_context import ProjectContext
 from utils.print_legal import print_legal
+from utils.precision import get_precision_dtype
 from os import path
 
 
-def fit_arhmm(project_dir, model_name, iters, kappa=None, config_overrides=None):
-    """Ajusta o modelo AR-HMM inicial."""
+def fit_arhmm(project_dir, model_name, iters, kappa=None, config_overrides=None, early_stopping=False):
+    """Ajusta o modelo AR-HMM inicial e devolve a iteração do último checkpoint."""
 
     print_legal(
         f"Ajustando o modelo AR-HMM para o projeto: {project_dir}, nome do modelo: {model_name}, iterações: {iters}"
     )
 
-    data, metadata, config, coordinates, video_frame_indexes, _ = load_data_and_config(project_dir)
-    if config_overrides:
-        config.update(config_overrides)
+    project = ProjectContext(project_dir, config_overrides=config_overrides)
+    data, metadata, config = project.data, project.metadata, project.config
 
     # Estima o sigmasq_loc
-    sigmasq_loc = estimate_sigmasq_loc(data["Y"], data["mask"], filter_size=config["fps"])
+    sigmasq_loc = estimate_sigmasq_loc(
+        data["Y"], data["mask"], filter_size=config["fps"], dtype=get_precision_dtype(config)
+    )
     kpms.update_config(project_dir, sigmasq_loc=sigmasq_loc)
 
     pca = kpms.load_pca(project_dir)
@@ -31,7 +34,7 @@ def fit_arhmm(project_dir, model_name, iters, kappa=None, config_overrides=None)
 
     print_legal(f"Iniciando ajuste do modelo AR-HMM com {iters} iterações.")
 
-    model, _ = kpms.fit_model(
+    model, last_iter = fit_model_with_early_stopping(
         model,
         data,
         metadata,
@@ -39,14 +42,19 @@ def fit_arhmm(project_dir, model_name, iters, kappa=None, config_overrides=None)
         model_name,
         ar_only=True,
         num_iters=iters,
+        early_stopping=early_stopping,
+        config=config,
         parallel_message_passing=False,  # SALVA USO DE MEMÓRIA https://keypoint-moseq.readthedocs.io/en/latest/FAQs.html#out-of-memory
     )
 
-    print_legal(f"Ajuste do modelo AR-HMM completo. Modelo salvo como {model_name}.")
+    print_legal(f"Ajuste do modelo AR-HMM completo. Modelo salvo como {model_name}, último checkpoint na iteração {last_iter}.")
+    return last_iter
 
 # De https://keypoint-moseq.readthedocs.io/en/latest/_modules/keypoint_moseq/util.html#estimate_sigmasq_loc
-def estimate_sigmasq_loc(Y, mask, filter_size=30) -> float:
-    masked_centroids = np.where(mask[:, :, None], np.median(Y, axis=2), np.nan)
+# `dtype` é a precisão dos cálculos (ver `precision` no config.yml); a média é acumulada em float64
+def estimate_sigmasq_loc(Y, mask, filter_size=30, dtype=np.float64) -> float:
+    Y = np.asarray(Y, dtype=dtype)
+    masked_centroids = np.where(mask[:, :, None], np.median(Y, axis=2), np.nan).astype(dtype, copy=False)
     smoothed_centroids = median_filter(masked_centroids, (1, filter_size, 1))
     distances = np.linalg.norm(np.diff(smoothed_centroids, axis=1), axis=-1)  # (batch, frames)
-    return float(np.nanmean(distances)**2)
\ No newline at end of file
+    return float(np.nanmean(distances, dtype=np.float64)**2)
\ No newline at end of file
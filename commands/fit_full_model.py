@@ -0,0 +1,25 @@
+from commands.fit_arhmm import fit_arhmm
+from commands.fit_keypoint import fit_keypoint
+
+
+def fit_full_model(
+    project_dir, model_name, ar_iters, ar_kappa, iters, kappa=None, config_overrides=None, early_stopping=False
+):
+    """Ajusta o modelo AR-HMM e, a partir do seu último checkpoint, o modelo keypoint."""
+    last_ar_iter = fit_arhmm(
+        project_dir=project_dir,
+        model_name=model_name,
+        iters=ar_iters,
+        kappa=ar_kappa,
+        config_overrides=config_overrides,
+        early_stopping=early_stopping,
+    )
+    return fit_keypoint(
+        project_dir=project_dir,
+        model_name=model_name,
+        checkpoint=last_ar_iter,
+        iters=iters,
+        kappa=kappa,
+        config_overrides=config_overrides,
+        early_stopping=early_stopping,
+    )
@@ -1,5 +1,6 @@
 import keypoint_moseq as kpms  # type: ignore
-from utils.load_data_and_config import load_data_and_config
+from utils.early_stopping import fit_model_with_early_stopping
+from utils.project_context import ProjectContext
 from utils.print_legal import print_legal
 
 
@@ -10,10 +11,10 @@ def fit_keypoint(
     iters,
     kappa=None,
     config_overrides=None,
+    early_stopping=False,
 ):
-    _, _, config, _, _, _ = load_data_and_config(project_dir)
-    if config_overrides:
-        config.update(config_overrides)
+    # Os dados vêm do checkpoint; do projeto só é preciso o config
+    config = ProjectContext(project_dir, config_overrides=config_overrides).config
 
     # Carrega o modelo a partir do checkpoint do modelo AR
     model, data, metadata, current_iter = kpms.load_checkpoint(
@@ -30,7 +31,7 @@ def fit_keypoint(
     model = kpms.update_hypparams(model, kappa=kappa_to_use)
     print_legal(f"Usando kappa: {kappa_to_use}")
 
-    model, _ = kpms.fit_model(
+    model, last_iter = fit_model_with_early_stopping(
         model,
         data,
         metadata,
@@ -39,6 +40,9 @@ def fit_keypoint(
         ar_only=False,
         start_iter=current_iter,
         num_iters=current_iter + iters,
+        early_stopping=early_stopping,
+        config=config,
         parallel_message_passing=False # SALVA USO DE MEMÓRIA https://keypoint-moseq.readthedocs.io/en/latest/FAQs.html#out-of-memor
     )
-    print_legal(f"Ajuste do modelo keypoint {model_name} completo.")
+    print_legal(f"Ajuste do modelo keypoint {model_name} completo, último checkpoint na iteração {last_iter}.")
+    return last_iter
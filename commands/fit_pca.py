@@ -1,5 +1,5 @@
 import keypoint_moseq as kpms # type: ignore
-from utils.load_data_and_config import load_data_and_config
+from utils.project_context import ProjectContext
 from utils.print_legal import print_legal
 from os import path
 
@@ -7,9 +7,8 @@ from os import path
 def fit_pca(project_dir, config_overrides=None):
     """Fits and saves PCA."""
 
-    data, metadata, config, _, _, _ = load_data_and_config(project_dir)
-    if config_overrides:
-        config.update(config_overrides)
+    project = ProjectContext(project_dir, config_overrides=config_overrides)
+    data, config = project.data, project.config
 
     print_legal(f"Ajustando PCA para o projeto: {project_dir}")
 
@@ -1,8 +1,17 @@
+import jax  # type: ignore
 import keypoint_moseq as kpms # type: ignore
+import multiprocessing
 import numpy as np
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
+from utils.early_stopping import fit_model_with_early_stopping
+from utils.formatted_data import load_formatted_entry
 from utils.print_legal import print_legal
-from utils.load_data_and_config import load_data_and_config
+from utils.project_context import ProjectContext
+from utils.scan_manifest import ScanManifest
+from utils.worker_env import get_threads_per_worker, get_worker_env, worker_environment
 
 
 def kappa_scan(
@@ -15,50 +24,310 @@ def kappa_scan(
     num_ar_iters,
     num_iters,
     config_overrides=None,
+    scan_workers=1,
+    threads_per_worker=None,
+    shared_init=False,
+    shared_ar_iters=0,
+    early_stopping=False,
 ):
     kappas = np.logspace(kappa_log_start, kappa_log_end, num_kappas)
     prefix = f"kappa_scan_{kappa_log_start}_{kappa_log_end}_{num_kappas}_{decrease_kappa_factor}"
 
-    data, metadata, config, coordinates, video_frame_indexes, _ = load_data_and_config(project_dir)
-    if config_overrides:
-        config.update(config_overrides)
+    project = ProjectContext(project_dir, config_overrides=config_overrides)
+    data, metadata, config = project.data, project.metadata, project.config
 
     pca = kpms.load_pca(project_dir)
 
     print_legal(f"Iniciando scan de kappa com os valores: {kappas}")
 
-    for kappa in kappas:
-        print_legal(f"Ajustando modelo com kappa={kappa}")
-        model_name = f"{prefix}-{kappa}"
+    # Retoma um scan interrompido: pula os kappas já ajustados e continua os outros do último checkpoint
+    manifest = ScanManifest(project_dir, prefix)
+    resume_points = {
+        kappa: manifest.resume_point(f"{prefix}-{kappa}", num_ar_iters, num_iters) for kappa in kappas
+    }
+    kappas_to_fit = [
+        kappa for kappa in kappas if resume_points[kappa] is None or resume_points[kappa][0] != "done"
+    ]
+    new_kappas = [kappa for kappa in kappas_to_fit if resume_points[kappa] is None]
+    if len(new_kappas) < len(kappas):
+        print_legal(
+            f"Manifesto do scan {manifest.path}: {len(kappas) - len(kappas_to_fit)} kappas já ajustados, "
+            f"{len(kappas_to_fit) - len(new_kappas)} retomados do último checkpoint, {len(new_kappas)} novos"
+        )
+
+    shared_start = None
+    if new_kappas and (shared_init or shared_ar_iters > 0):
+        shared_start = SharedStart.fit(
+            data, metadata, pca, config, project_dir, prefix, kappas, min(shared_ar_iters, num_ar_iters)
+        )
+
+    fit_args = (config, project_dir, prefix, decrease_kappa_factor, num_ar_iters, num_iters, early_stopping)
+    if kappas_to_fit and scan_workers and scan_workers > 1:
+        run_parallel_scan(project, pca, kappas_to_fit, fit_args, scan_workers, threads_per_worker, shared_start, manifest)
+    else:
+        for kappa in kappas_to_fit:
+            fit_kappa(kappa, data, metadata, pca, *fit_args, shared_start=shared_start, manifest=manifest)
+
+    if shared_start is not None:
+        print_legal(
+            f"Início compartilhado: {shared_start.seconds:.1f}s pagos uma vez em vez de {len(new_kappas)} "
+            f"(~{shared_start.seconds * (len(new_kappas) - 1):.1f}s economizados no scan)"
+        )
+
+    kpms.plot_kappa_scan(kappas, project_dir, prefix)
+
+
+class SharedStart:
+    """Modelo inicializado uma vez (e opcionalmente com um burn-in só AR) do qual todos os
+    kappas do scan partem.
+
+    O `init_model` não depende do kappa, então partir de uma inicialização só dá os mesmos
+    ajustes que inicializar cada kappa. Já o burn-in AR depende do kappa: as primeiras
+    `iteration` iterações são ajustadas uma vez com a média geométrica dos kappas do scan, e
+    cada kappa ajusta só as iterações AR que faltam com o seu valor.
+
+    Parameters
+    -------
+    model: dict
+        Snapshot do modelo (arrays numpy, para poder ser enviado aos processos do scan).
+
+    iteration: int
+        Iterações AR já ajustadas em `model` (0 se só inicializado).
+
+    init_seconds, burnin_seconds: float
+        Tempo da inicialização e do burn-in.
+    """
+
+    def __init__(self, model: dict, iteration: int, init_seconds: float, burnin_seconds: float = 0.0):
+        self.model = model
+        self.iteration = iteration
+        self.init_seconds = init_seconds
+        self.burnin_seconds = burnin_seconds
+
+    @property
+    def seconds(self) -> float:
+        return self.init_seconds + self.burnin_seconds
+
+    @classmethod
+    def fit(cls, data, metadata, pca, config, project_dir, prefix, kappas, ar_iters=0) -> "SharedStart":
+        """Inicializa o modelo e roda `ar_iters` iterações só AR, salvas como `{prefix}-shared`."""
+        start_time = time.perf_counter()
+        model = jax.block_until_ready(kpms.init_model(data, pca=pca, **config))
+        init_seconds = time.perf_counter() - start_time
+        print_legal(f"Modelo inicializado uma vez para todos os kappas em {init_seconds:.1f}s")
+
+        burnin_seconds = 0.0
+        if ar_iters > 0:
+            burnin_kappa = float(np.exp(np.mean(np.log(kappas))))
+            print_legal(f"Burn-in AR compartilhado: {ar_iters} iterações com kappa={burnin_kappa:.4g}")
+            start_time = time.perf_counter()
+            model = kpms.update_hypparams(model, kappa=burnin_kappa)
+            model = kpms.fit_model(
+                model,
+                data,
+                metadata,
+                project_dir,
+                f"{prefix}-shared",
+                ar_only=True,
+                num_iters=ar_iters,
+                save_every_n_iters=25,
+                parallel_message_passing=False # SALVA USO DE MEMÓRIA https://keypoint-moseq.readthedocs.io/en/latest/FAQs.html#out-of-memory
+            )[0]
+            model = jax.block_until_ready(model)
+            burnin_seconds = time.perf_counter() - start_time
+
+        return cls(jax.device_get(model), ar_iters, init_seconds, burnin_seconds)
+
+    def branch(self, kappa) -> tuple[dict, int]:
+        """Cópia do snapshot para `kappa` (o `update_hypparams` altera o modelo) e a iteração de
+        onde ela parte."""
+        start_time = time.perf_counter()
+        model = jax.tree_util.tree_map(lambda x: x, self.model)
+        branch_seconds = time.perf_counter() - start_time
+        print_legal(
+            f"kappa={kappa}: partindo do modelo compartilhado na iteração {self.iteration} "
+            f"({self.seconds - branch_seconds:.1f}s economizados: inicialização {self.init_seconds:.1f}s, "
+            f"burn-in {self.burnin_seconds:.1f}s)"
+        )
+        return model, self.iteration
+
+
+def fit_kappa(
+    kappa, data, metadata, pca, config, project_dir, prefix, decrease_kappa_factor, num_ar_iters, num_iters,
+    early_stopping=False, shared_start=None, manifest=None,
+):
+    """Ajusta o modelo AR e depois o AR-HMM de um kappa do scan (a partir de `shared_start`, se dado).
+
+    Com `manifest` (`ScanManifest`), o progresso do kappa é registrado nele e um ajuste
+    interrompido é retomado do último checkpoint em vez de recomeçar.
+    """
+    model_name = f"{prefix}-{kappa}"
+    resume_point = manifest.resume_point(model_name, num_ar_iters, num_iters) if manifest is not None else None
+    if resume_point is not None and resume_point[0] == "done":
+        print_legal(f"kappa={kappa} já ajustado (iteração {resume_point[1]}), pulando")
+        return model_name
+
+    print_legal(f"Ajustando modelo com kappa={kappa}")
+    if manifest is not None:
+        manifest.update(
+            model_name, kappa=float(kappa), status="running", num_ar_iters=num_ar_iters, num_iters=num_iters, error=None
+        )
+    try:
+        last_iter = _fit_kappa_phases(
+            kappa, model_name, data, metadata, pca, config, project_dir, decrease_kappa_factor, num_ar_iters,
+            num_iters, early_stopping, shared_start, manifest, resume_point,
+        )
+    except Exception as e:
+        if manifest is not None:
+            manifest.update(model_name, status="failed", error=repr(e))
+        raise
+    if manifest is not None:
+        manifest.update(model_name, status="done", last_iter=last_iter)
+    return model_name
+
+
+def _fit_kappa_phases(
+    kappa, model_name, data, metadata, pca, config, project_dir, decrease_kappa_factor, num_ar_iters, num_iters,
+    early_stopping, shared_start, manifest, resume_point,
+):
+    # `continuing`: o modelo já está na iteração `start_iter` (checkpoint ou burn-in compartilhado),
+    # então o ajuste segue da iteração seguinte em vez de repeti-la
+    phase, start_iter = resume_point or (None, 0)
+    continuing = phase is not None
+    if phase is not None:
+        model, _, _, start_iter = kpms.load_checkpoint(project_dir, model_name, iteration=start_iter)
+        phase_name = "do modelo AR" if phase == "ar" else "do modelo AR-HMM"
+        print_legal(f"kappa={kappa}: retomando o ajuste {phase_name} do checkpoint da iteração {start_iter}")
+    elif shared_start is None:
         model = kpms.init_model(data, pca=pca, **config)
+    else:
+        model, start_iter = shared_start.branch(kappa)
+        if start_iter > 0:
+            # Checkpoint do kappa com o modelo do burn-in na iteração em que ele parou (como o `kpms.fit_model` faria).
+            # Um checkpoint que já exista sem entrada no manifesto é de outra execução e é substituído
+            os.makedirs(os.path.join(project_dir, model_name), exist_ok=True)
+            kpms.save_hdf5(
+                os.path.join(project_dir, model_name, "checkpoint.h5"),
+                {"model_snapshots": {f"{start_iter}": model}, "metadata": metadata, "data": data},
+                exist_ok=True,
+                overwrite=True,
+            )
+            continuing = True
 
-        # Ajusta o modelo AR
+    if phase == "full":
+        ar_iter = manifest.entry(model_name)["ar_end_iter"]
+    else:
+        # Ajusta o modelo AR (só as iterações que faltam depois do burn-in compartilhado ou do checkpoint)
         model = kpms.update_hypparams(model, kappa=kappa)
-        model = kpms.fit_model(
-            model,
-            data,
-            metadata,
-            project_dir,
-            model_name,
-            ar_only=True,
-            num_iters=num_ar_iters,
-            save_every_n_iters=25,
-            parallel_message_passing=False # SALVA USO DE MEMÓRIA https://keypoint-moseq.readthedocs.io/en/latest/FAQs.html#out-of-memory
-        )[0]
-
-        # Ajusta o modelo AR-HMM
-        model = kpms.update_hypparams(model, kappa=kappa / decrease_kappa_factor)
-        kpms.fit_model(
-            model,
-            data,
-            metadata,
-            project_dir,
-            model_name,
-            ar_only=False,
-            start_iter=num_ar_iters,
-            num_iters=num_iters + num_ar_iters,
-            save_every_n_iters=25,
-            parallel_message_passing=False # SALVA USO DE MEMÓRIA https://keypoint-moseq.readthedocs.io/en/latest/FAQs.html#out-of-memory
+        ar_iter = start_iter
+        if start_iter + continuing <= num_ar_iters:
+            model, ar_iter = fit_model_with_early_stopping(
+                model,
+                data,
+                metadata,
+                project_dir,
+                model_name,
+                ar_only=True,
+                start_iter=start_iter + continuing,
+                num_iters=num_ar_iters,
+                early_stopping=early_stopping,
+                config=config,
+                save_every_n_iters=25,
+                parallel_message_passing=False # SALVA USO DE MEMÓRIA https://keypoint-moseq.readthedocs.io/en/latest/FAQs.html#out-of-memory
+            )
+        start_iter = ar_iter
+        if manifest is not None:
+            manifest.update(model_name, ar_end_iter=ar_iter, last_iter=ar_iter)
+
+    # Ajusta o modelo AR-HMM (partindo da última iteração AR, como no tutorial do keypoint-moseq, ou
+    # da iteração seguinte ao checkpoint de onde foi retomado)
+    model = kpms.update_hypparams(model, kappa=kappa / decrease_kappa_factor)
+    if start_iter >= ar_iter + num_iters:
+        return start_iter
+    if start_iter > ar_iter:
+        start_iter += 1
+    return fit_model_with_early_stopping(
+        model,
+        data,
+        metadata,
+        project_dir,
+        model_name,
+        ar_only=False,
+        start_iter=start_iter,
+        num_iters=num_iters + ar_iter,
+        early_stopping=early_stopping,
+        config=config,
+        save_every_n_iters=25,
+        parallel_message_passing=False # SALVA USO DE MEMÓRIA https://keypoint-moseq.readthedocs.io/en/latest/FAQs.html#out-of-memory
+    )[1]
+
+
+def run_parallel_scan(
+    project, pca, kappas, fit_args, scan_workers, threads_per_worker=None, shared_start=None, manifest=None
+):
+    """Ajusta os kappas em `scan_workers` processos (spawn, cada um com seu próprio JAX).
+
+    Cada processo lê os dados formatados do cache em disco (ver `load_formatted_entry`), sem
+    passar por este processo, mas guarda a sua própria cópia deles no dispositivo do JAX; sem o
+    cache dos dados formatados eles são enviados uma vez para cada processo, assim como o modelo
+    compartilhado (`shared_start`) e o manifesto do scan (com o lock dele). Cada processo recebe
+    uma fração igual da memória da GPU e tem as threads de BLAS/OpenMP limitadas, com o XLA
+    rodando em uma thread (ver `get_worker_env`), para os processos não disputarem os núcleos.
+    """
+    threads = get_threads_per_worker(scan_workers, threads_per_worker)
+    print_legal(f"Ajustando {len(kappas)} kappas em {scan_workers} processos com {threads} thread(s) cada")
+
+    if project.formatted_data_dir is not None:
+        shared_data = project.formatted_data_dir
+    else:
+        shared_data = ({name: np.asarray(values) for name, values in project.data.items()}, project.metadata)
+
+    start_time = time.perf_counter()
+    failures = {}
+    with worker_environment(get_worker_env(scan_workers, threads)):
+        executor = ProcessPoolExecutor(
+            max_workers=scan_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_scan_worker,
+            initargs=(shared_data, pca, shared_start, manifest),
         )
+        futures = {executor.submit(_fit_kappa_in_worker, kappa, *fit_args): kappa for kappa in kappas}
 
-    kpms.plot_kappa_scan(kappas, project_dir, prefix)
+    with executor:
+        for future in as_completed(futures):
+            kappa = futures[future]
+            try:
+                future.result()
+                print_legal(f"kappa={kappa} concluído ({time.perf_counter() - start_time:.0f}s desde o início do scan)")
+            except Exception as e:
+                print_legal(f"Erro ao ajustar kappa={kappa}: {e}", type="error")
+                failures[kappa] = e
+
+    if failures:
+        raise RuntimeError(f"O ajuste falhou para os kappas {list(failures)}") from next(iter(failures.values()))
+
+
+_worker_state = {}
+
+
+def _init_scan_worker(shared_data, pca, shared_start, manifest):
+    if isinstance(shared_data, str):
+        _worker_state["data"], _worker_state["metadata"] = load_formatted_entry(shared_data)
+    else:
+        data, _worker_state["metadata"] = shared_data
+        _worker_state["data"] = jax.device_put(data)
+    _worker_state["pca"] = pca
+    _worker_state["shared_start"] = shared_start
+    _worker_state["manifest"] = manifest
+
+
+def _fit_kappa_in_worker(kappa, *fit_args):
+    return fit_kappa(
+        kappa,
+        _worker_state["data"],
+        _worker_state["metadata"],
+        _worker_state["pca"],
+        *fit_args,
+        shared_start=_worker_state["shared_start"],
+        manifest=_worker_state["manifest"],
+    )
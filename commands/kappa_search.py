@@ -0,0 +1,183 @@
+import os
+import time
+
+import h5py
+import keypoint_moseq as kpms  # type: ignore
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+
+from commands.kappa_scan import SharedStart, fit_kappa
+from utils.print_legal import print_legal
+from utils.project_context import ProjectContext
+
+# Fração do intervalo (em log10(kappa)) entre a nova sonda e as pontas do intervalo: evita que a
+# interpolação fique presa perto de uma das pontas
+MIN_STEP_FRACTION = 0.1
+
+
+def kappa_search(
+    project_dir,
+    target_duration=12,
+    tolerance=0.1,
+    kappa_log_start=3,
+    kappa_log_end=7,
+    decrease_kappa_factor=10,
+    num_ar_iters=50,
+    num_iters=50,
+    max_probes=8,
+    config_overrides=None,
+):
+    """Procura o kappa cuja mediana da duração das sílabas é `target_duration` (em frames).
+
+    Cada sonda é um ajuste curto como os do `kappa_scan` (`num_ar_iters` iterações AR e
+    `num_iters` do modelo keypoint, todas partindo da mesma inicialização). As primeiras sondas
+    são as pontas de [10^kappa_log_start, 10^kappa_log_end]; se a duração alvo não estiver entre
+    as durações delas, o intervalo é estendido para o lado certo (se a duração cresce com o kappa
+    entre as pontas; senão o intervalo só é bisseccionado). Depois o intervalo é reduzido
+    interpolando log(duração) em log10(kappa) (com bisseção como salvaguarda), até uma sonda ficar
+    a menos de `tolerance` (relativo) da duração alvo ou até `max_probes` sondas.
+
+    As sondas ficam em `{project_dir}/kappa_search_<alvo>_<fator>-<kappa>`, e a trajetória (kappa,
+    duração e tempo de cada sonda) em `{project_dir}/kappa_search_<alvo>_<fator>.csv` e `.png`.
+    """
+    prefix = f"kappa_search_{target_duration}_{decrease_kappa_factor}"
+    trajectory_path = os.path.join(project_dir, f"{prefix}.csv")
+
+    project = ProjectContext(project_dir, config_overrides=config_overrides)
+    data, metadata, config = project.data, project.metadata, project.config
+    pca = kpms.load_pca(project_dir)
+    mask = np.asarray(data["mask"])
+
+    print_legal(
+        f"Procurando kappa com mediana da duração das sílabas de {target_duration} frames "
+        f"(tolerância {tolerance:.0%}, no máximo {max_probes} sondas)"
+    )
+    shared_start = SharedStart.fit(
+        data, metadata, pca, config, project_dir, prefix, [10**kappa_log_start, 10**kappa_log_end]
+    )
+
+    trajectory = []
+
+    def probe(log_kappa):
+        kappa = 10**log_kappa
+        start_time = time.perf_counter()
+        model_name = fit_kappa(
+            kappa,
+            data,
+            metadata,
+            pca,
+            config,
+            project_dir,
+            prefix,
+            decrease_kappa_factor,
+            num_ar_iters,
+            num_iters,
+            shared_start=shared_start,
+        )
+        duration = get_median_duration(project_dir, model_name, mask)
+        trajectory.append(
+            {
+                "probe": len(trajectory) + 1,
+                "kappa": kappa,
+                "log10_kappa": log_kappa,
+                "median_duration": duration,
+                "seconds": time.perf_counter() - start_time,
+                "model_name": model_name,
+            }
+        )
+        pd.DataFrame(trajectory).to_csv(trajectory_path, index=False)
+        print_legal(f"Sonda {len(trajectory)}: kappa={kappa:.4g}, mediana da duração {duration:.1f} frames")
+        return duration
+
+    def converged(duration):
+        return abs(duration - target_duration) <= tolerance * target_duration
+
+    def done():
+        return len(trajectory) >= max_probes or any(converged(p["median_duration"]) for p in trajectory)
+
+    def bracketed():
+        return min(duration_lo, duration_hi) <= target_duration <= max(duration_lo, duration_hi)
+
+    lo, hi = float(kappa_log_start), float(kappa_log_end)
+    duration_lo = probe(lo)
+    duration_hi = None if done() else probe(hi)
+
+    # Estende o intervalo até a duração alvo ficar entre as durações das pontas; só se as durações
+    # crescem com o kappa, senão não se sabe para que lado estender e o intervalo é só bisseccionado
+    while not done() and not bracketed() and duration_lo < duration_hi:
+        width = hi - lo
+        if target_duration < duration_lo:
+            hi, duration_hi = lo, duration_lo
+            lo = lo - width
+            duration_lo = probe(lo)
+        else:
+            lo, duration_lo = hi, duration_hi
+            hi = hi + width
+            duration_hi = probe(hi)
+
+    # Reduz o intervalo, trocando a ponta cuja duração fica do mesmo lado da duração alvo que a da sonda
+    while not done():
+        log_kappa = next_log_kappa(lo, hi, duration_lo, duration_hi, target_duration)
+        duration = probe(log_kappa)
+        if (duration < target_duration) == (duration_lo < target_duration):
+            lo, duration_lo = log_kappa, duration
+        else:
+            hi, duration_hi = log_kappa, duration
+
+    best = min(trajectory, key=lambda p: abs(p["median_duration"] - target_duration))
+    fig = plot_trajectory(trajectory, target_duration, tolerance)
+    fig.savefig(os.path.join(project_dir, f"{prefix}.png"))
+    plt.close(fig)
+
+    if converged(best["median_duration"]):
+        print_legal(f"Kappa encontrado em {len(trajectory)} sondas: {best['kappa']:.4g}")
+    else:
+        print_legal(
+            f"Nenhuma sonda ficou dentro da tolerância em {len(trajectory)} sondas; a mais próxima foi "
+            f"kappa={best['kappa']:.4g} ({best['median_duration']:.1f} frames)",
+            type="warn",
+        )
+    print_legal(
+        f"Use kappa={best['kappa']:.4g} no modelo AR e kappa={best['kappa'] / decrease_kappa_factor:.4g} "
+        f"no modelo keypoint (trajetória em {trajectory_path})"
+    )
+    return best["kappa"]
+
+
+def next_log_kappa(lo, hi, duration_lo, duration_hi, target_duration):
+    """Próxima sonda dentro do intervalo [lo, hi] (log10 do kappa).
+
+    Interpola linearmente as log-durações das pontas (a mediana da duração cresce mais ou menos
+    como uma potência do kappa), mantendo a sonda a pelo menos `MIN_STEP_FRACTION` do intervalo
+    de cada ponta; usa o ponto médio se as durações das pontas não crescem com o kappa.
+    """
+    if duration_hi <= duration_lo:
+        return (lo + hi) / 2
+    fraction = (np.log(target_duration) - np.log(duration_lo)) / (np.log(duration_hi) - np.log(duration_lo))
+    fraction = float(np.clip(fraction, MIN_STEP_FRACTION, 1 - MIN_STEP_FRACTION))
+    return lo + fraction * (hi - lo)
+
+
+def get_median_duration(project_dir, model_name, mask):
+    """Mediana da duração das sílabas (em frames) no último snapshot do checkpoint do modelo."""
+    with h5py.File(os.path.join(project_dir, model_name, "checkpoint.h5"), "r") as f:
+        last_iteration = max(int(i) for i in f["model_snapshots"])
+        z = f[f"model_snapshots/{last_iteration}/states/z"][()]
+    return float(np.median(kpms.get_durations(z, mask)))
+
+
+def plot_trajectory(trajectory, target_duration, tolerance):
+    fig, ax = plt.subplots(figsize=(5, 3))
+    kappas = [p["kappa"] for p in trajectory]
+    durations = [p["median_duration"] for p in trajectory]
+    ax.axhspan(target_duration * (1 - tolerance), target_duration * (1 + tolerance), color="gray", alpha=0.2)
+    ax.axhline(target_duration, color="gray", linestyle="--")
+    ax.plot(kappas, durations, color="lightgray", zorder=1)
+    points = ax.scatter(kappas, durations, c=range(1, len(trajectory) + 1), cmap="viridis", zorder=2)
+    fig.colorbar(points, ax=ax, label="sonda")
+    ax.set_xscale("log")
+    ax.set_xlabel("kappa")
+    ax.set_ylabel("mediana da duração (frames)")
+    fig.tight_layout()
+    return fig
@@ -1,13 +1,14 @@
 import keypoint_moseq as kpms # type: ignore
 from utils.print_legal import print_legal
-from utils.load_data_and_config import load_keypoints, load_config
+from utils.project_context import ProjectContext
 
 
 def noise_calibration(project_dir):
     """Calibra o ruído do modelo em um widget interativo."""
 
-    config = load_config(project_dir)
-    coordinates, confidences, bodyparts = load_keypoints(project_dir)
+    project = ProjectContext(project_dir)
+    config = project.config
+    coordinates, confidences, bodyparts = project.raw_keypoints
 
     print_legal(f"Iniciando calibração de ruído para o projeto: {project_dir}")
 
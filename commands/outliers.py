@@ -1,76 +1,156 @@
-import keypoint_moseq as kpms  # type: ignore
 import numpy as np
+import multiprocessing
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from scipy.ndimage import median_filter
-from utils.load_data_and_config import load_data_and_config
-from utils.find_medoid_distance_outliers import filter_outliers, plot_medoid_distance_outliers, plot_keypoint_distance_outliers
+from utils.project_context import ProjectContext
+from utils.find_medoid_distance_outliers import filter_outliers, plot_recording_outliers, get_outlier_detection_params, get_outlier_cache_params
+from utils.outlier_cache import hash_arrays
+from utils.outlier_summary import OutlierSummaryTable, summarize_outliers
 from utils.print_legal import print_legal
 from os import path
 
+DETECTOR_LABELS = {
+    "medoid": "Medoid distance",
+    "velocity": "Velocity",
+    "keypoint_distance": "Keypoint distance",
+    "combined": "Combined",
+}
 
-def outliers(project_dir):
-    data, metadata, config, coordinates, _, confidences = load_data_and_config(
-        project_dir, remove_outliers=False
-    )
 
-    coordinates, confidences, outliers = filter_outliers(
-        coordinates,
-        confidences,
-        config,
-        lambda coordinates, confidences, combined_outliers, recording_name, raw_coords: plot_outliers(
-            project_dir, config, coordinates, confidences, combined_outliers, recording_name, raw_coords
-        ),
-        project_dir=project_dir,
+def outliers(project_dir, plot_workers=1):
+    # Só as coordenadas cortadas; os dados formatados não são usados aqui (nem o JAX)
+    project = ProjectContext(project_dir, remove_outliers=False, build_indexes=False)
+    config, coordinates, confidences = project.config, project.coordinates, project.confidences
+
+    # Linhas da tabela só são recalculadas se as coordenadas ou os parâmetros mudaram
+    summary = OutlierSummaryTable(project_dir)
+    cache_params = get_outlier_cache_params(config, get_outlier_detection_params(config))
+    plot_jobs = OutlierPlotJobs(project_dir, config, plot_workers)
+
+    def on_recording_filtered(coordinates, confidences, combined_outliers, recording_name, raw_coords):
+        key = hash_arrays(raw_coords, params=cache_params)
+        if not summary.is_current(recording_name, key):
+            bodyparts = config.get("bodyparts")
+            if bodyparts is not None and len(bodyparts) != raw_coords.shape[1]:
+                bodyparts = None
+            summary.update(recording_name, key, summarize_outliers(recording_name, combined_outliers, bodyparts))
+        print_keypoint_distance_outlier_summary(recording_name, summary.rows(recording_name))
+        plot_jobs.plot_outliers(coordinates, confidences, combined_outliers, recording_name, raw_coords)
+
+    with plot_jobs:
+        coordinates, confidences, outliers = filter_outliers(
+            coordinates,
+            confidences,
+            config,
+            on_recording_filtered,
+            project_dir=project_dir,
+        )
+
+    summary.save(list(coordinates))
+    print_legal(
+        f"Tabela de outliers salva em {summary.path} "
+        f"({len(summary.updated)} de {len(coordinates)} gravações recalculadas)"
     )
+    plot_jobs.print_timing_summary()
+
+
+class OutlierPlotJobs:
+    """Renders the QA plots of each recording as soon as its outliers are filtered.
+
+    With `plot_workers > 1` the plots go to a process pool (spawn, so the workers do not
+    inherit the JAX threads) and the filtering of the next recording continues meanwhile; at
+    most 2 * plot_workers recordings wait in the pool. With 1 worker the plots are drawn in
+    this process, one recording at a time, as before.
+    """
+
+    def __init__(self, project_dir, config, plot_workers=1):
+        self.project_dir = project_dir
+        self.config = config
+        self.plot_workers = plot_workers or 1
+        self.executor = None
+        self.pending = deque()
+        self.filter_times = {}
+        self.plot_times = {}
+        self.last_time = None
+
+    def __enter__(self):
+        if self.plot_workers > 1:
+            print_legal(f"Gerando os gráficos de outliers com {self.plot_workers} processos")
+            os.environ.setdefault("MPLBACKEND", "Agg")
+            self.executor = ProcessPoolExecutor(
+                max_workers=self.plot_workers, mp_context=multiprocessing.get_context("spawn")
+            )
+        self.start_time = self.last_time = time.perf_counter()
+        return self
 
+    def __exit__(self, *exc_info):
+        if self.executor is not None:
+            while self.pending:
+                self._collect_oldest()
+            self.executor.shutdown()
+        self.total_time = time.perf_counter() - self.start_time
+
+    def plot_outliers(self, coordinates, confidences, combined_outliers, recording_name, raw_coords):
+        now = time.perf_counter()
+        self.filter_times[recording_name] = now - self.last_time
+
+        args = (
+            self.project_dir,
+            recording_name,
+            raw_coords,
+            coordinates[recording_name],
+            combined_outliers,
+            self.config,
+        )
+        if self.executor is None:
+            self.plot_times[recording_name] = plot_recording_outliers(*args)
+        else:
+            while len(self.pending) >= 2 * self.plot_workers:
+                self._collect_oldest()
+            self.pending.append((recording_name, self.executor.submit(plot_recording_outliers, *args)))
+
+        self.last_time = time.perf_counter()
+
+    def _collect_oldest(self):
+        recording_name, future = self.pending.popleft()
+        self.plot_times[recording_name] = future.result()
+
+    def print_timing_summary(self):
+        print(f"\n=== Tempo por gravação ({self.plot_workers} processo(s) de gráficos) ===")
+        print(f"{'Gravação':<40} {'Filtro (s)':>10} {'Gráficos (s)':>12}")
+        for recording_name, filter_time in self.filter_times.items():
+            plot_time = self.plot_times.get(recording_name, float("nan"))
+            print(f"{recording_name:<40} {filter_time:>10.2f} {plot_time:>12.2f}")
+        print(
+            f"Total: {self.total_time:.2f}s, filtro {sum(self.filter_times.values()):.2f}s, "
+            f"gráficos {sum(self.plot_times.values()):.2f}s"
+        )
+        print("=" * 60)
+
+
+def print_keypoint_distance_outlier_summary(recording_name, rows):
+    """Print the rows of one recording of the outlier table (see `summarize_outliers`)."""
+    n_frames = int(rows["n_frames"].iloc[0])
+    keypoints = rows["keypoint"].unique()
+    total_keypoints = n_frames * len(keypoints)
 
-def plot_outliers(
-    project_dir, config, coordinates, confidences, combined_outliers, recording_name, raw_coords
-):
-    # plot_medoid_distance_outliers(
-    #     project_dir,
-    #     recording_name,
-    #     raw_coords,
-    #     coordinates[recording_name],
-    #     combined_outliers["medoid_outliers"]["mask"],
-    #     combined_outliers["medoid_thresholds"],
-    #     **config
-    # )
-    print_keypoint_distance_outlier_summary(recording_name, combined_outliers)
-
-
-def print_keypoint_distance_outlier_summary(recording_name, combined_outliers):
-    medoid_mask = combined_outliers["medoid_outliers"]["mask"]
-    keypoint_distance_mask = combined_outliers["keypoint_distance_outliers"]["mask"]
-    combined_mask = combined_outliers["mask"]
-    
-    n_frames, n_keypoints = medoid_mask.shape
-    total_keypoints = n_frames * n_keypoints
-    
-    medoid_outliers = np.sum(medoid_mask)
-    keypoint_distance_outliers = np.sum(keypoint_distance_mask)
-    combined_outliers_count = np.sum(combined_mask)
-    
-    medoid_percentage = (medoid_outliers / total_keypoints) * 100
-    keypoint_distance_percentage = (keypoint_distance_outliers / total_keypoints) * 100
-    combined_percentage = (combined_outliers_count / total_keypoints) * 100
-    
     print(f"\n=== Outliers para {recording_name} ===")
-    print(f"Keypoints: {total_keypoints:,} ({n_frames:,} frames x {n_keypoints} keypoints)")
-    print(f"Medoid distance outliers: {medoid_outliers:,} ({medoid_percentage:.2f}%)")
-    print(f"Keypoint distance outliers: {keypoint_distance_outliers:,} ({keypoint_distance_percentage:.2f}%)")
-    print(f"Combined outliers: {combined_outliers_count:,} ({combined_percentage:.2f}%)")
-    
-    for i in range(n_keypoints):
-        keypoint_medoid = np.sum(medoid_mask[:, i])
-        keypoint_distance = np.sum(keypoint_distance_mask[:, i])
-        keypoint_combined = np.sum(combined_mask[:, i])
-        
-        medoid_pct = (keypoint_medoid / n_frames) * 100
-        distance_pct = (keypoint_distance / n_frames) * 100
-        combined_pct = (keypoint_combined / n_frames) * 100
-        
-        print(f"  Keypoint {i}: Medoid={keypoint_medoid:,} ({medoid_pct:.1f}%), "
-              f"Distance={keypoint_distance:,} ({distance_pct:.1f}%), "
-              f"Combined={keypoint_combined:,} ({combined_pct:.1f}%)")
-    
-    print("=" * 60)
\ No newline at end of file
+    print(f"Keypoints: {total_keypoints:,} ({n_frames:,} frames x {len(keypoints)} keypoints)")
+    totals = rows.groupby("detector", sort=False)["n_outliers"].sum()
+    for detector, count in totals.items():
+        print(f"{DETECTOR_LABELS.get(detector, detector)} outliers: {count:,} ({(count / total_keypoints) * 100:.2f}%)")
+
+    for keypoint, keypoint_rows in rows.groupby("keypoint", sort=False):
+        print(
+            f"  Keypoint {keypoint}: "
+            + ", ".join(
+                f"{DETECTOR_LABELS.get(row.detector, row.detector)}={row.n_outliers:,} "
+                f"({row.outlier_percentage:.1f}%, max run {row.longest_run})"
+                for row in keypoint_rows.itertuples()
+            )
+        )
+
+    print("=" * 60)
@@ -1,5 +1,5 @@
 import keypoint_moseq as kpms  # type: ignore
-from utils.load_data_and_config import load_data_and_config
+from utils.project_context import ProjectContext
 from utils.print_legal import print_legal
 
 
@@ -10,9 +10,10 @@ def results(
     load_results=False,
     config_overrides=None,
 ):
-    _, _, config, coordinates, video_frame_indexes, _ = load_data_and_config(project_dir)
-    if config_overrides:
-        config.update(config_overrides)
+    project = ProjectContext(project_dir, config_overrides=config_overrides)
+    config = project.config
+    coordinates = project.coordinates
+    video_frame_indexes = project.video_frame_indexes
 
 
     if load_results:
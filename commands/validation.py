@@ -13,7 +13,7 @@ from sklearn.metrics import precision_score, recall_score, f1_score, accuracy_sc
 
 from utils.load_data_and_config import load_config
 from utils.print_legal import print_legal
-from utils.video_frame_indexes import skip_frames_in_array, start_frames_to_skip, end_frames_to_skip
+from utils.video_frame_indexes import FrameWindows
 
 rearing_csvs_path = "./data/rearing_csv"
 generate_movies = False
@@ -26,6 +26,7 @@ def validation(project_dir, model_name):
 
     config = load_config(project_dir)
     video_dirs = config["video_dir"]
+    frame_windows = FrameWindows.from_config(config)
 
     for recording_name, recording in results.items():
         file_path = find_csv_file(recording_name)
@@ -34,7 +35,7 @@ def validation(project_dir, model_name):
         print_legal(f"Arquivo encontrado: {file_path}")
 
         syllable = recording["syllable"]
-        rearing = get_rearing_data(file_path)
+        rearing = frame_windows.window(recording_name, get_rearing_data(file_path))
 
         syllables_rearing, syllables_non_rearing = get_syllables_by_rearing(syllable, rearing)
         all_syllables_rearing.extend(syllables_rearing)
@@ -44,7 +45,7 @@ def validation(project_dir, model_name):
             video_path = get_video_path(recording_name, video_dirs)
             if video_path is not None:
                 generate_syllable_rearing_movies(
-                    syllable, rearing, video_path, recording_name, project_dir, model_name
+                    syllable, rearing, video_path, recording_name, project_dir, model_name, frame_windows
                 )
 
     analyze_syllable_patterns(all_syllables_rearing, all_syllables_non_rearing)
@@ -75,7 +76,7 @@ def get_rearing_data(file_path):
         for row in reader:
             rearing_data.append(int(row[0]))
         rearing_data = np.array(rearing_data)
-    return skip_frames_in_array(rearing_data)
+    return rearing_data
 
 
 def get_syllables_by_rearing(syllable, rearing):
@@ -145,7 +146,7 @@ def analyze_syllable_patterns(syllables_rearing, syllables_non_rearing):
 
 
 def generate_syllable_rearing_movies(
-    syllable, rearing, video_path, recording_name, project_dir, model_name
+    syllable, rearing, video_path, recording_name, project_dir, model_name, frame_windows
 ):
     output_dir = Path(project_dir) / model_name / "syllable_rearing_movies"
     output_dir.mkdir(parents=True, exist_ok=True)
@@ -163,15 +164,16 @@ def generate_syllable_rearing_movies(
     width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
     height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
     total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    frames = frame_windows.frame_range(recording_name, total_frames)
 
-    for _ in range(start_frames_to_skip):
+    for _ in range(frames.start):
         ret, _ = cap.read()
         if not ret:
-            print_legal(f"Erro: Não foi possível pular {start_frames_to_skip} frames iniciais")
+            print_legal(f"Erro: Não foi possível pular {frames.start} frames iniciais")
             cap.release()
             return
 
-    min_length = min(len(syllable), len(rearing), total_frames - start_frames_to_skip)
+    min_length = min(len(syllable), len(rearing), len(frames))
     syllable = syllable[:min_length]
     rearing = rearing[:min_length]
 
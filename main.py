@@ -1,104 +1,159 @@
 # Baseado em https://keypoint-moseq.readthedocs.io/en/latest/modeling.html
-from utils.args import build_parser, parser, get_arg
-from commands import init_project, fit_pca, fit_arhmm, fit_keypoint, kappa_scan, kappa_scan_metrics, results, outliers, validation, apply, stats
-from jax_moseq.utils import set_mixed_map_iters
-import matplotlib.pyplot as plt
-import matplotlib
-matplotlib.use('Agg')
+import os
+
+# Backend sem janela antes de qualquer import do matplotlib
+os.environ.setdefault("MPLBACKEND", "Agg")
+
+import time
+
+import commands
+from utils.args import build_parser, parser, get_args
+from utils.import_timing import ImportTimer
+from utils.worker_env import get_gpu_memory_env
+
+# Comando -> (função em `commands.COMMAND_MODULES`, argumentos a partir da linha de comando, usa JAX)
+COMMANDS = {
+    "init": ("init_project", lambda args: dict(project_dir=args.project_dir), False),
+    "outliers": (
+        "outliers",
+        lambda args: dict(project_dir=args.project_dir, plot_workers=args.plot_workers),
+        False,
+    ),
+    "fit_pca": ("fit_pca", lambda args: dict(project_dir=args.project_dir, config_overrides={}), False),
+    "kappa_scan": (
+        "kappa_scan",
+        lambda args: dict(
+            project_dir=args.project_dir,
+            model_name=args.model_name,
+            kappa_log_start=args.kappa_log_start,
+            kappa_log_end=args.kappa_log_end,
+            num_kappas=args.num_kappas,
+            decrease_kappa_factor=args.decrease_kappa_factor,
+            num_ar_iters=args.num_ar_iters,
+            num_iters=args.iters,
+            config_overrides={},
+            scan_workers=args.scan_workers,
+            threads_per_worker=args.threads_per_worker,
+            shared_init=args.shared_init,
+            shared_ar_iters=args.shared_ar_iters,
+            early_stopping=args.early_stopping,
+        ),
+        True,
+    ),
+    "kappa_search": (
+        "kappa_search",
+        lambda args: dict(
+            project_dir=args.project_dir,
+            target_duration=args.target_duration,
+            tolerance=args.tolerance,
+            kappa_log_start=args.kappa_log_start,
+            kappa_log_end=args.kappa_log_end,
+            decrease_kappa_factor=args.decrease_kappa_factor,
+            num_ar_iters=args.num_ar_iters,
+            num_iters=args.iters,
+            max_probes=args.max_probes,
+            config_overrides={},
+        ),
+        True,
+    ),
+    "kappa_scan_metrics": (
+        "kappa_scan_metrics",
+        lambda args: dict(project_dir=args.project_dir),
+        True,
+    ),
+    "fit_arhmm": (
+        "fit_arhmm",
+        lambda args: dict(
+            project_dir=args.project_dir,
+            model_name=args.model_name,
+            iters=args.iters,
+            kappa=args.kappa,
+            config_overrides={},
+            early_stopping=args.early_stopping,
+        ),
+        True,
+    ),
+    "fit_keypoint": (
+        "fit_keypoint",
+        lambda args: dict(
+            project_dir=args.project_dir,
+            model_name=args.model_name,
+            checkpoint=args.checkpoint,
+            iters=args.iters,
+            kappa=args.kappa,
+            config_overrides={},
+            early_stopping=args.early_stopping,
+        ),
+        True,
+    ),
+    "fit_full_model": (
+        "fit_full_model",
+        lambda args: dict(
+            project_dir=args.project_dir,
+            model_name=args.model_name,
+            ar_iters=args.ar_iters,
+            ar_kappa=args.ar_kappa,
+            iters=args.iters,
+            kappa=args.kappa,
+            config_overrides={},
+            early_stopping=args.early_stopping,
+        ),
+        True,
+    ),
+    "results": (
+        "results",
+        lambda args: dict(
+            project_dir=args.project_dir,
+            model_name=args.model_name,
+            checkpoint=args.checkpoint,
+            load_results=args.load_results,
+            config_overrides={},
+        ),
+        True,
+    ),
+    "validation": (
+        "validation",
+        lambda args: dict(project_dir=args.project_dir, model_name=args.model_name),
+        False,
+    ),
+    "apply": ("apply", lambda args: dict(project_dir=args.project_dir, model_name=args.model_name), True),
+    "stats": ("stats", lambda args: dict(project_dir=args.project_dir, model_name=args.model_name), False),
+}
+
 
 def main():
+    start_time = time.perf_counter()
     build_parser()
+    args = get_args()
+    parse_time = time.perf_counter() - start_time
 
-    config_overrides = {}
+    if args.command not in COMMANDS:
+        print(f"Comando desconhecido: {args.command}")
+        parser.print_help()
+        return
 
-    command = get_arg('command')
-    project_dir = get_arg('project_dir')
-    model_name = get_arg('model_name')
-    num_ar_iters = get_arg('num_ar_iters')
-    checkpoint = get_arg('checkpoint')
-    iters = get_arg('iters')
-    ar_iters = get_arg('ar_iters')
-    kappa = get_arg('kappa')
-    ar_kappa = get_arg('ar_kappa')
-    kappa_log_start = get_arg('kappa_log_start')
-    kappa_log_end = get_arg('kappa_log_end')
-    num_kappas = get_arg('num_kappas')
-    decrease_kappa_factor = get_arg('decrease_kappa_factor')
-    mixed_map_iters = get_arg('mixed_map_iters')
-    load_results = get_arg('load_results')
+    function_name, get_kwargs, uses_jax = COMMANDS[args.command]
 
-    set_mixed_map_iters(mixed_map_iters)
+    # No scan paralelo este processo divide a GPU com os workers; o limite tem que valer antes do primeiro uso do JAX
+    if args.command == "kappa_scan" and args.scan_workers > 1:
+        os.environ.update(get_gpu_memory_env(args.scan_workers))
 
-    if command == "init":
-        init_project(project_dir=project_dir)
-    elif command == "outliers":
-        outliers(project_dir=project_dir)
-    elif command == "fit_pca":
-        fit_pca(project_dir=project_dir, config_overrides=config_overrides)
-    elif command == "kappa_scan":
-        kappa_scan(
-            project_dir=project_dir,
-            model_name=model_name,
-            kappa_log_start=kappa_log_start,
-            kappa_log_end=kappa_log_end,
-            num_kappas=num_kappas,
-            decrease_kappa_factor=decrease_kappa_factor,
-            num_ar_iters=num_ar_iters,
-            num_iters=iters,
-            config_overrides=config_overrides,
-        )
-    elif command == "kappa_scan_metrics":
-        kappa_scan_metrics(project_dir=project_dir)
-    elif command == "fit_arhmm":
-        fit_arhmm(
-            project_dir=project_dir,
-            model_name=model_name,
-            iters=iters,
-            kappa=kappa,
-            config_overrides=config_overrides,
-        )
-    elif command == "fit_keypoint":
-        fit_keypoint(
-            project_dir=project_dir,
-            model_name=model_name,
-            checkpoint=checkpoint,
-            iters=iters,
-            kappa=kappa,
-            config_overrides=config_overrides,
-        )
-    elif command == "fit_full_model":
-        fit_arhmm(
-            project_dir=project_dir,
-            model_name=model_name,
-            iters=ar_iters,
-            kappa=ar_kappa,
-            config_overrides=config_overrides,
-        )
-        fit_keypoint(
-            project_dir=project_dir,
-            model_name=model_name,
-            checkpoint=ar_iters,
-            iters=iters,
-            kappa=kappa,
-            config_overrides=config_overrides,
-        )
-    elif command == "results":
-        results(
-            project_dir=project_dir,
-            model_name=model_name,
-            checkpoint=checkpoint,
-            load_results=load_results,
-            config_overrides=config_overrides,
-        )
-    elif command == "validation":
-        validation(project_dir=project_dir, model_name=model_name)
-    elif command == "apply":
-        apply(project_dir=project_dir, model_name=model_name)
-    elif command == "stats":
-        stats(project_dir=project_dir, model_name=model_name)
-    else:
-        print(f"Comando desconhecido: {command}")
-        parser.print_help()
+    # Só o módulo do comando escolhido (e suas dependências) é importado
+    with ImportTimer() as import_timer:
+        command = getattr(commands, function_name)
+        if uses_jax:
+            from jax_moseq.utils import set_mixed_map_iters
+
+            set_mixed_map_iters(args.mixed_map_iters)
+
+    if args.timing:
+        print(f"=== Inicialização de {args.command} ===")
+        print(f"Leitura dos argumentos: {parse_time:.3f}s")
+        print(import_timer.report())
+        print(f"Total até o comando: {time.perf_counter() - start_time:.3f}s")
+        print("=" * 42)
+
+    command(**get_kwargs(args))
 
 
 if __name__ == "__main__":
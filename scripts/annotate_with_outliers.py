@@ -7,16 +7,18 @@ import numpy as np
 from tqdm import tqdm
 import os
 import sys
-import keypoint_moseq as kpms
+import yaml
 from typing import Optional, Tuple, Dict, Any
 
 # Add the parent directory to the path to import our utils
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from utils.find_medoid_distance_outliers import (
-    find_medoid_distance_outliers, 
-    find_keypoint_distance_outliers,
-    get_distance_to_medoid
+    detect_outliers,
+    get_distance_to_medoid,
+    get_outlier_detection_params,
 )
+from utils.interpolation import interpolate_keypoints
+from utils.video_frame_indexes import FrameWindows
 
 
 def load_dlc_csv(csv_path):
@@ -108,50 +110,28 @@ def load_dlc_csv(csv_path):
         return coords, names
 
 
-def apply_outlier_filtering(coords: np.ndarray, 
-                          outlier_scale_factor: float = 6.0,
-                          use_keypoint_distance_outliers: bool = True,
-                          keypoint_distance_outlier_scale_factor: float = 6.0,
-                          keypoint_distance_outlier_threshold_percentage: float = 0.5) -> Tuple[np.ndarray, Dict[str, Any]]:
+def apply_outlier_filtering(coords: np.ndarray,
+                          config: Optional[dict] = None,
+                          **detection_overrides) -> Tuple[np.ndarray, Dict[str, Any]]:
     """
-    Apply outlier filtering to keypoint coordinates.
+    Apply outlier filtering to keypoint coordinates, with the same detectors as the pipeline
+    (`detect_outliers`): the `use_*_outliers` switches and parameters come from `config`
+    (config.yml of the project), with the non-None `detection_overrides` on top.
     
     Returns:
         filtered_coords: numpy array with outliers interpolated
-        outlier_info: dictionary containing outlier masks and statistics
+        outlier_info: result of `find_outliers` (combined mask and one entry per detector)
     """
+    config = config or {}
     # Extract x,y coordinates (first 2 dimensions)
     coordinates_xy = coords[:, :, :2]  # (n_frames, n_keypoints, 2)
     
-    # Find medoid distance outliers
-    medoid_outliers = find_medoid_distance_outliers(
-        coordinates_xy, outlier_scale_factor=outlier_scale_factor
-    )
-    
-    if use_keypoint_distance_outliers:
-        # Find keypoint-to-keypoint distance outliers
-        keypoint_distance_outliers = find_keypoint_distance_outliers(
-            coordinates_xy,
-            outlier_scale_factor=keypoint_distance_outlier_scale_factor,
-            outlier_threshold_percentage=keypoint_distance_outlier_threshold_percentage,
-        )
-        
-        # Combine outlier masks (OR operation)
-        combined_mask = medoid_outliers["mask"] | keypoint_distance_outliers["mask"]
-        
-        outlier_info = {
-            "mask": combined_mask,
-            "medoid_thresholds": medoid_outliers["thresholds"],
-            "keypoint_distance_thresholds": keypoint_distance_outliers["thresholds"],
-            "medoid_outliers": medoid_outliers,
-            "keypoint_distance_outliers": keypoint_distance_outliers,
-        }
-    else:
-        combined_mask = medoid_outliers["mask"]
-        outlier_info = medoid_outliers
+    detection_params = get_outlier_detection_params(config, **detection_overrides)
+    outlier_info = detect_outliers(coordinates_xy, config, **detection_params)
+    combined_mask = outlier_info["mask"]
     
-    # Interpolate outliers using keypoint-moseq
-    filtered_coords = kpms.interpolate_keypoints(coordinates_xy, combined_mask)
+    # Interpolate outliers (same result as kpms.interpolate_keypoints)
+    filtered_coords = interpolate_keypoints(coordinates_xy, combined_mask)
     
     # Add back the likelihood dimension
     filtered_coords_with_likelihood = np.zeros_like(coords)
@@ -175,26 +155,27 @@ def create_side_by_side_video(video_path: str,
                              thickness: int = 2,
                              fps_out: Optional[float] = None,
                              draw_names: bool = False,
-                             outlier_scale_factor: float = 6.0,
-                             use_keypoint_distance_outliers: bool = True,
-                             keypoint_distance_outlier_scale_factor: float = 6.0,
-                             keypoint_distance_outlier_threshold_percentage: float = 0.5):
+                             config: Optional[dict] = None,
+                             frame_windows: Optional[FrameWindows] = None,
+                             **detection_overrides):
     """
     Create a side-by-side video showing original vs outlier-filtered keypoints.
+    The outliers are detected as in the pipeline, from `config` and `detection_overrides`
+    (see `apply_outlier_filtering`).
+    With `frame_windows`, only the frames kept for the recording (as in the model) are used.
     """
     print("Loading DLC CSV data...")
     coords, names = load_dlc_csv(csv_path)
+    first_frame = 0
+    if frame_windows is not None:
+        recording_name = os.path.splitext(os.path.basename(csv_path))[0]
+        first_frame = frame_windows.frame_range(recording_name, len(coords)).start
+        coords = frame_windows.window(recording_name, coords)
     n_frames_csv = coords.shape[0]
     n_kp = coords.shape[1]
     
     print("Applying outlier filtering...")
-    filtered_coords, outlier_info = apply_outlier_filtering(
-        coords,
-        outlier_scale_factor=outlier_scale_factor,
-        use_keypoint_distance_outliers=use_keypoint_distance_outliers,
-        keypoint_distance_outlier_scale_factor=keypoint_distance_outlier_scale_factor,
-        keypoint_distance_outlier_threshold_percentage=keypoint_distance_outlier_threshold_percentage
-    )
+    filtered_coords, outlier_info = apply_outlier_filtering(coords, config, **detection_overrides)
     
     # Print outlier statistics
     outlier_mask = outlier_info["mask"]
@@ -213,7 +194,9 @@ def create_side_by_side_video(video_path: str,
     fps = cap.get(cv2.CAP_PROP_FPS)
     w = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
     h = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT)) - first_frame
+    if first_frame:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, first_frame)
     
     if fps_out is None:
         fps_out = fps
@@ -338,18 +321,25 @@ def main():
     parser.add_argument("--draw-names", action="store_true", help="Draw keypoint names")
     parser.add_argument("--skeleton", default=None, help="Skeleton pairs as comma-separated pairs (e.g., 'nose-neck,neck-Lshoulder')")
     
-    # Outlier detection parameters
-    parser.add_argument("--outlier-scale-factor", type=float, default=6.0, 
+    # Outlier detection parameters (default: config.yml of --project-dir, then the pipeline defaults)
+    parser.add_argument("--outlier-scale-factor", type=float, default=None, 
                        help="Scale factor for medoid distance outlier detection")
     parser.add_argument("--no-keypoint-distance-outliers", action="store_true",
                        help="Disable keypoint-to-keypoint distance outlier detection")
-    parser.add_argument("--keypoint-distance-scale-factor", type=float, default=6.0,
+    parser.add_argument("--keypoint-distance-scale-factor", type=float, default=None,
                        help="Scale factor for keypoint distance outlier detection")
-    parser.add_argument("--keypoint-distance-threshold-percentage", type=float, default=0.5,
+    parser.add_argument("--keypoint-distance-threshold-percentage", type=float, default=None,
                        help="Percentage threshold for keypoint distance outliers")
+    parser.add_argument("--project-dir", default=None,
+                       help="Project whose config.yml (frame trims and outlier detection) is applied to the CSV and the video")
     
     args = parser.parse_args()
     
+    config = None
+    if args.project_dir:
+        with open(os.path.join(args.project_dir, "config.yml")) as f:
+            config = yaml.safe_load(f) or {}
+
     skeleton_pairs = None
     if args.skeleton:
         skeleton_pairs = [tuple(p.split('-')) for p in args.skeleton.split(',')]
@@ -363,10 +353,12 @@ def main():
         point_radius=args.radius,
         thickness=args.thickness,
         draw_names=args.draw_names,
-        outlier_scale_factor=args.outlier_scale_factor,
-        use_keypoint_distance_outliers=not args.no_keypoint_distance_outliers,
+        config=config,
+        frame_windows=FrameWindows.from_config(config) if config is not None else None,
+        medoid_outlier_scale_factor=args.outlier_scale_factor,
+        use_keypoint_distance_outliers=False if args.no_keypoint_distance_outliers else None,
         keypoint_distance_outlier_scale_factor=args.keypoint_distance_scale_factor,
-        keypoint_distance_outlier_threshold_percentage=args.keypoint_distance_threshold_percentage
+        keypoint_distance_outlier_threshold_percentage=args.keypoint_distance_threshold_percentage,
     )
 
 
@@ -0,0 +1,72 @@
+# Compara a leitura dos arquivos .h5 e .csv do DeepLabCut: confere que as duas versões de cada
+# gravação dão os mesmos arrays e mede o tempo de leitura de cada formato.
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import keypoint_moseq as kpms
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.keypoint_store import get_format_pairs
+
+
+def time_load(path: str, repeats: int):
+    best = np.inf
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = kpms.load_keypoints(path, "deeplabcut", extension=os.path.splitext(path)[1])
+        best = min(best, time.perf_counter() - start)
+    return result, best
+
+
+def arrays_equal(a: dict, b: dict) -> bool:
+    return a.keys() == b.keys() and all(np.array_equal(a[k], b[k], equal_nan=True) for k in a)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check and benchmark the DeepLabCut .h5 and .csv outputs")
+    parser.add_argument("project_dir", nargs="?", help="Project whose config.yml has the video_dir")
+    parser.add_argument("--video-dir", help="Directory with the DeepLabCut files (instead of the project)")
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    video_dir = args.video_dir or kpms.load_config(args.project_dir)["video_dir"]
+    pairs = {stem: paths for stem, paths in get_format_pairs(video_dir).items() if {".h5", ".csv"} <= paths.keys()}
+    if not pairs:
+        print(f"No recording with both .h5 and .csv files in {video_dir}")
+        return
+
+    total = {".csv": 0.0, ".h5": 0.0}
+    mismatches = []
+    print(f"{'recording':<50} {'csv (s)':>8} {'h5 (s)':>8} {'speedup':>8} {'identical':>10}")
+    for stem, paths in sorted(pairs.items()):
+        csv_result, csv_time = time_load(paths[".csv"], args.repeats)
+        h5_result, h5_time = time_load(paths[".h5"], args.repeats)
+        identical = (
+            arrays_equal(csv_result[0], h5_result[0])
+            and arrays_equal(csv_result[1], h5_result[1])
+            and list(csv_result[2]) == list(h5_result[2])
+        )
+        if not identical:
+            mismatches.append(stem)
+        total[".csv"] += csv_time
+        total[".h5"] += h5_time
+        print(
+            f"{os.path.basename(stem)[:50]:<50} {csv_time:>8.3f} {h5_time:>8.3f} "
+            f"{csv_time / h5_time:>7.1f}x {str(identical):>10}"
+        )
+
+    print(
+        f"\n{len(pairs)} recordings: csv {total['.csv']:.2f}s, h5 {total['.h5']:.2f}s "
+        f"({total['.csv'] / total['.h5']:.1f}x)"
+    )
+    if mismatches:
+        print(f"The .h5 and .csv files differ for: {', '.join(os.path.basename(s) for s in mismatches)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+# Compara a interpolação de outliers de utils/interpolation.py com kpms.interpolate_keypoints
+# em gravações sintéticas de tamanho crescente.
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import keypoint_moseq as kpms
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.interpolation import interpolate_keypoints, interpolate_recordings
+
+
+def make_recording(n_frames: int, n_keypoints: int, outlier_fraction: float, rng: np.random.Generator):
+    """Random walk keypoints with runs of outlier frames."""
+    coordinates = 300 + np.cumsum(rng.normal(0, 2, size=(n_frames, n_keypoints, 2)), axis=0)
+    run_starts = rng.random((n_frames, n_keypoints)) < outlier_fraction / 5
+    run_lengths = rng.integers(1, 10, size=(n_frames, n_keypoints))
+    outliers = np.zeros((n_frames, n_keypoints), dtype=bool)
+    for frame, keypoint in zip(*np.nonzero(run_starts)):
+        outliers[frame : frame + run_lengths[frame, keypoint], keypoint] = True
+    return coordinates, outliers
+
+
+def time_call(fn, *args, repeats: int = 3):
+    best = np.inf
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = fn(*args)
+        best = min(best, time.perf_counter() - start)
+    return result, best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the outlier interpolation against kpms")
+    parser.add_argument("--lengths", type=int, nargs="+", default=[10_000, 50_000, 100_000, 500_000, 1_000_000])
+    parser.add_argument("--keypoints", type=int, default=15)
+    parser.add_argument("--outlier-fraction", type=float, default=0.05)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    recordings = {}
+
+    print(f"{'frames':>10} {'kpms (s)':>10} {'native (s)':>11} {'speedup':>8} {'identical':>10}")
+    for n_frames in args.lengths:
+        coordinates, outliers = make_recording(n_frames, args.keypoints, args.outlier_fraction, rng)
+        recordings[f"{n_frames}"] = (coordinates, outliers)
+
+        expected, kpms_time = time_call(kpms.interpolate_keypoints, coordinates, outliers, repeats=args.repeats)
+        result, native_time = time_call(interpolate_keypoints, coordinates, outliers, repeats=args.repeats)
+        identical = np.array_equal(expected, result, equal_nan=True)
+        print(
+            f"{n_frames:>10} {kpms_time:>10.3f} {native_time:>11.3f} "
+            f"{kpms_time / native_time:>7.1f}x {str(identical):>10}"
+        )
+
+    print("\nAll recordings in a single call:")
+    interpolate_recordings(
+        {name: coordinates for name, (coordinates, _) in recordings.items()},
+        {name: outliers for name, (_, outliers) in recordings.items()},
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+# Confere se o pré-processamento em float32 (`precision: float32` no config.yml) dá os mesmos
+# resultados que em float64: máscaras de outliers e estimativa do sigmasq_loc de cada gravação.
+
+import argparse
+import os
+import sys
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from commands.fit_arhmm import estimate_sigmasq_loc
+from utils.precision import MASK_TOLERANCE, SIGMASQ_LOC_TOLERANCE, compare_outlier_masks
+from utils.project_context import ProjectContext
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the float32 preprocessing against float64")
+    parser.add_argument("project_dir")
+    parser.add_argument("--mask-tolerance", type=float, default=MASK_TOLERANCE,
+                        help="Maximum fraction of keypoints x frames whose outlier mask may differ")
+    parser.add_argument("--sigmasq-loc-tolerance", type=float, default=SIGMASQ_LOC_TOLERANCE,
+                        help="Maximum relative error of sigmasq_loc")
+    args = parser.parse_args()
+
+    # Coordenadas cortadas, sem remoção de outliers, em float64 (referência)
+    project = ProjectContext(args.project_dir, remove_outliers=False, config_overrides={"precision": "float64"})
+    config = project.config
+    failures = []
+
+    print(f"{'recording':<40} {'mask diff':>10} {'sigmasq_loc 64':>15} {'rel. error':>11} {'peak MB 64/32':>14}")
+    for recording_name, coordinates in project.coordinates.items():
+        differences, peak_bytes = compare_outlier_masks(np.asarray(coordinates), config, np.float32)
+        mask = np.ones((1, len(coordinates)), dtype=bool)
+        reference = estimate_sigmasq_loc(coordinates[None], mask, filter_size=config["fps"], dtype=np.float64)
+        result = estimate_sigmasq_loc(coordinates[None], mask, filter_size=config["fps"], dtype=np.float32)
+        relative_error = abs(result - reference) / max(abs(reference), np.finfo(np.float64).tiny)
+
+        print(
+            f"{recording_name[:40]:<40} {differences['combined']:>10.2e} {reference:>15.4f} {relative_error:>11.2e} "
+            f"{peak_bytes['float64'] / 1024**2:>6.0f}/{peak_bytes['float32'] / 1024**2:<6.0f}"
+        )
+        if max(differences.values()) > args.mask_tolerance or relative_error > args.sigmasq_loc_tolerance:
+            failures.append(recording_name)
+
+    if failures:
+        print(f"float32 is outside the tolerance for: {', '.join(failures)}")
+        sys.exit(1)
+    print("float32 is within the tolerance for every recording; `precision: float32` can be used")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+# Acompanha um .csv do DeepLabCut enquanto ele é escrito (ex. análise ao vivo) e mostra os outliers dos
+# frames novos a cada leitura, com os limiares dos últimos `outlier_online_window` frames.
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.load_data_and_config import load_config
+from utils.online_outliers import GrowingDLCFile, detect_outliers_online
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Detect the outliers of a DeepLabCut .csv while it is being written")
+    parser.add_argument("csv_path")
+    parser.add_argument("--project-dir", default=None,
+                        help="Project whose config.yml has the detection parameters (defaults are used otherwise)")
+    parser.add_argument("--interval", type=float, default=1.0, help="Seconds between reads of the file")
+    parser.add_argument("--idle-timeout", type=float, default=None,
+                        help="Stop after this many seconds without new frames (default: run until Ctrl+C)")
+    parser.add_argument("--output", default=None, help="Save the outlier mask of every frame read to this .npy")
+    args = parser.parse_args()
+
+    config = load_config(args.project_dir, build_indexes=False) if args.project_dir else {}
+    dlc_file = GrowingDLCFile(args.csv_path)
+    detector, masks = None, []
+    last_new_frames = time.monotonic()
+
+    try:
+        while True:
+            detector, result = detect_outliers_online(dlc_file, detector, config)
+            if result is None:
+                if args.idle_timeout is not None and time.monotonic() - last_new_frames > args.idle_timeout:
+                    break
+                time.sleep(args.interval)
+                continue
+
+            last_new_frames = time.monotonic()
+            masks.append(result["mask"])
+            counts = ", ".join(
+                f"{key[: -len('_outliers')]} {result[key]['mask'].any(axis=1).sum()}"
+                for key in result
+                if key.endswith("_outliers")
+            )
+            print(
+                f"frames {detector.n_frames - len(result['mask'])}-{detector.n_frames - 1}: "
+                f"{result['mask'].any(axis=1).sum()} with outliers ({counts})"
+            )
+    except KeyboardInterrupt:
+        pass
+
+    if args.output and masks:
+        np.save(args.output, np.concatenate(masks))
+        print(f"Saved the outlier mask of {detector.n_frames} frames to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Os testes importam `utils` e `commands` a partir da raiz do repositório, como main.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
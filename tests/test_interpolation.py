@@ -0,0 +1,123 @@
+import numpy as np
+import pytest
+
+from utils.interpolation import find_outlier_runs, interpolate_keypoints, interpolate_recordings
+
+
+def reference_interpolate_keypoints(coordinates, outliers):
+    """`kpms.interpolate_keypoints`: `np.interp` per keypoint and axis, zeros without valid frames."""
+    interpolated_coordinates = np.zeros_like(coordinates)
+    frames = np.arange(coordinates.shape[0])
+    for keypoint in range(coordinates.shape[1]):
+        valid_frames = np.nonzero(~outliers[:, keypoint])[0]
+        if len(valid_frames) == 0:
+            continue
+        for axis in range(coordinates.shape[2]):
+            interpolated_coordinates[:, keypoint, axis] = np.interp(
+                frames, valid_frames, coordinates[valid_frames, keypoint, axis]
+            )
+    return interpolated_coordinates
+
+
+def make_recording(n_frames=500, n_keypoints=5, seed=0, dtype=np.float64):
+    rng = np.random.default_rng(seed)
+    coordinates = (300 + np.cumsum(rng.normal(0, 2, (n_frames, n_keypoints, 2)), axis=0)).astype(dtype)
+    outliers = rng.random((n_frames, n_keypoints)) < 0.2
+    outliers[:7, 0] = True  # run no início
+    outliers[-5:, 1] = True  # run no fim
+    outliers[:, 2] = True  # keypoint sem nenhum frame válido
+    outliers[:, 3] = False  # keypoint sem outliers
+    return coordinates, outliers
+
+
+def test_fixed_reference():
+    coordinates = np.array(
+        [
+            [[0.0, 10.0], [5.0, 5.0], [1.0, 1.0]],
+            [[99.0, 99.0], [6.0, 4.0], [2.0, 2.0]],
+            [[99.0, 99.0], [99.0, 99.0], [3.0, 3.0]],
+            [[3.0, 4.0], [99.0, 99.0], [4.0, 4.0]],
+        ]
+    )
+    outliers = np.array(
+        [
+            [False, True, True],
+            [True, False, True],
+            [True, True, True],
+            [False, True, True],
+        ]
+    )
+    expected = np.array(
+        [
+            [[0.0, 10.0], [6.0, 4.0], [0.0, 0.0]],
+            [[1.0, 8.0], [6.0, 4.0], [0.0, 0.0]],
+            [[2.0, 6.0], [6.0, 4.0], [0.0, 0.0]],
+            [[3.0, 4.0], [6.0, 4.0], [0.0, 0.0]],
+        ]
+    )
+    np.testing.assert_array_equal(interpolate_keypoints(coordinates, outliers), expected)
+    np.testing.assert_array_equal(reference_interpolate_keypoints(coordinates, outliers), expected)
+
+
+@pytest.mark.parametrize("dtype", [np.float64, np.float32])
+def test_matches_np_interp(dtype):
+    coordinates, outliers = make_recording(dtype=dtype)
+    interpolated = interpolate_keypoints(coordinates, outliers)
+
+    assert interpolated.dtype == dtype
+    np.testing.assert_array_equal(interpolated, reference_interpolate_keypoints(coordinates, outliers))
+    assert np.all(interpolated[:, 2] == 0)
+    np.testing.assert_array_equal(interpolated[:, 3], coordinates[:, 3])
+
+
+def test_does_not_modify_input():
+    coordinates, outliers = make_recording()
+    original = coordinates.copy()
+    interpolate_keypoints(coordinates, outliers)
+    np.testing.assert_array_equal(coordinates, original)
+
+
+@pytest.mark.parametrize("dtype", [np.float64, np.float32])
+def test_no_outliers(dtype):
+    coordinates, _ = make_recording(dtype=dtype)
+    interpolated = interpolate_keypoints(coordinates, np.zeros(coordinates.shape[:2], dtype=bool))
+    assert interpolated.dtype == dtype
+    np.testing.assert_array_equal(interpolated, coordinates)
+
+
+def test_all_outliers():
+    coordinates, _ = make_recording()
+    interpolated = interpolate_keypoints(coordinates, np.ones(coordinates.shape[:2], dtype=bool))
+    np.testing.assert_array_equal(interpolated, np.zeros_like(coordinates))
+
+
+@pytest.mark.parametrize("dtype", [np.float64, np.float32])
+def test_empty_recording(dtype):
+    coordinates = np.zeros((0, 4, 2), dtype=dtype)
+    interpolated = interpolate_keypoints(coordinates, np.zeros((0, 4), dtype=bool))
+    assert interpolated.shape == (0, 4, 2) and interpolated.dtype == dtype
+
+
+def test_recordings_are_interpolated_separately():
+    # As runs não passam de uma gravação para a seguinte
+    recordings = {f"rec{i}": make_recording(n_frames=n_frames, seed=i) for i, n_frames in enumerate([120, 0, 1, 300])}
+    coordinates = {name: recording[0] for name, recording in recordings.items()}
+    outliers = {name: recording[1] for name, recording in recordings.items()}
+
+    interpolated = interpolate_recordings(coordinates, outliers, verbose=False)
+    assert list(interpolated) == list(recordings)
+    for name in recordings:
+        np.testing.assert_array_equal(
+            interpolated[name], reference_interpolate_keypoints(coordinates[name], outliers[name])
+        )
+    assert interpolate_recordings({}, {}) == {}
+
+
+def test_find_outlier_runs():
+    outliers = [
+        np.array([[True, False], [True, True], [False, True]]),
+        np.array([[True, True], [False, True]]),
+    ]
+    recordings, keypoints, starts, ends = find_outlier_runs(outliers)
+    runs = sorted(zip(recordings.tolist(), keypoints.tolist(), starts.tolist(), ends.tolist()))
+    assert runs == [(0, 0, 0, 2), (0, 1, 1, 3), (1, 0, 0, 1), (1, 1, 0, 2)]
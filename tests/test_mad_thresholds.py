@@ -0,0 +1,110 @@
+import numpy as np
+import pytest
+
+from utils.find_medoid_distance_outliers import filter_recording, find_outliers
+from utils.mad_thresholds import QuantileSketch, build_sketch, get_mad_thresholds, sketch_mad_thresholds
+
+SCALE_FACTOR = 4.0
+
+
+def make_values(n_rows=20001, seed=0):
+    # Distâncias com escalas diferentes por coluna, algumas com muitos zeros e outliers grandes
+    rng = np.random.default_rng(seed)
+    values = rng.gamma(2.0, [1.0, 5.0, 0.01, 100.0, 3.0], (n_rows, 5))
+    values[rng.random(n_rows) < 0.3, 2] = 0.0
+    values[rng.random((n_rows, 5)) < 0.01] *= 50
+    return values
+
+
+def assert_within_relative_error(thresholds, values, relative_error):
+    # A mediana tem erro relativo <= relative_error e o MAD <= relative_error * (mediana + MAD)
+    medians = np.median(values, axis=0)
+    mads = np.median(np.abs(values - medians), axis=0)
+    exact = get_mad_thresholds(values, SCALE_FACTOR, method="median")
+    tolerance = relative_error * (medians + SCALE_FACTOR * (medians + mads))
+    assert np.all(np.abs(thresholds - exact) <= tolerance + 1e-12)
+
+
+@pytest.mark.parametrize("relative_error", [0.001, 0.01, 0.05])
+def test_sketch_thresholds_within_relative_error(relative_error):
+    values = make_values()
+    thresholds = get_mad_thresholds(values, SCALE_FACTOR, method="sketch", relative_error=relative_error)
+    assert_within_relative_error(thresholds, values, relative_error)
+
+
+def test_partition_matches_median():
+    values = make_values(n_rows=1000)
+    np.testing.assert_allclose(
+        get_mad_thresholds(values, SCALE_FACTOR, method="partition"),
+        get_mad_thresholds(values, SCALE_FACTOR, method="median"),
+    )
+
+
+def test_merged_sketches_within_relative_error():
+    values = make_values()
+    sketches = [QuantileSketch(5, relative_error=0.01) for _ in range(3)]
+    for sketch, chunk in zip(sketches, np.array_split(values, 3)):
+        sketch.update(chunk)
+    merged = sketches[0].merge(sketches[1]).merge(sketches[2])
+
+    expected = build_sketch(np.array_split(values, 7), relative_error=0.01)
+    np.testing.assert_array_equal(merged.total_counts, expected.total_counts)
+    thresholds = sketch_mad_thresholds(merged, SCALE_FACTOR)
+    np.testing.assert_array_equal(thresholds, sketch_mad_thresholds(expected, SCALE_FACTOR))
+    assert_within_relative_error(thresholds, values, 0.01)
+
+
+def test_merge_requires_same_relative_error():
+    with pytest.raises(ValueError):
+        QuantileSketch(5, relative_error=0.01).merge(QuantileSketch(5, relative_error=0.05))
+
+
+def test_removed_values_within_relative_error():
+    values = make_values()
+    sketch = QuantileSketch(5, relative_error=0.01)
+    sketch.update(values)
+    sketch.update(values[:5000], weight=-1)
+
+    remaining = values[5000:]
+    expected = QuantileSketch(5, relative_error=0.01)
+    expected.update(remaining)
+    np.testing.assert_array_equal(sketch.total_counts, expected.total_counts)
+    thresholds = sketch_mad_thresholds(sketch, SCALE_FACTOR)
+    np.testing.assert_array_equal(thresholds, sketch_mad_thresholds(expected, SCALE_FACTOR))
+    assert_within_relative_error(thresholds, remaining, 0.01)
+
+
+def test_empty_sketch_gives_nan():
+    sketch = QuantileSketch(3)
+    assert np.all(np.isnan(sketch_mad_thresholds(sketch, SCALE_FACTOR)))
+
+    values = make_values(n_rows=100)[:, :3]
+    sketch.update(values)
+    sketch.update(values, weight=-1)
+    assert np.all(sketch.total_counts == 0)
+    assert np.all(np.isnan(sketch_mad_thresholds(sketch, SCALE_FACTOR)))
+
+
+@pytest.mark.parametrize("method", ["median", "partition", "sketch"])
+def test_empty_recording_gives_nan_thresholds(method):
+    coordinates = np.zeros((0, 4, 2))
+    result = find_outliers(coordinates, use_velocity_outliers=True, outlier_threshold_method=method)
+
+    assert result["mask"].shape == (0, 4)
+    for detector in ("medoid", "velocity", "keypoint_distance"):
+        assert result[f"{detector}_outliers"]["mask"].shape == (0, 4)
+    assert np.all(np.isnan(result["medoid_thresholds"]))
+    assert np.all(np.isnan(result["velocity_thresholds"]))
+    off_diagonal = ~np.eye(4, dtype=bool)
+    assert np.all(np.isnan(result["keypoint_distance_thresholds"][off_diagonal]))
+
+    # Um único frame não tem velocidade
+    result = find_outliers(np.ones((1, 4, 2)), use_velocity_outliers=True, outlier_threshold_method=method)
+    assert np.all(np.isnan(result["velocity_thresholds"]))
+    assert not result["mask"].any()
+
+
+def test_empty_recording_is_filtered():
+    coordinates, confidences, combined_outliers = filter_recording(np.zeros((0, 4, 2)), np.zeros((0, 4)), {})
+    assert coordinates.shape == (0, 4, 2) and confidences.shape == (0, 4)
+    assert combined_outliers["mask"].shape == (0, 4)
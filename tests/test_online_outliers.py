@@ -0,0 +1,142 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from utils.find_medoid_distance_outliers import find_outliers
+from utils.mad_thresholds import QuantileSketch
+from utils.online_outliers import GrowingDLCFile, OnlineOutlierDetector, RollingValues, detect_outliers_online
+
+DETECTION_PARAMS = {"use_medoid_outliers": True, "use_velocity_outliers": True, "use_keypoint_distance_outliers": True}
+DETECTORS = ("medoid", "velocity", "keypoint_distance")
+
+
+def make_coordinates(n_frames=2000, n_keypoints=6, seed=0):
+    rng = np.random.default_rng(seed)
+    coordinates = 100 + np.cumsum(rng.normal(0, 1, (n_frames, n_keypoints, 2)), axis=0)
+    coordinates[rng.random((n_frames, n_keypoints)) < 0.02] += 80
+    return coordinates
+
+
+def write_dlc_csv(path, coordinates, confidences, mode="w", header=True):
+    n_frames, n_keypoints, _ = coordinates.shape
+    columns = pd.MultiIndex.from_product(
+        [["scorer"], [f"bp{i}" for i in range(n_keypoints)], ["x", "y", "likelihood"]],
+        names=["scorer", "bodyparts", "coords"],
+    )
+    values = np.concatenate([coordinates, confidences[..., None]], axis=2).reshape(n_frames, -1)
+    pd.DataFrame(values, columns=columns).to_csv(path, mode=mode, header=header)
+
+
+def assert_same_outliers(result, reference, frames=slice(None)):
+    assert np.array_equal(result["mask"], reference["mask"][frames])
+    for detector in DETECTORS:
+        key = f"{detector}_outliers"
+        assert np.array_equal(result[key]["mask"], reference[key]["mask"][frames]), detector
+        np.testing.assert_allclose(result[key]["thresholds"], reference[key]["thresholds"])
+
+
+def test_single_append_matches_find_outliers():
+    coordinates = make_coordinates()
+    reference = find_outliers(coordinates, outlier_threshold_method="sketch", **DETECTION_PARAMS)
+
+    detector = OnlineOutlierDetector(coordinates.shape[1], window_size=len(coordinates), chunk_size=len(coordinates), **DETECTION_PARAMS)
+    assert_same_outliers(detector.append(coordinates), reference)
+
+
+def test_last_append_matches_find_outliers():
+    # Com a janela cobrindo a gravação, o último bloco é limiarizado com os valores de todos os frames
+    coordinates = make_coordinates()
+    reference = find_outliers(coordinates, outlier_threshold_method="sketch", **DETECTION_PARAMS)
+
+    detector = OnlineOutlierDetector(coordinates.shape[1], window_size=len(coordinates), chunk_size=len(coordinates), **DETECTION_PARAMS)
+    for start in range(0, 1700, 340):
+        assert len(detector.append(coordinates[start : start + 340])["mask"]) == 340
+    assert_same_outliers(detector.append(coordinates[1700:]), reference, slice(1700, None))
+    assert detector.n_frames == len(coordinates)
+
+
+def test_window_matches_find_outliers_on_last_frames():
+    # Os frames que saem da janela são removidos dos sketches (peso -1): os limiares passam a ser
+    # os de `find_outliers` só nos últimos `window_size` frames
+    coordinates = make_coordinates(n_frames=2500)
+    window_size = 800
+    params = {**DETECTION_PARAMS, "use_velocity_outliers": False}
+    reference = find_outliers(coordinates[-window_size:], outlier_threshold_method="sketch", **params)
+
+    detector = OnlineOutlierDetector(coordinates.shape[1], window_size=window_size, chunk_size=300, **params)
+    for start in range(0, 2200, 300):
+        detector.append(coordinates[start : min(start + 300, 2200)])
+    result = detector.append(coordinates[-300:])
+
+    for detector_name in ("medoid", "keypoint_distance"):
+        key = f"{detector_name}_outliers"
+        np.testing.assert_allclose(result[key]["thresholds"], reference[key]["thresholds"])
+        assert np.array_equal(result[key]["mask"], reference[key]["mask"][-300:])
+
+
+def test_rolling_values_removes_rows_leaving_the_window():
+    rng = np.random.default_rng(1)
+    values = rng.gamma(2.0, 3.0, (1000, 4))
+    rolling = RollingValues(4, window_size=250, relative_error=0.01, dtype=np.float64)
+    for start in range(0, 1000, 70):
+        rolling.extend(values[start : start + 70])
+
+    expected = QuantileSketch(4, relative_error=0.01)
+    expected.update(values[-250:])
+    assert rolling.n_rows == 250
+    assert np.array_equal(rolling.sketch.total_counts, expected.total_counts)
+    np.testing.assert_array_equal(rolling.sketch.median(), expected.median())
+    np.testing.assert_array_equal(rolling.sketch.mad(), expected.mad())
+    np.testing.assert_array_equal(np.sort(rolling.values, axis=0), np.sort(values[-250:], axis=0))
+
+
+def test_growing_dlc_file_reads_only_new_rows(tmp_path):
+    path = tmp_path / "recording.csv"
+    coordinates = make_coordinates(n_frames=30, n_keypoints=3)
+    confidences = np.random.default_rng(2).random((30, 3))
+    dlc_file = GrowingDLCFile(str(path))
+
+    new_coordinates, new_confidences = dlc_file.read_new_frames()
+    assert new_coordinates.shape[0] == 0 and new_confidences.shape[0] == 0
+
+    write_dlc_csv(path, coordinates[:10], confidences[:10])
+    with open(path) as f:
+        assert len(f.readlines()) == 3 + 10  # scorer, bodyparts, coords
+    new_coordinates, new_confidences = dlc_file.read_new_frames()
+    np.testing.assert_allclose(new_coordinates, coordinates[:10])
+    np.testing.assert_allclose(new_confidences, confidences[:10])
+    assert dlc_file.offset == path.stat().st_size
+
+    write_dlc_csv(path, coordinates[10:20], confidences[10:20], mode="a", header=False)
+    # Uma linha ainda sendo escrita fica para a próxima leitura
+    with open(path, "a") as f:
+        f.write("20,1.0,2.0")
+    offset = path.stat().st_size - len("20,1.0,2.0")
+    new_coordinates, _ = dlc_file.read_new_frames()
+    np.testing.assert_allclose(new_coordinates, coordinates[10:20])
+    assert dlc_file.offset == offset
+
+    with open(path, "r+") as f:
+        f.truncate(offset)
+    write_dlc_csv(path, coordinates[20:], confidences[20:], mode="a", header=False)
+    new_coordinates, new_confidences = dlc_file.read_new_frames()
+    np.testing.assert_allclose(new_coordinates, coordinates[20:])
+    np.testing.assert_allclose(new_confidences, confidences[20:])
+    assert dlc_file.read_new_frames()[0].shape[0] == 0
+
+
+@pytest.mark.parametrize("precision", ["float64", "float32"])
+def test_detect_outliers_online_matches_find_outliers(tmp_path, precision):
+    path = tmp_path / "recording.csv"
+    coordinates = make_coordinates(n_frames=1200)
+    write_dlc_csv(path, coordinates, np.ones(coordinates.shape[:2]))
+    config = {**DETECTION_PARAMS, "outlier_online_window": 5000, "precision": precision}
+    # O .csv guarda as coordenadas com menos casas decimais; a referência usa as mesmas
+    coordinates = GrowingDLCFile(str(path)).read_new_frames()[0].astype(precision)
+    reference = find_outliers(coordinates, outlier_threshold_method="sketch", chunk_size=8192, **DETECTION_PARAMS)
+
+    dlc_file = GrowingDLCFile(str(path))
+    detector, result = detect_outliers_online(dlc_file, None, config)
+    assert detector.window_size == 5000
+    assert_same_outliers(result, reference)
+    assert detect_outliers_online(dlc_file, detector, config) == (detector, None)
@@ -2,6 +2,7 @@ import argparse
 from os import path
 
 parser = None
+_args = None
 DEFAULT_PROJECT_SUBDIR = "projects"
 
 def _append_project_subdir(p_dir_str: str | None) -> str | None:
@@ -24,6 +25,11 @@ def build_parser():
         default=1,
         help="Número de batches. Diminui o uso de memória, mas aumenta o tempo de execução. Por padrão, 1.",
     )
+    parser.add_argument(
+        "--timing",
+        action="store_true",
+        help="Mostra o tempo de importação de cada pacote antes de rodar o comando.",
+    )
     
     subparsers = parser.add_subparsers(
         dest="command",
@@ -35,7 +41,13 @@ def build_parser():
     parser_init = subparsers.add_parser("init", help="Inicializa o projeto.")
 
     # Subparser para remoção de outliers
-    parser_init = subparsers.add_parser("outliers", help="Remove os outliers")
+    parser_outliers = subparsers.add_parser("outliers", help="Remove os outliers")
+    parser_outliers.add_argument(
+        "--plot-workers",
+        type=int,
+        default=1,
+        help="Número de processos para gerar os gráficos de outliers enquanto as próximas gravações são filtradas. Por padrão, 1.",
+    )
     
     # Subparser para ajustar PCA
     parser_pca = subparsers.add_parser("fit_pca", help="Ajusta e salva PCA.")
@@ -54,6 +66,11 @@ def build_parser():
         default=None,
         help="Valor de Kappa para o modelo AR-HMM. Sobrescreve o valor no config.yml se fornecido.",
     )
+    parser_arhmm.add_argument(
+        "--early-stopping",
+        action="store_true",
+        help="Para o ajuste antes do número de iterações quando a log-likelihood, a duração e o uso das sílabas se estabilizam.",
+    )
     
     # Subparser para ajustar modelo keypoint moseq
     parser_keypoint = subparsers.add_parser(
@@ -74,6 +91,11 @@ def build_parser():
         default=None,
         help="Valor de Kappa para o modelo keypoint. Sobrescreve o valor no config.yml se fornecido.",
     )
+    parser_keypoint.add_argument(
+        "--early-stopping",
+        action="store_true",
+        help="Para o ajuste antes do número de iterações quando a log-likelihood, a duração e o uso das sílabas se estabilizam.",
+    )
     
     # Subparser para métricas do scan de kappa
     parser_kappa_metrics = subparsers.add_parser(
@@ -103,6 +125,11 @@ def build_parser():
         default=None,
         help="Valor de Kappa para o modelo keypoint. Sobrescreve o valor no config.yml se fornecido.",
     )
+    parser_fit_full_model.add_argument(
+        "--early-stopping",
+        action="store_true",
+        help="Para o ajuste antes do número de iterações quando a log-likelihood, a duração e o uso das sílabas se estabilizam.",
+    )
     
     # Subparser para scan de kappa
     parser_kappa = subparsers.add_parser(
@@ -145,6 +172,88 @@ def build_parser():
         default=250,
         help="Número de iterações para o ajuste do modelo AR-HMM.",
     )
+    parser_kappa.add_argument(
+        "--scan-workers",
+        type=int,
+        default=1,
+        help="Número de processos para ajustar os kappas em paralelo. Por padrão, 1 (um kappa por vez).",
+    )
+    parser_kappa.add_argument(
+        "--threads-per-worker",
+        type=int,
+        default=None,
+        help="Threads de CPU (BLAS/OpenMP) de cada processo do scan; o XLA roda em uma thread por processo. Por padrão, os núcleos divididos entre os processos.",
+    )
+    parser_kappa.add_argument(
+        "--shared-init",
+        action="store_true",
+        help="Inicializa o modelo uma vez e todos os kappas partem dessa inicialização.",
+    )
+    parser_kappa.add_argument(
+        "--shared-ar-iters",
+        type=int,
+        default=0,
+        help="Iterações AR ajustadas uma vez para todos os kappas (burn-in compartilhado, implica --shared-init). Por padrão, 0.",
+    )
+    parser_kappa.add_argument(
+        "--early-stopping",
+        action="store_true",
+        help="Para o ajuste antes do número de iterações quando a log-likelihood, a duração e o uso das sílabas se estabilizam.",
+    )
+
+    # Subparser para busca adaptativa do kappa
+    parser_kappa_search = subparsers.add_parser(
+        "kappa_search",
+        help="Busca o kappa que dá a mediana da duração das sílabas desejada, com poucos ajustes curtos.",
+    )
+    parser_kappa_search.add_argument(
+        "--target-duration",
+        type=float,
+        default=12,
+        help="Mediana da duração das sílabas desejada, em frames. Por padrão, 12 (400 ms a 30 fps).",
+    )
+    parser_kappa_search.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.1,
+        help="Diferença relativa aceita entre a mediana da duração e o alvo. Por padrão, 0.1 (10%%).",
+    )
+    parser_kappa_search.add_argument(
+        "--kappa-log-start",
+        type=float,
+        default=3,
+        help="Expoente do kappa da ponta inferior do intervalo inicial. Exemplo: 3 = 10^3 = 1000.",
+    )
+    parser_kappa_search.add_argument(
+        "--kappa-log-end",
+        type=float,
+        default=7,
+        help="Expoente do kappa da ponta superior do intervalo inicial. Exemplo: 7 = 10^7 = 10000000.",
+    )
+    parser_kappa_search.add_argument(
+        "--decrease-kappa-factor",
+        type=float,
+        default=10,
+        help="Fator pelo qual o kappa é dividido após o ajuste do modelo AR. Por padrão, 10.",
+    )
+    parser_kappa_search.add_argument(
+        "--num-ar-iters",
+        type=int,
+        default=50,
+        help="Número de iterações do modelo AR de cada sonda.",
+    )
+    parser_kappa_search.add_argument(
+        "--iters",
+        type=int,
+        default=50,
+        help="Número de iterações do modelo keypoint de cada sonda.",
+    )
+    parser_kappa_search.add_argument(
+        "--max-probes",
+        type=int,
+        default=8,
+        help="Número máximo de sondas (ajustes). Por padrão, 8.",
+    )
 
     parser_results = subparsers.add_parser(
         "results",
@@ -180,7 +289,11 @@ def build_parser():
     return parser
 
 def get_args():
-    return parser.parse_args()
+    """Argumentos da linha de comando, lidos uma vez só."""
+    global _args
+    if _args is None:
+        _args = parser.parse_args()
+    return _args
 
 def get_subparser(subparser_name):
     return parser.parse_args(subparser_name)
@@ -0,0 +1,236 @@
+import json
+import os
+from typing import Optional
+
+import keypoint_moseq as kpms  # type: ignore
+import numpy as np
+from jax_moseq.models import keypoint_slds  # type: ignore
+
+from utils.print_legal import print_legal
+
+EARLY_STOPPING_FILENAME = "early_stopping.json"
+
+# Podem ser mudados no config.yml
+DEFAULT_EARLY_STOPPING_PARAMS = {
+    "early_stopping_check_every": 10,  # iterações entre as verificações
+    "early_stopping_window": 5,  # verificações na janela
+    "early_stopping_llh_tolerance": 1e-3,  # aumento relativo da log-likelihood na janela
+    "early_stopping_duration_tolerance": 0.05,  # variação relativa da mediana da duração na janela
+    "early_stopping_usage_tolerance": 0.05,  # distância (variação total) entre os usos das sílabas na janela
+}
+
+
+def get_early_stopping_params(config: dict) -> dict:
+    """Early stopping parameters from config.yml, with `DEFAULT_EARLY_STOPPING_PARAMS` as defaults."""
+    return {key: config.get(key, default) for key, default in DEFAULT_EARLY_STOPPING_PARAMS.items()}
+
+
+class ConvergenceMonitor:
+    """Checks whether a fit has converged over a sliding window of checks.
+
+    At each check the log-likelihood of the model, the median syllable duration and the
+    syllable usages are computed from the current model. The fit has converged when, over the
+    last `early_stopping_window` checks, the log-likelihood increased by less than
+    `early_stopping_llh_tolerance` (relative), the median duration varied by less than
+    `early_stopping_duration_tolerance` (relative) and the usages moved by less than
+    `early_stopping_usage_tolerance` (total variation distance to the last check).
+
+    In AR-only fits only the terms that change (syllables and latent trajectories) enter the
+    log-likelihood; the fixed terms would hide its changes.
+
+    Parameters
+    -------
+    **params
+        Values of `DEFAULT_EARLY_STOPPING_PARAMS` (see `get_early_stopping_params`).
+    """
+
+    def __init__(self, **params):
+        params = {**DEFAULT_EARLY_STOPPING_PARAMS, **params}
+        self.check_every = int(params["early_stopping_check_every"])
+        self.window = int(params["early_stopping_window"])
+        self.llh_tolerance = params["early_stopping_llh_tolerance"]
+        self.duration_tolerance = params["early_stopping_duration_tolerance"]
+        self.usage_tolerance = params["early_stopping_usage_tolerance"]
+        self.history = []
+        self._usages = []
+
+    def update(self, iteration: int, model: dict, data: dict, mask: np.ndarray, ar_only: bool) -> Optional[str]:
+        """Record the state of `model` at `iteration`; returns why the fit converged, or None."""
+        log_likelihoods = keypoint_slds.model_likelihood(data, **model)
+        if ar_only:
+            log_likelihood = float(log_likelihoods["z"] + log_likelihoods["x"])
+        else:
+            log_likelihood = float(sum(log_likelihoods.values()))
+
+        z = np.asarray(model["states"]["z"])
+        num_states = model["hypparams"]["trans_hypparams"]["num_states"]
+        usages = kpms.get_frequencies(z, mask, num_states=num_states)
+        self._usages = (self._usages + [usages])[-self.window :]
+        self.history.append(
+            {
+                "iteration": iteration,
+                "log_likelihood": log_likelihood,
+                "median_duration": float(np.median(kpms.get_durations(z, mask))),
+                "usage_change": float(np.abs(usages - self._usages[0]).sum() / 2),
+            }
+        )
+        return self.check()
+
+    def check(self) -> Optional[str]:
+        if len(self.history) < self.window:
+            return None
+        window = self.history[-self.window :]
+
+        llh_change = (window[-1]["log_likelihood"] - window[0]["log_likelihood"]) / abs(window[0]["log_likelihood"])
+        durations = [h["median_duration"] for h in window]
+        duration_change = (max(durations) - min(durations)) / np.median(durations)
+        usage_change = max(np.abs(self._usages[-1] - usages).sum() / 2 for usages in self._usages)
+
+        if (
+            llh_change < self.llh_tolerance
+            and duration_change < self.duration_tolerance
+            and usage_change < self.usage_tolerance
+        ):
+            return (
+                f"nas últimas {window[-1]['iteration'] - window[0]['iteration']} iterações a log-likelihood "
+                f"variou {llh_change:.2e} (< {self.llh_tolerance:g}), a mediana da duração {duration_change:.1%} "
+                f"(< {self.duration_tolerance:.0%}) e o uso das sílabas {usage_change:.1%} (< {self.usage_tolerance:.0%})"
+            )
+        return None
+
+
+def save_early_stopping_record(project_dir: str, model_name: str, phase: str, record: dict):
+    """Save the record of one fit (`phase` "ar" or "full") in `{project_dir}/{model_name}/early_stopping.json`."""
+    path = os.path.join(project_dir, model_name, EARLY_STOPPING_FILENAME)
+    records = {}
+    if os.path.exists(path):
+        with open(path) as f:
+            records = json.load(f)
+    records[phase] = record
+    with open(path + ".tmp", "w") as f:
+        json.dump(records, f, indent=2)
+    os.replace(path + ".tmp", path)
+
+
+def fit_model_block(model, data, metadata, project_dir, model_name, ar_only, start_iter, num_iters, **fit_kwargs):
+    """`kpms.fit_model` from `start_iter` to `num_iters`, always saving the snapshot at `num_iters`.
+
+    `kpms.fit_model` only saves the iterations after `start_iter`, so a fit continuing a model
+    for a single iteration (`start_iter == num_iters`) would not be checkpointed.
+    """
+    model = kpms.fit_model(
+        model,
+        data,
+        metadata,
+        project_dir,
+        model_name,
+        ar_only=ar_only,
+        start_iter=start_iter,
+        num_iters=num_iters,
+        **fit_kwargs,
+    )[0]
+    if start_iter == num_iters and fit_kwargs.get("save_every_n_iters", 25) is not None:
+        kpms.save_hdf5(
+            os.path.join(project_dir, model_name, "checkpoint.h5"),
+            model,
+            f"model_snapshots/{num_iters}",
+            exist_ok=True,
+            overwrite=True,
+        )
+    return model
+
+
+def fit_model_with_early_stopping(
+    model,
+    data,
+    metadata,
+    project_dir,
+    model_name,
+    ar_only,
+    start_iter=0,
+    num_iters=50,
+    early_stopping=False,
+    config=None,
+    **fit_kwargs,
+) -> tuple[dict, int]:
+    """`kpms.fit_model` with optional early stopping.
+
+    With `early_stopping`, the fit runs in blocks of `early_stopping_check_every` iterations
+    (each block ends with a checkpoint) and stops after the first block at which the
+    `ConvergenceMonitor` reports convergence. The first block starts at `start_iter`, as
+    `kpms.fit_model` would, and each later block at the iteration after the previous one, so
+    the fit runs the same iterations as without early stopping. The checks and the reason for
+    stopping are saved in `{project_dir}/{model_name}/early_stopping.json`. The blocks run
+    without the progress plots of `kpms.fit_model`, which are generated once, at the end.
+
+    Parameters
+    -------
+    early_stopping: bool, default=False
+        Without it this is just `kpms.fit_model` from `start_iter` to `num_iters`.
+
+    config: dict, optional
+        config.yml, for the early stopping parameters (see `get_early_stopping_params`).
+
+    **fit_kwargs
+        Passed to `kpms.fit_model`.
+
+    Returns
+    -------
+    model, iteration
+        The fitted model and the iteration of its last checkpoint.
+    """
+    if not early_stopping:
+        model = fit_model_block(
+            model, data, metadata, project_dir, model_name, ar_only, start_iter, num_iters, **fit_kwargs
+        )
+        return model, num_iters
+
+    monitor = ConvergenceMonitor(**get_early_stopping_params(config or {}))
+    mask = np.asarray(data["mask"])
+    # Os gráficos leem o histórico do checkpoint, então um no final mostra todos os blocos
+    generate_progress_plots = fit_kwargs.pop("generate_progress_plots", True)
+    block_start, iteration, reason = start_iter, start_iter, None
+    while block_start <= num_iters and reason is None:
+        iteration = min(iteration + monitor.check_every, num_iters)
+        model = fit_model_block(
+            model,
+            data,
+            metadata,
+            project_dir,
+            model_name,
+            ar_only,
+            block_start,
+            iteration,
+            generate_progress_plots=False,
+            **fit_kwargs,
+        )
+        reason = monitor.update(iteration, model, data, mask, ar_only)
+        block_start = iteration + 1
+
+    if generate_progress_plots and fit_kwargs.get("save_every_n_iters", 25):
+        kpms.plot_progress(
+            model,
+            data,
+            os.path.join(project_dir, model_name, "checkpoint.h5"),
+            iteration,
+            project_dir,
+            model_name,
+            savefig=True,
+        )
+
+    save_early_stopping_record(
+        project_dir,
+        model_name,
+        "ar" if ar_only else "full",
+        {
+            "start_iter": start_iter,
+            "num_iters": num_iters,
+            "last_iter": iteration,
+            "stopped_early": iteration < num_iters,
+            "reason": reason or "número máximo de iterações",
+            "history": monitor.history,
+        },
+    )
+    if iteration < num_iters:
+        print_legal(f"Ajuste parado na iteração {iteration} de {num_iters}: {reason}")
+    return model, iteration
@@ -1,13 +1,45 @@
 # From https://keypoint-moseq.readthedocs.io/en/latest/_modules/keypoint_moseq/util.html#find_medoid_distance_outliers
 
-import keypoint_moseq as kpms  # type: ignore
 import numpy as np
 import matplotlib.pyplot as plt
+from matplotlib.collections import PolyCollection
 from typing import Optional
 import os
-import h5py
-import hashlib
-import json
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from itertools import islice
+
+from utils.mad_thresholds import get_mad_thresholds, sketch_mad_thresholds, QuantileSketch
+from utils.outlier_cache import OutlierCache, DEFAULT_MAX_BYTES, hash_arrays
+from utils.precision import get_precision_dtype
+from utils.interpolation import interpolate_keypoints, find_outlier_runs
+from utils.video_frame_indexes import FrameWindows
+
+# Chaves do config.yml que mudam o resultado da detecção (entram na chave do cache)
+OUTLIER_CONFIG_KEYS = (
+    "outlier_threshold_method",
+    "outlier_sketch_relative_error",
+    "fps",
+)
+
+OUTLIER_DETECTORS = ("medoid", "velocity", "keypoint_distance")
+
+# Detectores e parâmetros usados por `filter_outliers`; podem ser sobrescritos no config.yml
+DEFAULT_DETECTION_PARAMS = {
+    "use_medoid_outliers": True,
+    "use_velocity_outliers": False,
+    "use_keypoint_distance_outliers": True,
+    "medoid_outlier_scale_factor": 4.0,
+    "velocity_outlier_scale_factor": 4.0,
+    "keypoint_distance_outlier_scale_factor": 4.0,
+    "keypoint_distance_outlier_threshold_percentage": 0.3,
+}
+
+# Largura (polegadas) e dpi dos gráficos de QA; os traços são reduzidos a ~2 pontos por pixel
+QA_PLOT_WIDTH = 16
+QA_PLOT_DPI = 150
 
 
 def get_distance_to_medoid(coordinates: np.ndarray) -> np.ndarray:
@@ -47,99 +79,361 @@ def get_keypoint_to_keypoint_distances(coordinates: np.ndarray) -> np.ndarray:
     return distances
 
 
-def find_medoid_distance_outliers(
-    coordinates: np.ndarray, outlier_scale_factor: float, **kwargs
-) -> dict[str, np.ndarray]:
-    """Identify keypoint distance outliers using Median Absolute Deviation (MAD).
+def iter_chunks(n: int, chunk_size: int):
+    """Yield consecutive slices of at most `chunk_size` elements covering range(n)."""
+    for start in range(0, n, chunk_size):
+        yield slice(start, min(start + chunk_size, n))
+
+
+def get_keypoint_pair_indexes(n_keypoints: int) -> tuple[np.ndarray, np.ndarray]:
+    """Indexes (i, j), i < j, of the K*(K-1)/2 unique keypoint pairs (upper triangle)."""
+    return np.triu_indices(n_keypoints, k=1)
+
 
-    Keypoints are considered outliers when their distance to the medoid at a given timepoint differs
-    from its median value by a multiple of the median absolute deviation (MAD) for that keypoint.
+def get_keypoint_pair_distances(
+    coordinates: np.ndarray, dtype=None, chunk_size: int = 4096
+) -> np.ndarray:
+    """Compute the distance of each unique keypoint pair at each frame.
+
+    Compact alternative to `get_keypoint_to_keypoint_distances`: only the upper triangle
+    of the (n_keypoints, n_keypoints) distance matrix is kept, without the mirrored pairs
+    and the zero diagonal. Columns follow the order of `get_keypoint_pair_indexes`.
 
     Parameters
     -------
     coordinates: ndarray of shape (n_frames, n_keypoints, keypoint_dim)
-        Keypoint coordinates where keypoint_dim is 2 or 3. Only the first two dimensions (x, y) are
-        used for distance calculations.
+        Keypoint coordinates where keypoint_dim is 2 or 3.
 
-    outlier_scale_factor: float, default=6.0
-        Multiplier used to set the outlier threshold. Higher values result in fewer outliers.
+    dtype: numpy dtype, optional
+        Dtype of the returned distances; defaults to the dtype of `coordinates`.
 
-    **kwargs
-        Additional keyword arguments (ignored), usually overflow from **config().
+    chunk_size: int, default=4096
+        Number of frames processed at once, bounds the size of the temporaries.
 
     Returns
     -------
-    result: dict with the following items
+    distances: ndarray of shape (n_frames, n_keypoints * (n_keypoints - 1) // 2)
+    """
+    n_frames, n_keypoints, _ = coordinates.shape
+    i, j = get_keypoint_pair_indexes(n_keypoints)
 
-        mask: ndarray of shape (n_frames, n_keypoints)
-            Boolean array where True indicates outlier keypoints.
+    distances = np.empty((n_frames, len(i)), dtype=dtype or coordinates.dtype)
+    for frames in iter_chunks(n_frames, chunk_size):
+        chunk = coordinates[frames]
+        distances[frames] = np.linalg.norm(chunk[:, i, :] - chunk[:, j, :], axis=-1)
+    return distances
 
-        thresholds: ndarray of shape (n_keypoints,)
-            Distance thresholds used to classify outlier timepoints for each keypoint.
-    """
-    distances = get_distance_to_medoid(coordinates)  # (n_frames, n_keypoints)
-    medians = np.median(distances, axis=0)  # (n_keypoints,)
-    MADs = np.median(np.abs(distances - medians[None, :]), axis=0)  # (n_keypoints,)
-    outlier_thresholds = MADs * outlier_scale_factor + medians  # (n_keypoints,)
-    outlier_mask = distances > outlier_thresholds[None, :]  # (n_frames, n_keypoints)
-    return {"mask": outlier_mask, "thresholds": outlier_thresholds}
 
+def pair_values_to_square(pair_values: np.ndarray, n_keypoints: int) -> np.ndarray:
+    """Expand per-pair values of shape (n_pairs,) to a symmetric (n_keypoints, n_keypoints)
+    matrix with a zero diagonal."""
+    i, j = get_keypoint_pair_indexes(n_keypoints)
+    square = np.zeros((n_keypoints, n_keypoints), dtype=pair_values.dtype)
+    square[i, j] = pair_values
+    square[j, i] = pair_values
+    return square
 
-def find_velocity_outliers(
-    coordinates: np.ndarray, outlier_scale_factor: float = 4.0, fps: float = 30.0, **kwargs
-) -> dict[str, np.ndarray]:
-    velocities = get_keypoint_velocities(coordinates, fps)
 
-    medians = np.median(velocities, axis=0)
-    MADs = np.median(np.abs(velocities - medians[None, :]), axis=0)
+def get_pair_incidence(n_keypoints: int) -> np.ndarray:
+    """Matrix of shape (n_pairs, n_keypoints) with 1 where the keypoint belongs to the pair."""
+    i, j = get_keypoint_pair_indexes(n_keypoints)
+    incidence = np.zeros((len(i), n_keypoints), dtype=np.int32)
+    incidence[np.arange(len(i)), i] = 1
+    incidence[np.arange(len(j)), j] = 1
+    return incidence
 
-    outlier_thresholds = MADs * outlier_scale_factor + medians
 
-    outlier_mask = velocities > outlier_thresholds[None, :]
+def count_pair_outliers_per_keypoint(pair_outlier_mask: np.ndarray, incidence: np.ndarray) -> np.ndarray:
+    """Count, for each frame and keypoint, the outlier pairs that involve the keypoint.
 
-    return {"mask": outlier_mask, "thresholds": outlier_thresholds}
+    `pair_outlier_mask` has shape (n_frames, n_pairs) and `incidence` comes from
+    `get_pair_incidence`. Returns an array of shape (n_frames, n_keypoints).
+    """
+    return pair_outlier_mask.astype(np.int32) @ incidence
 
 
-# Se o keypoint for anormalmente distante de X% dos outros keypoints, ele é considerado um outlier.
-def find_keypoint_distance_outliers(
+def get_chunk_outlier_values(
     coordinates: np.ndarray,
-    outlier_scale_factor: float = 6.0,
-    outlier_threshold_percentage: float = 0.5, #X%
-    **kwargs,
+    frames: slice,
+    detectors: tuple[str, ...],
+    fps: float = 30.0,
+    dtype=None,
 ) -> dict[str, np.ndarray]:
-    distances = get_keypoint_to_keypoint_distances(
-        coordinates
-    )  # (n_frames, n_keypoints, n_keypoints)
-    n_frames, n_keypoints, _ = distances.shape
+    """Compute the values thresholded by each detector for one chunk of frames.
 
-    medians = np.median(distances, axis=0)  # (n_keypoints, n_keypoints)
-    MADs = np.median(np.abs(distances - medians[None, :, :]), axis=0)  # (n_keypoints, n_keypoints)
+    - "medoid": distance to the medoid, shape (n_chunk_frames, n_keypoints).
+    - "velocity": speed of the step arriving at each frame of the chunk, skipping frame 0
+      (which has no previous frame), shape (n_chunk_steps, n_keypoints).
+    - "keypoint_distance": compact pair distances, shape (n_chunk_frames, n_pairs).
+    """
+    values = {}
+    chunk = coordinates[frames]
+    if "medoid" in detectors:
+        values["medoid"] = get_distance_to_medoid(chunk)
+    if "velocity" in detectors:
+        first_step_frame = max(frames.start, 1)
+        values["velocity"] = get_keypoint_velocities(coordinates[first_step_frame - 1 : frames.stop], fps)
+    if "keypoint_distance" in detectors:
+        values["keypoint_distance"] = get_keypoint_pair_distances(chunk, dtype=dtype, chunk_size=len(chunk) or 1)
+    return values
+
+
+def get_chunk_value_rows(frames: slice, detector: str) -> slice:
+    """Rows of the detector values that correspond to a chunk of frames."""
+    if detector == "velocity":
+        return slice(max(frames.start, 1) - 1, max(frames.stop - 1, 0))
+    return frames
+
+
+def find_outliers(
+    coordinates: np.ndarray,
+    use_medoid_outliers: bool = True,
+    use_velocity_outliers: bool = False,
+    use_keypoint_distance_outliers: bool = True,
+    medoid_outlier_scale_factor: float = 4.0,
+    velocity_outlier_scale_factor: float = 4.0,
+    keypoint_distance_outlier_scale_factor: float = 4.0,
+    keypoint_distance_outlier_threshold_percentage: float = 0.3,
+    fps: float = 30.0,
+    outlier_threshold_method: str = "median",
+    outlier_sketch_relative_error: float = 0.01,
+    chunk_size: int = 4096,
+    dtype=None,
+    **kwargs,
+) -> dict:
+    """Fused medoid distance, velocity and keypoint distance outlier detection.
 
-    outlier_thresholds = MADs * outlier_scale_factor + medians  # (n_keypoints, n_keypoints)
+    The distances to the medoid, the frame-to-frame velocities and the pair distances are
+    computed together in a single chunked pass over the coordinates, so the only full-size
+    arrays are the compact per-detector values (no (n_frames, K, K, D) temporaries). With the
+    "sketch" threshold method nothing full-size is stored: a first pass fills one sketch per
+    detector and a second pass computes the masks.
 
-    distance_outlier_mask = (
-        distances > outlier_thresholds[None, :, :]
-    )  # (n_frames, n_keypoints, n_keypoints)
+    Each detector thresholds its values at median + scale factor * MAD of each column
+    (keypoint or keypoint pair). Velocity outliers are aligned to frames: a step t -> t+1
+    above the threshold marks frame t+1. A keypoint is a keypoint distance outlier when its
+    distance to at least `keypoint_distance_outlier_threshold_percentage` of the other
+    keypoints is above the threshold of the pair.
 
-    keypoint_outlier_mask = np.zeros((n_frames, n_keypoints), dtype=bool)
+    Parameters
+    -------
+    coordinates: ndarray of shape (n_frames, n_keypoints, keypoint_dim)
+        Keypoint coordinates where keypoint_dim is 2 or 3.
 
-    for f in range(n_frames):
-        for i in range(n_keypoints):
-            distances_from_i = distance_outlier_mask[f, i, :]  # (n_keypoints,)
+    use_medoid_outliers, use_velocity_outliers, use_keypoint_distance_outliers: bool
+        Which detectors to run.
 
-            outlier_count = np.sum(
-                distances_from_i
-            )
-            total_other_keypoints = n_keypoints - 1
+    medoid_outlier_scale_factor, velocity_outlier_scale_factor,
+    keypoint_distance_outlier_scale_factor: float
+        MAD multipliers of each detector.
 
-            if outlier_count >= outlier_threshold_percentage * total_other_keypoints:
-                keypoint_outlier_mask[f, i] = True
+    keypoint_distance_outlier_threshold_percentage: float, default=0.3
+        Fraction of the other keypoints from which a keypoint must be an outlier.
 
-    return {
-        "mask": keypoint_outlier_mask,
-        "thresholds": outlier_thresholds,
-        "distance_outlier_mask": distance_outlier_mask,
+    fps: float, default=30.0
+        Frame rate, used to scale the velocities.
+
+    outlier_threshold_method: str, default="median"
+        How medians and MADs are computed: "median", "partition" (see `get_mad_thresholds`)
+        or "sketch" (see `sketch_mad_thresholds`).
+
+    outlier_sketch_relative_error: float, default=0.01
+        Relative error bound of the "sketch" method.
+
+    chunk_size: int, default=4096
+        Number of frames per chunk.
+
+    dtype: numpy dtype, optional
+        Dtype of the pair distances; defaults to the dtype of `coordinates`, so float64
+        coordinates are thresholded in float64 and float32 is only used when the coordinates
+        are float32 (see `precision` in config.yml).
+
+    **kwargs
+        Additional keyword arguments (ignored), usually overflow from **config().
+
+    Returns
+    -------
+    result: dict with the following items
+
+        mask: ndarray of shape (n_frames, n_keypoints)
+            Union of the masks of the enabled detectors.
+
+        {detector}_outliers: dict with "mask" (n_frames, n_keypoints) and "thresholds"
+            One entry per enabled detector ("medoid", "velocity", "keypoint_distance").
+
+        {detector}_thresholds: ndarray
+            Shortcut to the thresholds of each enabled detector.
+    """
+    n_frames, n_keypoints, _ = coordinates.shape
+    dtype = dtype or coordinates.dtype
+    enabled = {
+        "medoid": use_medoid_outliers,
+        "velocity": use_velocity_outliers,
+        "keypoint_distance": use_keypoint_distance_outliers,
+    }
+    detectors = tuple(detector for detector in OUTLIER_DETECTORS if enabled[detector])
+    scale_factors = {
+        "medoid": medoid_outlier_scale_factor,
+        "velocity": velocity_outlier_scale_factor,
+        "keypoint_distance": keypoint_distance_outlier_scale_factor,
     }
+    n_rows = {"medoid": n_frames, "velocity": max(n_frames - 1, 0), "keypoint_distance": n_frames}
+    n_columns = {"medoid": n_keypoints, "velocity": n_keypoints, "keypoint_distance": n_keypoints * (n_keypoints - 1) // 2}
+
+    thresholds = {}
+    masks = {}
+    # Sem valores (gravação vazia, ou um frame só para a velocidade) não há mediana: máscara vazia e
+    # limiares NaN, como os do `np.median` de um array vazio
+    for detector in detectors:
+        if n_rows[detector] == 0:
+            thresholds[detector] = np.full(n_columns[detector], np.nan, dtype=dtype)
+            masks[detector] = np.zeros((0, n_columns[detector]), dtype=bool)
+    computed = tuple(detector for detector in detectors if detector not in masks)
+
+    def iter_chunk_values():
+        for frames in iter_chunks(n_frames, chunk_size):
+            yield frames, get_chunk_outlier_values(coordinates, frames, computed, fps, dtype)
+
+    if outlier_threshold_method == "sketch":
+        sketches = {}
+        for _, chunk_values in iter_chunk_values():
+            for detector, chunk in chunk_values.items():
+                if detector not in sketches:
+                    sketches[detector] = QuantileSketch(chunk.shape[1], outlier_sketch_relative_error)
+                sketches[detector].update(chunk)
+
+        for frames, chunk_values in iter_chunk_values():
+            for detector, chunk in chunk_values.items():
+                if detector not in masks:
+                    thresholds[detector] = sketch_mad_thresholds(
+                        sketches[detector], scale_factors[detector], dtype=chunk.dtype
+                    )
+                    masks[detector] = np.empty((n_rows[detector], chunk.shape[1]), dtype=bool)
+                rows = get_chunk_value_rows(frames, detector)
+                masks[detector][rows] = chunk > thresholds[detector][None, :]
+    else:
+        values = {}
+        for frames, chunk_values in iter_chunk_values():
+            for detector, chunk in chunk_values.items():
+                if detector not in values:
+                    values[detector] = np.empty((n_rows[detector], chunk.shape[1]), dtype=chunk.dtype)
+                values[detector][get_chunk_value_rows(frames, detector)] = chunk
+
+        for detector in computed:
+            thresholds[detector] = get_mad_thresholds(
+                values[detector], scale_factors[detector], method=outlier_threshold_method
+            )
+            masks[detector] = values[detector] > thresholds[detector][None, :]
+
+    result = {}
+    combined_mask = np.zeros((n_frames, n_keypoints), dtype=bool)
+
+    if "medoid" in masks:
+        result["medoid_outliers"] = {"mask": masks["medoid"], "thresholds": thresholds["medoid"]}
+
+    if "velocity" in masks:
+        velocity_mask = np.zeros((n_frames, n_keypoints), dtype=bool)
+        velocity_mask[1:] = masks["velocity"]
+        result["velocity_outliers"] = {"mask": velocity_mask, "thresholds": thresholds["velocity"]}
+
+    if "keypoint_distance" in masks:
+        incidence = get_pair_incidence(n_keypoints)
+        min_outlier_count = keypoint_distance_outlier_threshold_percentage * (n_keypoints - 1)
+        keypoint_mask = np.empty((n_frames, n_keypoints), dtype=bool)
+        for frames in iter_chunks(n_frames, chunk_size):
+            outlier_counts = count_pair_outliers_per_keypoint(masks["keypoint_distance"][frames], incidence)
+            keypoint_mask[frames] = outlier_counts >= min_outlier_count
+        result["keypoint_distance_outliers"] = {
+            "mask": keypoint_mask,
+            "thresholds": pair_values_to_square(thresholds["keypoint_distance"], n_keypoints),
+            "pair_thresholds": thresholds["keypoint_distance"],
+        }
+
+    for detector in detectors:
+        combined_mask |= result[f"{detector}_outliers"]["mask"]
+        result[f"{detector}_thresholds"] = result[f"{detector}_outliers"]["thresholds"]
+    result["mask"] = combined_mask
+    return result
+
+
+def decimate_trace(trace: np.ndarray, max_points: int) -> tuple[np.ndarray, np.ndarray]:
+    """Downsample a 1-D trace keeping its shape (min/max per bin).
+
+    The frames are split in `max_points // 2` bins and only the minimum and the maximum of each
+    bin are kept, in their original order, so peaks (eg. outliers) survive the downsampling.
+    With one bin per pixel column the plotted line looks the same as the full trace.
+
+    Parameters
+    -------
+    trace: ndarray of shape (n_frames,)
+
+    max_points: int
+        Maximum number of points returned.
+
+    Returns
+    -------
+    frames, values: ndarrays of shape (<= max_points,)
+    """
+    n_frames = len(trace)
+    n_bins = max(max_points // 2, 1)
+    if n_frames <= 2 * n_bins:
+        return np.arange(n_frames), trace
+
+    bin_size = -(-n_frames // n_bins)
+    padded = np.full(bin_size * (-(-n_frames // bin_size)), np.nan, dtype=np.float64)
+    padded[:n_frames] = trace
+    bins = padded.reshape(-1, bin_size)
+    nan_mask = np.isnan(bins)
+    argmins = np.argmin(np.where(nan_mask, np.inf, bins), axis=1)
+    argmaxs = np.argmax(np.where(nan_mask, -np.inf, bins), axis=1)
+
+    offsets = np.arange(len(bins))[:, None] * bin_size
+    frames = np.sort(np.stack([argmins, argmaxs], axis=1), axis=1) + offsets
+    frames = np.minimum(frames.ravel(), n_frames - 1)
+    return frames, trace[frames]
+
+
+def get_outlier_intervals(mask: np.ndarray, min_gap: int = 1) -> list[tuple[np.ndarray, np.ndarray]]:
+    """Run-length encode the outlier frames of each keypoint.
+
+    Returns, for each column of `mask` (n_frames, n_keypoints), the first frames and the
+    frames after the last one of its runs of outliers. Runs separated by less than `min_gap`
+    frames are merged (eg. gaps narrower than a pixel of the plot).
+    """
+    _, keypoints, starts, ends = find_outlier_runs([mask])
+    if min_gap > 1 and len(starts) > 1:
+        # Junta um run ao anterior (do mesmo keypoint) se o intervalo entre eles é pequeno
+        new_run = np.ones(len(starts), dtype=bool)
+        new_run[1:] = (keypoints[1:] != keypoints[:-1]) | (starts[1:] - ends[:-1] >= min_gap)
+        run_starts = np.flatnonzero(new_run)
+        run_ends = np.append(run_starts[1:], len(starts)) - 1
+        keypoints, starts, ends = keypoints[run_starts], starts[run_starts], ends[run_ends]
+    # Os runs vêm ordenados por keypoint
+    splits = np.searchsorted(keypoints, np.arange(1, mask.shape[1]))
+    return list(zip(np.split(starts, splits), np.split(ends, splits)))
+
+
+def shade_outlier_intervals(ax: plt.Axes, starts: np.ndarray, ends: np.ndarray, **kwargs) -> None:
+    """Shade the frame intervals [start, end) over the full height of `ax` with a single
+    collection (instead of one `axvspan` per frame)."""
+    if len(starts) == 0:
+        return
+    left, right = starts - 0.5, ends - 0.5
+    vertices = np.stack(
+        [
+            np.stack([left, np.zeros_like(left)], axis=1),
+            np.stack([left, np.ones_like(left)], axis=1),
+            np.stack([right, np.ones_like(right)], axis=1),
+            np.stack([right, np.zeros_like(right)], axis=1),
+        ],
+        axis=1,
+    )
+    collection = PolyCollection(
+        vertices,
+        transform=ax.get_xaxis_transform(),
+        **{"alpha": 0.1, "facecolor": "grey", "edgecolor": "none", **kwargs},
+    )
+    ax.add_collection(collection, autolim=False)
 
 
 def plot_keypoint_traces(
@@ -149,6 +443,7 @@ def plot_keypoint_traces(
     line_labels: Optional[list[str]] = None,
     thresholds: Optional[np.ndarray] = None,
     shading_mask: Optional[np.ndarray] = None,
+    max_points: Optional[int] = None,
 ) -> plt.Figure:
     """Create a multi-panel plot showing keypoint traces over time (used to visualize outliers).
 
@@ -180,6 +475,10 @@ def plot_keypoint_traces(
         Boolean mask indicating frames to shade (e.g., outlier frames).
         True values will be shaded in grey.
 
+    max_points: int, optional
+        Maximum number of points plotted per trace (see `decimate_trace`). Defaults to two
+        points per pixel column of the saved figure.
+
     Returns
     -------
     fig: matplotlib.figure.Figure
@@ -210,22 +509,28 @@ def plot_keypoint_traces(
                 f"Shading mask shape {shading_mask.shape} must match traces shape {traces[0].shape}"
             )
 
-    fig, axes = plt.subplots(n_keypoints, 1, figsize=(16, 3 * n_keypoints), constrained_layout=True)
+    if max_points is None:
+        max_points = QA_PLOT_WIDTH * QA_PLOT_DPI
+
+    fig, axes = plt.subplots(
+        n_keypoints, 1, figsize=(QA_PLOT_WIDTH, 3 * n_keypoints), constrained_layout=True
+    )
     if n_keypoints == 1:
         axes = [axes]  # Ensure axes is always a list
 
+    outlier_intervals = None
+    if shading_mask is not None:
+        outlier_intervals = get_outlier_intervals(shading_mask, min_gap=len(shading_mask) // max_points)
+
     for keypoint_idx in range(n_keypoints):
         ax = axes[keypoint_idx]
 
-        if shading_mask is not None:
-            shaded_frames = np.where(shading_mask[:, keypoint_idx])[0]
-            if len(shaded_frames) > 0:
-                for frame in shaded_frames:
-                    ax.axvspan(frame - 0.5, frame + 0.5, alpha=0.1, color="grey")
+        if outlier_intervals is not None:
+            shade_outlier_intervals(ax, *outlier_intervals[keypoint_idx])
 
         for line_idx, trace_array in enumerate(traces):
             label = line_labels[line_idx] if line_labels else f"Line {line_idx}"
-            ax.plot(trace_array[:, keypoint_idx], label=label)
+            ax.plot(*decimate_trace(trace_array[:, keypoint_idx], max_points), label=label)
 
         if thresholds is not None:
             threshold_value = thresholds[keypoint_idx]
@@ -300,14 +605,14 @@ def plot_medoid_distance_outliers(
     Returns
     -------
     None
-        The plot is saved to 'QA/plots/keypoint_distance_outliers/{recording_name}.png'.
+        The plot is saved to 'QA/plots/medoid_distance_outliers/{recording_name}.png'.
     """
 
     plot_path = os.path.join(
         project_dir,
         "quality_assurance",
         "plots",
-        "keypoint_distance_outliers",
+        "medoid_distance_outliers",
         f"{recording_name}.png",
     )
     os.makedirs(os.path.dirname(plot_path), exist_ok=True)
@@ -326,9 +631,9 @@ def plot_medoid_distance_outliers(
         shading_mask=outlier_mask,
     )
 
-    fig.savefig(plot_path, dpi=300)
-    plt.close()
-    print(f"Saved keypoint distance outlier plot for {recording_name} to {plot_path}.")
+    fig.savefig(plot_path, dpi=QA_PLOT_DPI)
+    plt.close(fig)
+    print(f"Saved medoid distance outlier plot for {recording_name} to {plot_path}.")
 
 
 def plot_velocity_outliers(
@@ -358,6 +663,10 @@ def plot_velocity_outliers(
         interpolated_coordinates, fps
     )  # (n_frames-1, n_keypoints)
 
+    # A máscara de velocidade é alinhada aos frames: o passo t -> t+1 marca o frame t+1
+    if len(outlier_mask) == len(original_velocities) + 1:
+        outlier_mask = outlier_mask[1:]
+
     fig = plot_keypoint_traces(
         traces=[original_velocities, interpolated_velocities],
         plot_title=f"{recording_name} - Velocity Outliers",
@@ -367,8 +676,8 @@ def plot_velocity_outliers(
         shading_mask=outlier_mask,
     )
 
-    fig.savefig(plot_path, dpi=300)
-    plt.close()
+    fig.savefig(plot_path, dpi=QA_PLOT_DPI)
+    plt.close(fig)
     print(f"Saved keypoint velocity outlier plot for {recording_name} to {plot_path}.")
 
 
@@ -380,6 +689,7 @@ def plot_keypoint_distance_outliers(
     outlier_mask: np.ndarray,
     outlier_thresholds: np.ndarray,
     bodyparts: list[str],
+    max_points: Optional[int] = None,
     **kwargs,
 ):
     plot_path = os.path.join(
@@ -391,14 +701,20 @@ def plot_keypoint_distance_outliers(
     )
     os.makedirs(os.path.dirname(plot_path), exist_ok=True)
 
-    # Calculate keypoint-to-keypoint distances
-    original_distances = get_keypoint_to_keypoint_distances(original_coordinates)
-    interpolated_distances = get_keypoint_to_keypoint_distances(interpolated_coordinates)
+    # Distâncias só dos pares únicos (n_frames, n_pairs)
+    original_distances = get_keypoint_pair_distances(original_coordinates)
+    interpolated_distances = get_keypoint_pair_distances(interpolated_coordinates)
 
-    n_frames, n_keypoints, _ = original_distances.shape
+    n_keypoints = original_coordinates.shape[1]
+    pair_indexes = pair_values_to_square(np.arange(original_distances.shape[1]), n_keypoints)
+    if max_points is None:
+        max_points = QA_PLOT_WIDTH * QA_PLOT_DPI
+    outlier_intervals = get_outlier_intervals(outlier_mask, min_gap=len(outlier_mask) // max_points)
 
     # Create a figure with subplots for each keypoint
-    fig, axes = plt.subplots(n_keypoints, 1, figsize=(16, 3 * n_keypoints), constrained_layout=True)
+    fig, axes = plt.subplots(
+        n_keypoints, 1, figsize=(QA_PLOT_WIDTH, 3 * n_keypoints), constrained_layout=True
+    )
     if n_keypoints == 1:
         axes = [axes]
 
@@ -406,24 +722,23 @@ def plot_keypoint_distance_outliers(
         ax = axes[keypoint_idx]
 
         # Shade outlier frames
-        shaded_frames = np.where(outlier_mask[:, keypoint_idx])[0]
-        if len(shaded_frames) > 0:
-            for frame in shaded_frames:
-                ax.axvspan(frame - 0.5, frame + 0.5, alpha=0.1, color="grey")
+        shade_outlier_intervals(ax, *outlier_intervals[keypoint_idx])
 
         # Plot distances from this keypoint to all other keypoints
         for other_keypoint_idx in range(n_keypoints):
             if other_keypoint_idx != keypoint_idx:
+                pair_idx = pair_indexes[keypoint_idx, other_keypoint_idx]
+
                 # Original distances
                 ax.plot(
-                    original_distances[:, keypoint_idx, other_keypoint_idx],
+                    *decimate_trace(original_distances[:, pair_idx], max_points),
                     alpha=0.7,
                     label=f"Original to {bodyparts[other_keypoint_idx]}",
                 )
 
                 # Interpolated distances
                 ax.plot(
-                    interpolated_distances[:, keypoint_idx, other_keypoint_idx],
+                    *decimate_trace(interpolated_distances[:, pair_idx], max_points),
                     alpha=0.7,
                     linestyle="--",
                     label=f"Interpolated to {bodyparts[other_keypoint_idx]}",
@@ -440,184 +755,248 @@ def plot_keypoint_distance_outliers(
         ax.grid(True, alpha=0.3)
 
     fig.suptitle(f"{recording_name} - Keypoint Distance Outliers", fontsize=16)
-    fig.savefig(plot_path, dpi=300)
-    plt.close()
+    fig.savefig(plot_path, dpi=QA_PLOT_DPI)
+    plt.close(fig)
     print(f"Saved keypoint distance outlier plot for {recording_name} to {plot_path}.")
 
 
+DETECTOR_PLOTS = {
+    "medoid": plot_medoid_distance_outliers,
+    "velocity": plot_velocity_outliers,
+    "keypoint_distance": plot_keypoint_distance_outliers,
+}
+
+
+def plot_recording_outliers(
+    project_dir: str,
+    recording_name: str,
+    original_coordinates: np.ndarray,
+    interpolated_coordinates: np.ndarray,
+    combined_outliers: dict,
+    config: dict,
+) -> float:
+    """Save the QA plots of every detector that ran on one recording (see `DETECTOR_PLOTS`).
+
+    Only reads its arguments and writes the figures to disk, so it can run in a worker
+    process while the next recording is being filtered. Returns the time spent, in seconds.
+    """
+    start_time = time.perf_counter()
+    for detector in OUTLIER_DETECTORS:
+        if f"{detector}_outliers" not in combined_outliers:
+            continue
+        DETECTOR_PLOTS[detector](
+            project_dir,
+            recording_name,
+            original_coordinates,
+            interpolated_coordinates,
+            combined_outliers[f"{detector}_outliers"]["mask"],
+            combined_outliers[f"{detector}_thresholds"],
+            **config,
+        )
+    return time.perf_counter() - start_time
+
+
+def get_outlier_detection_params(config: dict, **overrides) -> dict:
+    """Detection parameters of `filter_outliers`: explicit (non-None) overrides, then the
+    values in config.yml, then `DEFAULT_DETECTION_PARAMS`."""
+    params = {}
+    for key, default in DEFAULT_DETECTION_PARAMS.items():
+        if overrides.get(key) is not None:
+            params[key] = overrides[key]
+        else:
+            params[key] = config.get(key, default)
+    return params
+
+
+def detect_outliers(raw_coords: np.ndarray, config: dict, **detection_params) -> dict:
+    """Run the enabled outlier detectors on one recording (see `find_outliers`), in the dtype
+    of `precision` in config.yml (see `get_precision_dtype`)."""
+    dtype = get_precision_dtype(config)
+    return find_outliers(raw_coords.astype(dtype, copy=False), **{**config, **detection_params, "dtype": dtype})
+
+
+def clean_recording(
+    raw_coords: np.ndarray,
+    confidences: np.ndarray,
+    combined_outliers: dict,
+) -> tuple[np.ndarray, np.ndarray]:
+    """Interpolate the outlier keypoints and zero their confidences."""
+    coordinates = interpolate_keypoints(raw_coords, combined_outliers["mask"])
+    confidences = np.where(combined_outliers["mask"], 0, confidences)
+    return coordinates, confidences
+
+
+def filter_recording(
+    raw_coords: np.ndarray,
+    confidences: np.ndarray,
+    config: dict,
+    combined_outliers: Optional[dict] = None,
+    **detection_params,
+) -> tuple[np.ndarray, np.ndarray, dict]:
+    """Detect (unless `combined_outliers` is given, eg. from the cache) and clean the
+    outliers of one recording. Runs in the worker processes of `filter_outliers`."""
+    if combined_outliers is None:
+        combined_outliers = detect_outliers(raw_coords, config, **detection_params)
+    coordinates, confidences = clean_recording(raw_coords, confidences, combined_outliers)
+    return coordinates, confidences, combined_outliers
+
+
+def ordered_pool_map(fn: callable, args_list: list, n_workers: int = 1, max_pending: int = None):
+    """Yield `fn(*args)` for each args tuple in `args_list`, in the original order.
+
+    With `n_workers > 1` the calls run in a process pool. At most `max_pending` calls
+    (default 2 * n_workers) are in flight, so only a few recordings are pickled to the
+    workers ahead of the one being consumed.
+    """
+    if n_workers <= 1:
+        for args in args_list:
+            yield fn(*args)
+        return
+
+    max_pending = max_pending or 2 * n_workers
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        pending = deque()
+        args_iter = iter(args_list)
+        for args in islice(args_iter, max_pending):
+            pending.append(executor.submit(fn, *args))
+        while pending:
+            result = pending.popleft().result()
+            for args in islice(args_iter, 1):
+                pending.append(executor.submit(fn, *args))
+            yield result
+
+
 def filter_outliers(
     coordinates: np.ndarray,
     confidences: np.ndarray,
     config: dict,
     cb: callable = None,
-    use_keypoint_distance_outliers: bool = True,
-    keypoint_distance_outlier_scale_factor: float = 4.0,
-    keypoint_distance_outlier_threshold_percentage: float = 0.3,
+    use_keypoint_distance_outliers: bool = None,
+    keypoint_distance_outlier_scale_factor: float = None,
+    keypoint_distance_outlier_threshold_percentage: float = None,
     project_dir: str = None,
+    n_workers: int = None,
 ) -> tuple[np.ndarray, np.ndarray]:
-    cache_path = get_cache_path(project_dir) if project_dir else None
-    
-    for i, recording_name in enumerate(coordinates):
-        print(f"{i+1}/{len(coordinates)}: {recording_name}")
-        raw_coords = coordinates[recording_name].copy()
-        
-        cache_key = None
-        cached_masks = None
-        
-        if cache_path:
-            cache_key = generate_cache_key(
-                recording_name,
-                raw_coords.shape,
-                4.0,
-                use_keypoint_distance_outliers,
-                keypoint_distance_outlier_scale_factor,
-                keypoint_distance_outlier_threshold_percentage,
+    """Remove the outliers of every recording (detection, interpolation and confidences).
+
+    With `n_workers > 1` (or `outlier_n_workers` in config.yml) the recordings are processed
+    in a process pool. Results are consumed in the original order in this process, which
+    also runs `cb` and is the only writer of the mask cache.
+
+    The detectors are switched on and off from config.yml (`use_medoid_outliers`,
+    `use_velocity_outliers`, `use_keypoint_distance_outliers`, see `DEFAULT_DETECTION_PARAMS`)
+    and run fused in a single pass (see `find_outliers`).
+
+    The cache (see `OutlierCache`) is keyed by a hash of the coordinates, the confidences and
+    every detection parameter, and capped at `outlier_cache_max_bytes` from config.yml. It
+    stores the masks and the final clean coordinates and confidences, so a hit skips both
+    the detection and the interpolation.
+    """
+    if n_workers is None:
+        n_workers = config.get("outlier_n_workers", 1)
+    cache = (
+        OutlierCache(project_dir, config.get("outlier_cache_max_bytes", DEFAULT_MAX_BYTES))
+        if project_dir
+        else None
+    )
+
+    detection_params = get_outlier_detection_params(
+        config,
+        use_keypoint_distance_outliers=use_keypoint_distance_outliers,
+        keypoint_distance_outlier_scale_factor=keypoint_distance_outlier_scale_factor,
+        keypoint_distance_outlier_threshold_percentage=keypoint_distance_outlier_threshold_percentage,
+    )
+    cache_params = get_outlier_cache_params(config, detection_params)
+
+    recording_names = list(coordinates)
+    cache_keys = {}
+    cached_results = {}
+    jobs = []
+    for recording_name in recording_names:
+        raw_coords = coordinates[recording_name]
+        cached_outliers = None
+
+        if cache:
+            cache_keys[recording_name] = hash_arrays(
+                raw_coords, confidences[recording_name], params=cache_params
             )
-            cached_masks = load_cached_masks(cache_path, cache_key)
-        
-        if cached_masks:
-            print(f"  Using cached masks for {recording_name}")
-            medoid_outliers = {
-                "mask": cached_masks["medoid_mask"],
-                "thresholds": cached_masks["medoid_thresholds"],
-            }
-            
-            if use_keypoint_distance_outliers:
-                keypoint_distance_outliers = {
-                    "mask": cached_masks["keypoint_distance_mask"],
-                    "thresholds": cached_masks["keypoint_distance_thresholds"],
-                }
-                combined_mask = cached_masks["combined_mask"]
-                
-                combined_outliers = {
-                    "mask": combined_mask,
-                    "medoid_thresholds": medoid_outliers["thresholds"],
-                    "keypoint_distance_thresholds": keypoint_distance_outliers["thresholds"],
-                    "medoid_outliers": medoid_outliers,
-                    "keypoint_distance_outliers": keypoint_distance_outliers,
-                }
-            else:
-                combined_outliers = medoid_outliers
+            cached_entry = cache.load(cache_keys[recording_name])
+            if cached_entry:
+                cached_outliers = cached_masks_to_outliers(cached_entry)
+                if "coordinates" in cached_entry:
+                    cached_results[recording_name] = (
+                        cached_entry["coordinates"],
+                        cached_entry["confidences"],
+                        cached_outliers,
+                    )
+                    continue
+
+        jobs.append((raw_coords, confidences[recording_name], config, cached_outliers))
+
+    if n_workers > 1 and jobs:
+        print(f"Filtering outliers of {len(jobs)} recordings with {n_workers} workers")
+
+    computed_results = ordered_pool_map(
+        partial(filter_recording, **detection_params), jobs, n_workers=n_workers
+    )
+    combined_outliers = None
+    for i, recording_name in enumerate(recording_names):
+        print(f"{i+1}/{len(recording_names)}: {recording_name}")
+        raw_coords = coordinates[recording_name]
+
+        if recording_name in cached_results:
+            print(f"  Using cached clean coordinates for {recording_name}")
+            result = cached_results.pop(recording_name)
         else:
-            print(f"  Computing masks for {recording_name}")
-            medoid_outliers = find_medoid_distance_outliers(
-                raw_coords, outlier_scale_factor=4.0, **config
-            )
-
-            if use_keypoint_distance_outliers:
-                keypoint_distance_outliers = find_keypoint_distance_outliers(
-                    raw_coords,
-                    outlier_scale_factor=keypoint_distance_outlier_scale_factor,
-                    outlier_threshold_percentage=keypoint_distance_outlier_threshold_percentage,
-                    **config,
+            print(f"  Computing clean coordinates for {recording_name}")
+            result = next(computed_results)
+            if cache:
+                cache.save(
+                    cache_keys[recording_name],
+                    {
+                        **outliers_to_cached_masks(result[2]),
+                        "coordinates": result[0],
+                        "confidences": result[1],
+                    },
                 )
 
-                combined_mask = medoid_outliers["mask"] | keypoint_distance_outliers["mask"]
-
-                combined_outliers = {
-                    "mask": combined_mask,
-                    "medoid_thresholds": medoid_outliers["thresholds"],
-                    "keypoint_distance_thresholds": keypoint_distance_outliers["thresholds"],
-                    "medoid_outliers": medoid_outliers,
-                    "keypoint_distance_outliers": keypoint_distance_outliers,
-                }
-            else:
-                combined_outliers = medoid_outliers
-            
-            if cache_path and cache_key:
-                masks_to_cache = {
-                    "medoid_mask": medoid_outliers["mask"],
-                    "medoid_thresholds": medoid_outliers["thresholds"],
-                }
-                if use_keypoint_distance_outliers:
-                    masks_to_cache.update({
-                        "keypoint_distance_mask": keypoint_distance_outliers["mask"],
-                        "keypoint_distance_thresholds": keypoint_distance_outliers["thresholds"],
-                        "combined_mask": combined_mask,
-                    })
-                save_cached_masks(cache_path, cache_key, masks_to_cache)
-
-        coordinates[recording_name] = kpms.interpolate_keypoints(
-            raw_coords, combined_outliers["mask"]
-        )
-        confidences[recording_name] = np.where(
-            combined_outliers["mask"], 0, confidences[recording_name]
-        )
+        coordinates[recording_name], confidences[recording_name], combined_outliers = result
 
         if cb is not None:
             cb(coordinates, confidences, combined_outliers, recording_name, raw_coords)
 
+    if cache:
+        cache.record_stats()
+        print(cache.summary())
+
     return coordinates, confidences, combined_outliers
 
-def generate_cache_key(
-    recording_name: str,
-    data_shape: tuple,
-    medoid_scale_factor: float,
-    use_keypoint_distance_outliers: bool,
-    keypoint_distance_outlier_scale_factor: float,
-    keypoint_distance_outlier_threshold_percentage: float,
-) -> str:
-    params = {
-        "recording_name": recording_name,
-        "data_shape": data_shape,
-        "medoid_scale_factor": medoid_scale_factor,
-        "use_keypoint_distance_outliers": use_keypoint_distance_outliers,
-        "keypoint_distance_outlier_scale_factor": keypoint_distance_outlier_scale_factor,
-        "keypoint_distance_outlier_threshold_percentage": keypoint_distance_outlier_threshold_percentage,
-    }
-    params_str = json.dumps(params, sort_keys=True)
-    return hashlib.md5(params_str.encode()).hexdigest()
 
+def get_outlier_cache_params(config: dict, detection_params: dict) -> dict:
+    """Every parameter, besides the coordinates themselves, that affects the detection."""
+    return {
+        **detection_params,
+        **{key: config[key] for key in OUTLIER_CONFIG_KEYS if key in config},
+        **FrameWindows.from_config(config).params(),
+    }
 
-def get_cache_path(project_dir: str) -> str:
-    return os.path.join(project_dir, "outlier_masks_cache.h5")
 
+def cached_masks_to_outliers(cached_masks: dict) -> dict:
+    combined_outliers = {"mask": cached_masks["combined_mask"]}
+    for detector in OUTLIER_DETECTORS:
+        if f"{detector}_mask" in cached_masks:
+            combined_outliers[f"{detector}_outliers"] = {
+                "mask": cached_masks[f"{detector}_mask"],
+                "thresholds": cached_masks[f"{detector}_thresholds"],
+            }
+            combined_outliers[f"{detector}_thresholds"] = cached_masks[f"{detector}_thresholds"]
+    return combined_outliers
 
-def load_cached_masks(cache_path: str, cache_key: str) -> Optional[dict]:
-    if not os.path.exists(cache_path):
-        return None
-    
-    try:
-        with h5py.File(cache_path, "r") as f:
-            if cache_key not in f:
-                return None
-            
-            group = f[cache_key]
-            masks = {}
-            
-            if "medoid_mask" in group:
-                masks["medoid_mask"] = group["medoid_mask"][:]
-            if "medoid_thresholds" in group:
-                masks["medoid_thresholds"] = group["medoid_thresholds"][:]
-            if "keypoint_distance_mask" in group:
-                masks["keypoint_distance_mask"] = group["keypoint_distance_mask"][:]
-            if "keypoint_distance_thresholds" in group:
-                masks["keypoint_distance_thresholds"] = group["keypoint_distance_thresholds"][:]
-            if "combined_mask" in group:
-                masks["combined_mask"] = group["combined_mask"][:]
-            
-            return masks
-    except Exception:
-        return None
-
-
-def save_cached_masks(cache_path: str, cache_key: str, masks: dict) -> None:
-    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
-    
-    with h5py.File(cache_path, "a") as f:
-        if cache_key in f:
-            del f[cache_key]
-        
-        group = f.create_group(cache_key)
-        
-        if "medoid_mask" in masks:
-            group.create_dataset("medoid_mask", data=masks["medoid_mask"], compression="gzip")
-        if "medoid_thresholds" in masks:
-            group.create_dataset("medoid_thresholds", data=masks["medoid_thresholds"], compression="gzip")
-        if "keypoint_distance_mask" in masks:
-            group.create_dataset("keypoint_distance_mask", data=masks["keypoint_distance_mask"], compression="gzip")
-        if "keypoint_distance_thresholds" in masks:
-            group.create_dataset("keypoint_distance_thresholds", data=masks["keypoint_distance_thresholds"], compression="gzip")
-        if "combined_mask" in masks:
-            group.create_dataset("combined_mask", data=masks["combined_mask"], compression="gzip")
 
+def outliers_to_cached_masks(combined_outliers: dict) -> dict:
+    masks = {"combined_mask": combined_outliers["mask"]}
+    for detector in OUTLIER_DETECTORS:
+        if f"{detector}_outliers" in combined_outliers:
+            masks[f"{detector}_mask"] = combined_outliers[f"{detector}_outliers"]["mask"]
+            masks[f"{detector}_thresholds"] = combined_outliers[f"{detector}_thresholds"]
+    return masks
@@ -0,0 +1,137 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+
+from utils.outlier_cache import hash_arrays
+
+FORMATTED_DIRNAME = "formatted_data"
+DATA_ARRAYS = ("Y", "conf", "mask")
+DEFAULT_MAX_ENTRIES = 2
+
+# Chaves do config.yml usadas por `kpms.format_data` (entram na chave dos dados formatados)
+FORMAT_CONFIG_KEYS = (
+    "bodyparts",
+    "use_bodyparts",
+    "conf_pseudocount",
+    "added_noise_level",
+    "seg_length",
+    "max_seg_length",
+    "max_percent_padding",
+    "min_fragment_length",
+)
+
+
+# keypoint-moseq e JAX são importados dentro das funções: este módulo é importado (via ProjectContext)
+# também pelos comandos que não usam o modelo
+
+
+def get_formatted_data_key(coordinates: dict, confidences: dict, config: dict) -> str:
+    """Hash of the recordings (names and arrays) and of the segmentation parameters."""
+    import keypoint_moseq as kpms  # type: ignore
+
+    hasher = hashlib.blake2b(digest_size=16)
+    for recording_name in sorted(coordinates):
+        hasher.update(recording_name.encode())
+        hasher.update(hash_arrays(coordinates[recording_name], confidences[recording_name]).encode())
+    params = {key: config.get(key) for key in FORMAT_CONFIG_KEYS}
+    params["kpms_version"] = getattr(kpms, "__version__", None)
+    hasher.update(json.dumps(params, sort_keys=True, default=str).encode())
+    return hasher.hexdigest()
+
+
+def load_formatted_entry(entry_dir: str) -> tuple[dict, tuple]:
+    """Data (memory-mapped, then `jax.device_put` as in `kpms.format_data`) and metadata of one
+    entry saved by `load_formatted_data`, eg. in the worker processes of a kappa scan."""
+    import jax  # type: ignore
+
+    arrays, metadata = _load_entry(entry_dir)
+    return jax.device_put(arrays), metadata
+
+
+def _load_entry(entry_dir: str) -> tuple[dict, tuple]:
+    arrays = {name: np.load(os.path.join(entry_dir, f"{name}.npy"), mmap_mode="r") for name in DATA_ARRAYS}
+    metadata = (
+        np.load(os.path.join(entry_dir, "keys.npy")),
+        np.load(os.path.join(entry_dir, "bounds.npy")),
+    )
+    return arrays, metadata
+
+
+def _save_entry(entry_dir: str, data: dict, metadata: tuple):
+    tmp_dir = entry_dir + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    for name in DATA_ARRAYS:
+        np.save(os.path.join(tmp_dir, f"{name}.npy"), np.asarray(data[name]))
+    keys, bounds = metadata
+    np.save(os.path.join(tmp_dir, "keys.npy"), np.asarray(keys))
+    np.save(os.path.join(tmp_dir, "bounds.npy"), np.asarray(bounds))
+    shutil.rmtree(entry_dir, ignore_errors=True)
+    os.replace(tmp_dir, entry_dir)
+
+
+def _prune_entries(formatted_dir: str, max_entries: int):
+    entries = sorted(
+        (os.path.getmtime(path), path)
+        for path in (os.path.join(formatted_dir, name) for name in os.listdir(formatted_dir))
+        if os.path.isdir(path) and not path.endswith(".tmp")
+    )
+    for _, path in entries[: max(len(entries) - max_entries, 0)]:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def load_formatted_data(
+    project_dir: str, coordinates: dict, confidences: dict, config: dict
+) -> tuple[dict, tuple, str]:
+    """`kpms.format_data`, with the padded arrays and the metadata kept in `{project_dir}/formatted_data`.
+
+    Each entry is a directory named by `get_formatted_data_key` with `Y`, `conf`, `mask`, the
+    keys and the bounds of the segments as `.npy` files. When the recordings and the
+    segmentation parameters did not change, the arrays are memory-mapped instead of being
+    padded and segmented again. Only the `formatted_data_max_entries` (config.yml, default 2)
+    most recently used entries are kept.
+
+    Parameters
+    -------
+    project_dir: str
+
+    coordinates, confidences: dict
+        Clean recordings, as passed to `kpms.format_data`.
+
+    config: dict
+
+    Returns
+    -------
+    data, metadata
+        Same as `kpms.format_data`.
+
+    entry_dir: str
+        Directory of the entry (see `load_formatted_entry`).
+    """
+    import jax  # type: ignore
+    import keypoint_moseq as kpms  # type: ignore
+
+    formatted_dir = os.path.join(project_dir, FORMATTED_DIRNAME)
+    start_time = time.perf_counter()
+    key = get_formatted_data_key(coordinates, confidences, config)
+    entry_dir = os.path.join(formatted_dir, key)
+
+    if os.path.exists(os.path.join(entry_dir, "bounds.npy")):
+        try:
+            arrays, metadata = _load_entry(entry_dir)
+            os.utime(entry_dir)
+            print(f"Formatted data memory-mapped from {entry_dir} in {time.perf_counter() - start_time:.2f}s")
+            return jax.device_put(arrays), metadata, entry_dir
+        except (OSError, ValueError) as e:
+            print(f"Could not read the formatted data {entry_dir} ({e}), formatting again")
+
+    data, metadata = kpms.format_data(coordinates, confidences, **config)
+    os.makedirs(formatted_dir, exist_ok=True)
+    _save_entry(entry_dir, data, metadata)
+    _prune_entries(formatted_dir, config.get("formatted_data_max_entries", DEFAULT_MAX_ENTRIES))
+    print(f"Formatted data saved to {entry_dir} in {time.perf_counter() - start_time:.2f}s")
+    return data, metadata, entry_dir
@@ -0,0 +1,49 @@
+import builtins
+import sys
+import time
+
+
+class ImportTimer:
+    """Times the first import of each top-level package while active (like `python -X importtime`,
+    summed per package).
+
+    Each package is charged its own import time, without the time of the other packages it
+    imports for the first time (which are charged separately).
+    """
+
+    def __init__(self):
+        self.times = {}
+        self._nested = []
+        self._original_import = None
+
+    def __enter__(self):
+        self._original_import = builtins.__import__
+        builtins.__import__ = self._import
+        return self
+
+    def __exit__(self, *exc_info):
+        builtins.__import__ = self._original_import
+
+    def _import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        package = name.partition(".")[0]
+        if level or package in sys.modules:
+            return self._original_import(name, globals, locals, fromlist, level)
+
+        start = time.perf_counter()
+        self._nested.append(0.0)
+        try:
+            return self._original_import(name, globals, locals, fromlist, level)
+        finally:
+            elapsed = time.perf_counter() - start
+            nested = self._nested.pop()
+            self.times[package] = self.times.get(package, 0.0) + elapsed - nested
+            if self._nested:
+                self._nested[-1] += elapsed
+
+    def report(self, top: int = 15) -> str:
+        total = sum(self.times.values())
+        lines = [f"{'Pacote':<30} {'Import (s)':>10}"]
+        for package, seconds in sorted(self.times.items(), key=lambda item: -item[1])[:top]:
+            lines.append(f"{package:<30} {seconds:>10.3f}")
+        lines.append(f"{'Total':<30} {total:>10.3f}")
+        return "\n".join(lines)
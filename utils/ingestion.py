@@ -0,0 +1,217 @@
+import multiprocessing
+import os
+import time
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import nullcontext
+from threading import Lock
+from typing import Optional
+
+import numpy as np
+
+from utils.find_medoid_distance_outliers import (
+    cached_masks_to_outliers,
+    filter_recording,
+    get_outlier_cache_params,
+    get_outlier_detection_params,
+    outliers_to_cached_masks,
+)
+from utils.keypoint_store import DLC_EXTENSIONS, KeypointStore, select_keypoint_files
+from utils.outlier_cache import DEFAULT_MAX_BYTES, OutlierCache, hash_arrays
+from utils.precision import get_precision_dtype
+from utils.video_frame_indexes import FrameWindows, get_video_frame_indexes
+
+
+class RecordingIngestion:
+    """Load → trim → filter of each DeepLabCut file, as one task per file.
+
+    Reading a file is mostly file I/O and NumPy (memory-mapped store), which release the GIL,
+    so the tasks run in a thread pool (`ingest_n_workers` in config.yml) sharing the keypoint
+    store behind its lock. With `remove_outliers`, each recording is filtered (see
+    `filter_recording`) as soon as its file is loaded: in `filter_executor` if given (the
+    process pool of `ingest_recordings`), else in the task itself. The outlier cache is only
+    read here, behind `cache_lock`; the results are saved by the caller.
+
+    Parameters
+    -------
+    project_dir: str
+
+    config: dict
+        Configuration of the project (`use_keypoint_store`, `keypoint_extensions`, trims).
+
+    remove_outliers: bool, default=False
+
+    filter_executor: concurrent.futures.Executor, optional
+
+    The coordinates and confidences are converted to the dtype of `precision` in config.yml
+    (see `get_precision_dtype`), and every value derived from them keeps that dtype (the
+    outlier detection runs in it too, see `detect_outliers`).
+    """
+
+    def __init__(self, project_dir: str, config: dict, remove_outliers: bool = False, filter_executor=None):
+        self.config = config
+        self.store = KeypointStore(project_dir) if config.get("use_keypoint_store", True) else None
+        self.frame_windows = FrameWindows.from_config(config)
+        self.dtype = get_precision_dtype(config)
+        self.remove_outliers = remove_outliers
+        self.filter_executor = filter_executor
+        self.cache = None
+        self.cache_lock = Lock()
+        if remove_outliers:
+            self.detection_params = get_outlier_detection_params(config)
+            self.cache_params = get_outlier_cache_params(config, self.detection_params)
+            if project_dir:
+                self.cache = OutlierCache(project_dir, config.get("outlier_cache_max_bytes", DEFAULT_MAX_BYTES))
+
+    def load_file(self, source_path: str) -> tuple[dict, dict, list]:
+        if self.store is not None:
+            return self.store.load_file(source_path)
+        import keypoint_moseq as kpms  # type: ignore
+
+        return kpms.load_keypoints(source_path, "deeplabcut", extension=os.path.splitext(source_path)[1])
+
+    def start_filtering(self, raw_coords: np.ndarray, confidences: np.ndarray) -> tuple[Optional[str], Future]:
+        """Start removing the outliers of one recording.
+
+        Returns the cache key the result should be saved under (None when it came from the
+        cache) and a future of `filter_recording`'s (coordinates, confidences, outliers).
+        """
+        cache_key, cached_outliers = None, None
+        if self.cache is not None:
+            cache_key = hash_arrays(raw_coords, confidences, params=self.cache_params)
+            with self.cache_lock:
+                cached_entry = self.cache.load(cache_key)
+            if cached_entry:
+                cached_outliers = cached_masks_to_outliers(cached_entry)
+                if "coordinates" in cached_entry:
+                    future = Future()
+                    future.set_result((cached_entry["coordinates"], cached_entry["confidences"], cached_outliers))
+                    return None, future
+
+        args = (raw_coords, confidences, self.config, cached_outliers)
+        if self.filter_executor is not None:
+            return cache_key, self.filter_executor.submit(filter_recording, *args, **self.detection_params)
+        future = Future()
+        future.set_result(filter_recording(*args, **self.detection_params))
+        return cache_key, future
+
+    def ingest_file(self, source_path: str) -> tuple[list[tuple], list]:
+        """Load, trim and (with `remove_outliers`) start filtering the recordings of one file.
+        Returns, for each recording, (name, coordinates, confidences, video frame indexes,
+        cache key, future of the filtered result or None), and the bodyparts."""
+        coordinates, confidences, bodyparts = self.load_file(source_path)
+        coordinates, confidences, video_frame_indexes = get_video_frame_indexes(
+            coordinates, confidences, self.frame_windows
+        )
+
+        results = []
+        for recording_name in coordinates:
+            # Só a janela da gravação é convertida (as do store são float64 mapeadas do disco)
+            raw_coords = coordinates[recording_name].astype(self.dtype, copy=False)
+            raw_confidences = confidences[recording_name].astype(self.dtype, copy=False)
+            cache_key, filtered = (
+                self.start_filtering(raw_coords, raw_confidences) if self.remove_outliers else (None, None)
+            )
+            results.append(
+                (
+                    recording_name,
+                    raw_coords,
+                    raw_confidences,
+                    video_frame_indexes[recording_name],
+                    cache_key,
+                    filtered,
+                )
+            )
+        return results, bodyparts
+
+
+def ingest_recordings(
+    project_dir: str,
+    config: dict,
+    video_dir=None,
+    remove_outliers: bool = True,
+    n_workers: Optional[int] = None,
+) -> tuple[dict, dict, list, dict]:
+    """Load, trim and clean every recording of the project.
+
+    Same result as `load_keypoints` → `get_video_frame_indexes` → `filter_outliers`, with the
+    recordings in the same (stable) order whatever the number of workers. The files are read
+    and trimmed in a thread pool, one task per file, and each recording is submitted to the
+    outlier filtering as soon as its file is loaded: in a process pool with
+    `outlier_n_workers > 1` in config.yml, else in the thread that loaded it. The results are
+    consumed in order here, the only writer of the outlier cache. The trims come from
+    `FrameWindows.from_config` and the frame indexes are `range`s.
+
+    Parameters
+    -------
+    project_dir: str
+
+    config: dict
+
+    video_dir: str, optional
+        Defaults to `video_dir` of config.yml.
+
+    remove_outliers: bool, default=True
+
+    n_workers: int, optional
+        Number of threads reading the files; defaults to `ingest_n_workers` of config.yml (1).
+
+    Returns
+    -------
+    coordinates, confidences, bodyparts, video_frame_indexes
+    """
+    if video_dir is None:
+        video_dir = config["video_dir"]
+    if n_workers is None:
+        n_workers = config.get("ingest_n_workers", 1)
+    outlier_n_workers = config.get("outlier_n_workers", 1) if remove_outliers else 1
+    extensions = tuple(config.get("keypoint_extensions", DLC_EXTENSIONS))
+    source_paths = select_keypoint_files(video_dir, extensions)
+    assert len(source_paths) > 0, f"No files with extensions {extensions} found for {video_dir}"
+
+    start_time = time.perf_counter()
+    if n_workers > 1:
+        print(f"Loading {len(source_paths)} files with {n_workers} threads")
+    if outlier_n_workers > 1:
+        print(f"Filtering outliers with {outlier_n_workers} workers")
+    filter_pool = (
+        ProcessPoolExecutor(max_workers=outlier_n_workers, mp_context=multiprocessing.get_context("spawn"))
+        if outlier_n_workers > 1
+        else nullcontext()
+    )
+    with filter_pool as filter_executor, ThreadPoolExecutor(max_workers=n_workers) as executor:
+        ingestion = RecordingIngestion(project_dir, config, remove_outliers, filter_executor)
+        file_futures = [executor.submit(ingestion.ingest_file, source_path) for source_path in source_paths]
+
+        coordinates, confidences, video_frame_indexes = {}, {}, {}
+        bodyparts = None
+        for file_future in file_futures:
+            results, bodyparts = file_future.result()
+            for recording_name, raw_coords, raw_confidences, frame_indexes, cache_key, filtered in results:
+                if recording_name in coordinates:
+                    raise ValueError(f"Duplicate recording names found in {video_dir}: {recording_name}")
+                video_frame_indexes[recording_name] = frame_indexes
+                if filtered is None:
+                    coordinates[recording_name], confidences[recording_name] = raw_coords, raw_confidences
+                    continue
+
+                print(f"{len(coordinates)+1}: {recording_name}")
+                result = filtered.result()
+                if cache_key is None:
+                    print(f"  Using cached clean coordinates for {recording_name}")
+                else:
+                    print(f"  Computed clean coordinates for {recording_name}")
+                    if ingestion.cache is not None:
+                        with ingestion.cache_lock:
+                            ingestion.cache.save(
+                                cache_key,
+                                {**outliers_to_cached_masks(result[2]), "coordinates": result[0], "confidences": result[1]},
+                            )
+                coordinates[recording_name], confidences[recording_name], _ = result
+
+    if ingestion.store is not None:
+        ingestion.store.finish(source_paths, list(coordinates))
+    if ingestion.cache is not None:
+        ingestion.cache.record_stats()
+        print(ingestion.cache.summary())
+    print(f"Loaded {len(coordinates)} recordings in {time.perf_counter() - start_time:.2f}s")
+    return coordinates, confidences, bodyparts, video_frame_indexes
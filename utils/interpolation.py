@@ -0,0 +1,188 @@
+import time
+
+import numpy as np
+
+
+def find_outlier_runs(outliers: list) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Find the runs of consecutive outlier frames of each keypoint in many recordings.
+
+    The masks of all the recordings are laid out back to back, keypoint by keypoint, as 1-D
+    series separated by a non-outlier frame, so a single `np.diff` finds every run and no run
+    crosses from one recording into the next.
+
+    Parameters
+    -------
+    outliers: list of ndarrays of shape (n_frames, n_keypoints)
+        Outlier mask of each recording (all with the same number of keypoints).
+
+    Returns
+    -------
+    recordings: ndarray of shape (n_runs,)
+        Index of the recording of each run.
+
+    keypoints: ndarray of shape (n_runs,)
+        Keypoint of each run.
+
+    starts, ends: ndarrays of shape (n_runs,)
+        First frame and frame after the last one of each run, in the frames of its recording.
+    """
+    n_keypoints = outliers[0].shape[1]
+    lengths = np.array([mask.shape[0] for mask in outliers], dtype=np.int64)
+    offsets = np.concatenate([[0], np.cumsum(lengths + 1)[:-1]]) + 1
+
+    series = np.zeros((n_keypoints, int(offsets[-1] + lengths[-1] + 1)), dtype=np.int8)
+    for offset, mask in zip(offsets, outliers):
+        series[:, offset : offset + mask.shape[0]] = mask.T
+
+    transitions = np.diff(series, axis=1)
+    keypoints, starts = np.nonzero(transitions == 1)
+    _, ends = np.nonzero(transitions == -1)
+    # A posição i do diff é a transição entre os frames i e i + 1
+    starts, ends = starts + 1, ends + 1
+
+    recordings = np.searchsorted(offsets, starts, side="right") - 1
+    return recordings, keypoints, starts - offsets[recordings], ends - offsets[recordings]
+
+
+def fill_outlier_runs(
+    coordinates: np.ndarray,
+    keypoints: np.ndarray,
+    starts: np.ndarray,
+    ends: np.ndarray,
+    first_frames: np.ndarray,
+    last_frames: np.ndarray,
+) -> None:
+    """Linearly interpolate the runs of outlier frames of `coordinates` in place.
+
+    Every run is filled from the last valid frame before it to the first valid frame after it,
+    with the same float64 formula as `np.interp` (including its fallback for NaN results).
+    Runs at the start (end) of a recording take the value of the first (last) valid frame and
+    runs covering the whole recording are filled with zeros, as `kpms.interpolate_keypoints`.
+
+    Parameters
+    -------
+    coordinates: ndarray of shape (n_frames, n_keypoints, n_dims)
+        Coordinates of all the recordings back to back.
+
+    keypoints, starts, ends: ndarrays of shape (n_runs,)
+        Runs to fill (see `find_outlier_runs`), in the frames of `coordinates`.
+
+    first_frames, last_frames: ndarrays of shape (n_runs,)
+        First frame and frame after the last one of the recording of each run.
+    """
+    if len(starts) == 0:
+        return
+
+    has_previous = starts > first_frames
+    has_following = ends < last_frames
+    both = has_previous & has_following
+    # Sem vizinho de um lado, o outro é usado nos dois (np.interp repete o valor da borda)
+    previous = np.where(has_previous, starts - 1, np.where(has_following, ends, starts))
+    following = np.where(has_following, ends, previous)
+    previous = np.where(has_previous, previous, following)
+
+    y0 = coordinates[previous, keypoints].astype(np.float64)
+    y1 = coordinates[following, keypoints].astype(np.float64)
+    no_neighbours = ~(has_previous | has_following)
+    y0[no_neighbours] = 0
+    y1[no_neighbours] = 0
+
+    lengths = ends - starts
+    runs = np.repeat(np.arange(len(starts)), lengths)
+    frames = np.arange(len(runs)) - np.repeat(np.cumsum(lengths) - lengths, lengths) + starts[runs]
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        slopes = (y1 - y0) / np.where(both, following - previous, 1)[:, None].astype(np.float64)
+        values = slopes[runs] * (frames - previous[runs])[:, None].astype(np.float64) + y0[runs]
+
+        nan_values = np.isnan(values) & both[runs, None]
+        if np.any(nan_values):
+            fallback = slopes[runs] * (frames - following[runs])[:, None].astype(np.float64) + y1[runs]
+            fallback = np.where(np.isnan(fallback) & (y0 == y1)[runs], y0[runs], fallback)
+            values = np.where(nan_values, fallback, values)
+
+    # Nas bordas o np.interp devolve o valor conhecido exatamente (mesmo se for inf ou NaN)
+    edge_frames = ~both[runs]
+    values[edge_frames] = y0[runs[edge_frames]]
+
+    coordinates[frames, keypoints[runs]] = values.astype(coordinates.dtype)
+
+
+def interpolate_keypoints(coordinates: np.ndarray, outliers: np.ndarray) -> np.ndarray:
+    """Drop-in replacement of `kpms.interpolate_keypoints` (same output) that fills all the
+    runs of outlier frames at once instead of calling `np.interp` per keypoint and axis.
+
+    Parameters
+    -------
+    coordinates: ndarray of shape (n_frames, n_keypoints, n_dims)
+
+    outliers: ndarray of shape (n_frames, n_keypoints)
+
+    Returns
+    -------
+    interpolated_coordinates: ndarray of shape (n_frames, n_keypoints, n_dims)
+    """
+    return interpolate_recordings({"": coordinates}, {"": outliers}, verbose=False)[""]
+
+
+def interpolate_recordings(coordinates: dict, outliers: dict, verbose: bool = True) -> dict:
+    """Interpolate the outliers of many recordings in a single call.
+
+    The coordinates of all the recordings are concatenated, the runs of outlier frames of
+    every keypoint are found in one pass (`find_outlier_runs`) and filled in bulk
+    (`fill_outlier_runs`). The result is identical to calling `kpms.interpolate_keypoints`
+    on each recording.
+
+    Parameters
+    -------
+    coordinates: dict
+        Coordinates of each recording, arrays of shape (n_frames, n_keypoints, n_dims), all
+        with the same number of keypoints and dimensions.
+
+    outliers: dict
+        Outlier mask of each recording, arrays of shape (n_frames, n_keypoints).
+
+    verbose: bool, default=True
+        Print the number of interpolated frames and the throughput.
+
+    Returns
+    -------
+    interpolated_coordinates: dict
+    """
+    start_time = time.perf_counter()
+    recording_names = list(coordinates)
+    if not recording_names:
+        return {}
+
+    masks = [np.asarray(outliers[name], dtype=bool) for name in recording_names]
+    lengths = np.array([coordinates[name].shape[0] for name in recording_names], dtype=np.int64)
+    frame_offsets = np.concatenate([[0], np.cumsum(lengths)])
+
+    recordings, keypoints, starts, ends = find_outlier_runs(masks)
+    all_coordinates = np.concatenate([coordinates[name] for name in recording_names])
+    fill_outlier_runs(
+        all_coordinates,
+        keypoints,
+        starts + frame_offsets[recordings],
+        ends + frame_offsets[recordings],
+        first_frames=frame_offsets[recordings],
+        last_frames=frame_offsets[recordings + 1],
+    )
+
+    interpolated_coordinates = {
+        name: all_coordinates[frame_offsets[i] : frame_offsets[i + 1]].astype(
+            coordinates[name].dtype, copy=False
+        )
+        for i, name in enumerate(recording_names)
+    }
+
+    if verbose:
+        elapsed = time.perf_counter() - start_time
+        n_frames = int(frame_offsets[-1])
+        print(
+            f"Interpolated {int(np.sum(ends - starts))} keypoint frames ({len(starts)} gaps) of "
+            f"{len(recording_names)} recordings ({n_frames} frames) in {elapsed:.3f}s "
+            f"({n_frames / max(elapsed, 1e-9) / 1e6:.1f} M frames/s)"
+        )
+
+    return interpolated_coordinates
@@ -0,0 +1,228 @@
+import glob
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+STORE_DIRNAME = "keypoint_store"
+MANIFEST_FILENAME = "manifest.json"
+STORE_VERSION = 1
+# Formatos do DeepLabCut em ordem de preferência (o HDF5 é lido bem mais rápido que o CSV)
+DLC_EXTENSIONS = (".h5", ".csv")
+
+
+def _array_paths(store_dir: str, recording_name: str) -> tuple[str, str]:
+    return (
+        os.path.join(store_dir, f"{recording_name}.coordinates.npy"),
+        os.path.join(store_dir, f"{recording_name}.confidences.npy"),
+    )
+
+
+def _source_signature(path: str) -> dict:
+    stat = os.stat(path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def _load_manifest(store_dir: str) -> dict:
+    path = os.path.join(store_dir, MANIFEST_FILENAME)
+    if os.path.exists(path):
+        try:
+            with open(path) as f:
+                manifest = json.load(f)
+            if manifest.get("version") == STORE_VERSION:
+                return manifest
+        except (OSError, ValueError) as e:
+            print(f"Could not read the keypoint store manifest {path} ({e}), rebuilding it")
+    return {"version": STORE_VERSION, "files": {}}
+
+
+def _save_manifest(store_dir: str, manifest: dict):
+    path = os.path.join(store_dir, MANIFEST_FILENAME)
+    with open(path + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(path + ".tmp", path)
+
+
+def _save_array(path: str, array: np.ndarray):
+    with open(path + ".tmp", "wb") as f:
+        np.save(f, np.ascontiguousarray(array))
+    os.replace(path + ".tmp", path)
+
+
+def _is_current(store_dir: str, entry: dict, source_path: str) -> bool:
+    if entry is None or entry.get("source") != _source_signature(source_path):
+        return False
+    return all(
+        os.path.exists(path)
+        for recording_name in entry["recordings"]
+        for path in _array_paths(store_dir, recording_name)
+    )
+
+
+# Igual ao `keypoint_moseq.util.list_files_with_exts`, sem importar o keypoint-moseq (e o JAX) só para listar arquivos
+def list_files_with_exts(filepath_pattern, ext_list, recursive=True) -> list[str]:
+    """Files matching a path, directory or glob pattern (or a list of them) with one of the extensions."""
+    if isinstance(filepath_pattern, list):
+        matches = []
+        for pattern in filepath_pattern:
+            matches += list_files_with_exts(pattern, ext_list, recursive=recursive)
+        return sorted(set(matches))
+
+    ext_list = ["." + ext.strip(".").lower() for ext in ext_list]
+    if os.path.isdir(filepath_pattern):
+        filepath_pattern = os.path.join(filepath_pattern, "*")
+    matches = glob.glob(filepath_pattern)
+    if recursive:
+        for match in list(matches):
+            matches += glob.glob(os.path.join(match, "**"), recursive=True)
+    return [match for match in matches if os.path.splitext(match)[1].lower() in ext_list]
+
+
+def _group_by_format(video_dir, extensions) -> dict[str, dict[str, str]]:
+    """{path without extension: {extension: path}} of the DeepLabCut files of `video_dir`."""
+    formats = {}
+    for path in list_files_with_exts(video_dir, list(extensions), recursive=True):
+        stem, extension = os.path.splitext(path)
+        formats.setdefault(stem, {})[extension.lower()] = path
+    return formats
+
+
+def select_keypoint_files(video_dir, extensions=DLC_EXTENSIONS) -> list[str]:
+    """List the DeepLabCut files of `video_dir`, one per recording, in the fastest format.
+
+    DeepLabCut saves the same tracking as `<name>.h5` and `<name>.csv`; when a recording has
+    more than one of `extensions`, the first one in `extensions` is used.
+    """
+    return [
+        next(paths[extension] for extension in extensions if extension in paths)
+        for paths in _group_by_format(video_dir, extensions).values()
+    ]
+
+
+def get_format_pairs(video_dir, extensions=DLC_EXTENSIONS) -> dict[str, dict[str, str]]:
+    """Recordings of `video_dir` saved in more than one format: {stem: {extension: path}}."""
+    return {stem: paths for stem, paths in _group_by_format(video_dir, extensions).items() if len(paths) > 1}
+
+
+class KeypointStore:
+    """Per-project binary store of the DeepLabCut keypoints (see `load_keypoint_store`).
+
+    `load_file` may be called from several threads at once; the manifest is only changed
+    under a lock and written by `finish`.
+    """
+
+    def __init__(self, project_dir: str):
+        self.store_dir = os.path.join(project_dir, STORE_DIRNAME)
+        os.makedirs(self.store_dir, exist_ok=True)
+        self.manifest = _load_manifest(self.store_dir)
+        self.bodyparts = self.manifest.get("bodyparts")
+        self.lock = threading.Lock()
+        self.cold_files = self.warm_files = 0
+        self.cold_time = self.warm_time = self.parse_time_saved = 0.0
+
+    def load_file(self, source_path: str) -> tuple[dict, dict, list]:
+        """Coordinates, confidences and bodyparts of one DeepLabCut file, memory-mapped from
+        the store if it is current, otherwise parsed and saved to the store."""
+        key = os.path.abspath(source_path)
+        with self.lock:
+            entry = self.manifest["files"].get(key)
+        start_time = time.perf_counter()
+
+        if _is_current(self.store_dir, entry, source_path):
+            coordinates, confidences = {}, {}
+            for recording_name in entry["recordings"]:
+                coordinates_path, confidences_path = _array_paths(self.store_dir, recording_name)
+                coordinates[recording_name] = np.load(coordinates_path, mmap_mode="r")
+                confidences[recording_name] = np.load(confidences_path, mmap_mode="r")
+            with self.lock:
+                self.warm_files += 1
+                self.warm_time += time.perf_counter() - start_time
+                self.parse_time_saved += entry.get("parse_seconds", 0.0)
+            return coordinates, confidences, self.bodyparts
+
+        import keypoint_moseq as kpms  # type: ignore
+
+        signature = _source_signature(source_path)
+        coordinates, confidences, bodyparts = kpms.load_keypoints(
+            source_path, "deeplabcut", extension=os.path.splitext(source_path)[1]
+        )
+        for recording_name in coordinates:
+            coordinates_path, confidences_path = _array_paths(self.store_dir, recording_name)
+            _save_array(coordinates_path, coordinates[recording_name])
+            _save_array(confidences_path, confidences[recording_name])
+        parse_seconds = time.perf_counter() - start_time
+        with self.lock:
+            self.manifest["files"][key] = {
+                "source": signature,
+                "recordings": list(coordinates),
+                "format": os.path.splitext(source_path)[1],
+                "parse_seconds": parse_seconds,
+            }
+            self.manifest["bodyparts"] = self.bodyparts = bodyparts
+            self.cold_files += 1
+            self.cold_time += parse_seconds
+        return coordinates, confidences, bodyparts
+
+    def finish(self, source_paths: list[str], recording_names: list[str]):
+        """Drop the files that no longer exist (keeping the arrays of `recording_names`), save
+        the manifest and print the load times."""
+        for key in set(self.manifest["files"]) - {os.path.abspath(path) for path in source_paths}:
+            for recording_name in self.manifest["files"].pop(key)["recordings"]:
+                if recording_name in recording_names:
+                    continue
+                for path in _array_paths(self.store_dir, recording_name):
+                    if os.path.exists(path):
+                        os.remove(path)
+
+        _save_manifest(self.store_dir, self.manifest)
+
+        print(
+            f"Keypoint store: {self.warm_files} files memory-mapped in {self.warm_time:.2f}s "
+            f"(parsing them took {self.parse_time_saved:.2f}s), "
+            f"{self.cold_files} files parsed in {self.cold_time:.2f}s"
+        )
+
+
+def load_keypoint_store(project_dir: str, video_dir, extensions=DLC_EXTENSIONS) -> tuple[dict, dict, list]:
+    """Load the DeepLabCut keypoints through a per-project binary store.
+
+    Each source file is parsed once with `kpms.load_keypoints` and its recordings are saved as
+    `.npy` files in `{project_dir}/keypoint_store`, listed in `manifest.json` together with the
+    size and modification time of the source. Later loads memory-map the arrays (read-only,
+    no copy) and only files that are new or whose size/modification time changed are parsed
+    again. Prints how long the parsed (cold) and the mapped (warm) files took. Each recording
+    is read from its fastest format available (see `select_keypoint_files`).
+
+    Parameters
+    -------
+    project_dir: str
+
+    video_dir: str or list of str
+        Files, directories or glob patterns with the DeepLabCut files (as in `kpms.load_keypoints`).
+
+    extensions: tuple of str, default=(".h5", ".csv")
+        Formats accepted, in order of preference.
+
+    Returns
+    -------
+    coordinates, confidences, bodyparts
+        Same as `kpms.load_keypoints`, with read-only memory-mapped arrays.
+    """
+    store = KeypointStore(project_dir)
+    source_paths = select_keypoint_files(video_dir, extensions)
+    assert len(source_paths) > 0, f"No files with extensions {extensions} found for {video_dir}"
+
+    coordinates, confidences = {}, {}
+    bodyparts = store.bodyparts
+    for source_path in source_paths:
+        new_coordinates, new_confidences, bodyparts = store.load_file(source_path)
+        duplicates = set(new_coordinates) & set(coordinates)
+        if duplicates:
+            raise ValueError(f"Duplicate recording names found in {video_dir}: {duplicates}")
+        coordinates.update(new_coordinates)
+        confidences.update(new_confidences)
+
+    store.finish(source_paths, list(coordinates))
+    return coordinates, confidences, bodyparts
@@ -1,30 +1,60 @@
-import keypoint_moseq as kpms # type: ignore
+import os
+import yaml
 from utils.print_legal import print_legal
-from utils.video_frame_indexes import get_video_frame_indexes
-from utils.find_medoid_distance_outliers import filter_outliers
+from utils.ingestion import ingest_recordings
+from utils.keypoint_store import load_keypoint_store, select_keypoint_files, DLC_EXTENSIONS
 
-def load_config(project_dir):
-    """Carrega a configuração do projeto."""
+# O keypoint-moseq (que importa o JAX) é importado dentro das funções, só quando é usado
+
+def load_config(project_dir, build_indexes=True):
+    """Carrega a configuração do projeto.
+
+    Com `build_indexes=False` o config.yml é lido sem o keypoint-moseq, que importa o JAX para
+    montar `anterior_idxs` e `posterior_idxs`; serve para os comandos que não usam o modelo.
+    """
+    if not build_indexes:
+        with open(os.path.join(project_dir, "config.yml")) as f:
+            config = yaml.safe_load(f)
+        config["skeleton"] = config.get("skeleton") or []
+        return config
+    import keypoint_moseq as kpms # type: ignore
     return kpms.load_config(project_dir)
 
-def load_keypoints(project_dir, video_dir=None):
-    """Carrega os keypoints do DLC."""
-    config = load_config(project_dir)
+def load_keypoints(project_dir, video_dir=None, config=None):
+    """Carrega os keypoints do DLC.
+
+    Cada gravação é lida do formato mais rápido disponível (.h5 antes de .csv, ou a ordem de
+    `keypoint_extensions` no config.yml). Por padrão os arquivos são lidos uma vez e guardados
+    em `{project_dir}/keypoint_store` (ver `load_keypoint_store`); `use_keypoint_store: false`
+    no config.yml lê sempre os arquivos do DLC.
+    """
+    if config is None:
+        config = load_config(project_dir)
     if video_dir is None:
         video_dir = config["video_dir"]
+    extensions = tuple(config.get("keypoint_extensions", DLC_EXTENSIONS))
+    if config.get("use_keypoint_store", True):
+        return load_keypoint_store(project_dir, video_dir, extensions=extensions)
+    import keypoint_moseq as kpms # type: ignore
     coordinates, confidences, bodyparts = kpms.load_keypoints(
-        video_dir, "deeplabcut", extension=".csv"
+        select_keypoint_files(video_dir, extensions), "deeplabcut"
     )
     return coordinates, confidences, bodyparts
 
 def load_data_and_config(project_dir, remove_outliers=True, video_dir=None):
-    """Carrega a configuração e os keypoints do DLC."""
+    """Carrega a configuração e os keypoints do DLC.
+
+    Os arquivos são carregados e cortados em `ingest_n_workers` threads e cada gravação vai para a
+    limpeza dos outliers assim que o seu arquivo é lido, em `outlier_n_workers` processos (ver
+    `ingest_recordings`).
+    Para carregar só o que o comando usa, prefira `ProjectContext`.
+    """
     print_legal(f"Carregando configuração e keypoints do DLC de: {project_dir}")
 
     config = load_config(project_dir)
-    coordinates, confidences, bodyparts = load_keypoints(project_dir, video_dir)
-    coordinates, confidences, video_frame_indexes = get_video_frame_indexes(coordinates, confidences)
-    if remove_outliers:
-        coordinates, confidences, _ = filter_outliers(coordinates, confidences, config, project_dir=project_dir)
+    coordinates, confidences, _, video_frame_indexes = ingest_recordings(
+        project_dir, config, video_dir=video_dir, remove_outliers=remove_outliers
+    )
+    import keypoint_moseq as kpms # type: ignore
     data, metadata = kpms.format_data(coordinates, confidences, **config)
     return data, metadata, config, coordinates, video_frame_indexes, confidences
@@ -0,0 +1,223 @@
+import numpy as np
+
+THRESHOLD_METHODS = ("median", "partition", "sketch")
+
+
+def partition_median(values: np.ndarray) -> np.ndarray:
+    """Median along axis 0 using `np.partition` (average O(n)) instead of a full sort.
+
+    Gives the same values as `np.median(values, axis=0)`, including NaN for columns that
+    contain NaNs.
+    """
+    n = values.shape[0]
+    lower, upper = (n - 1) // 2, n // 2
+    partitioned = np.partition(values, [lower, upper], axis=0)
+    medians = (partitioned[lower] + partitioned[upper]) * 0.5
+    nan_columns = np.isnan(values).any(axis=0)
+    if np.any(nan_columns):
+        medians = np.where(nan_columns, np.nan, medians).astype(medians.dtype)
+    return medians
+
+
+class QuantileSketch:
+    """Mergeable quantile sketch of non-negative values, one sketch per column.
+
+    Values are counted in logarithmic buckets (as in DDSketch): every positive value x falls
+    in bucket ceil(log_gamma(x)), with gamma = (1 + relative_error) / (1 - relative_error),
+    so the value returned for any quantile is within `relative_error` (relative) of an
+    element of the data with that rank. Values up to `min_value` share a single zero bucket.
+
+    The memory used depends only on the number of columns and on the dynamic range of the
+    values, not on how many values were added. Sketches with the same `relative_error` can
+    be merged, e.g. sketches built from separate chunks or recordings.
+
+    Parameters
+    -------
+    n_columns: int
+        Number of independent columns (eg. keypoints or keypoint pairs).
+
+    relative_error: float, default=0.01
+        Relative error bound of the quantiles.
+
+    min_value: float, default=1e-9
+        Values <= min_value are counted as zero.
+    """
+
+    def __init__(self, n_columns: int, relative_error: float = 0.01, min_value: float = 1e-9):
+        if not 0 < relative_error < 1:
+            raise ValueError(f"relative_error must be in (0, 1), got {relative_error}")
+        self.n_columns = n_columns
+        self.relative_error = relative_error
+        self.min_value = min_value
+        self.gamma = (1 + relative_error) / (1 - relative_error)
+        self._log_gamma = np.log(self.gamma)
+        self.index_offset = 0
+        self.counts = np.zeros((n_columns, 0), dtype=np.int64)
+        self.zero_counts = np.zeros(n_columns, dtype=np.int64)
+        self.nan_counts = np.zeros(n_columns, dtype=np.int64)
+
+    @property
+    def total_counts(self) -> np.ndarray:
+        """Number of (non-NaN) values added to each column."""
+        return self.zero_counts + self.counts.sum(axis=1)
+
+    def _ensure_bucket_range(self, low: int, high: int):
+        n_buckets = self.counts.shape[1]
+        if n_buckets == 0:
+            self.index_offset = low
+            self.counts = np.zeros((self.n_columns, high - low + 1), dtype=np.int64)
+            return
+        pad_left = max(self.index_offset - low, 0)
+        pad_right = max(high - (self.index_offset + n_buckets - 1), 0)
+        if pad_left or pad_right:
+            self.counts = np.pad(self.counts, ((0, 0), (pad_left, pad_right)))
+            self.index_offset -= pad_left
+
+    def update(self, values: np.ndarray, weight: int = 1):
+        """Add the rows of `values`, of shape (n, n_columns), to the sketch.
+
+        A negative `weight` removes values that were previously added.
+        """
+        values = np.asarray(values).reshape(-1, self.n_columns)
+        if np.any(values < 0):
+            raise ValueError("QuantileSketch only supports non-negative values")
+
+        nan_mask = np.isnan(values)
+        zero_mask = values <= self.min_value
+        self.nan_counts += nan_mask.sum(axis=0) * weight
+        self.zero_counts += zero_mask.sum(axis=0) * weight
+
+        rows, columns = np.nonzero(~(nan_mask | zero_mask))
+        if len(rows) == 0:
+            return
+        indexes = np.ceil(np.log(values[rows, columns].astype(np.float64)) / self._log_gamma)
+        indexes = indexes.astype(np.int64)
+        self._ensure_bucket_range(indexes.min(), indexes.max())
+
+        n_buckets = self.counts.shape[1]
+        flat_indexes = columns * n_buckets + (indexes - self.index_offset)
+        counts = np.bincount(flat_indexes, minlength=self.n_columns * n_buckets)
+        self.counts += counts.reshape(self.n_columns, n_buckets) * weight
+
+    def merge(self, other: "QuantileSketch") -> "QuantileSketch":
+        """Add the counts of `other` to this sketch (in place) and return it."""
+        if other.n_columns != self.n_columns or other.gamma != self.gamma:
+            raise ValueError("Only sketches with the same columns and relative_error can be merged")
+        if other.counts.shape[1] > 0:
+            other_low = other.index_offset
+            self._ensure_bucket_range(other_low, other_low + other.counts.shape[1] - 1)
+            start = other_low - self.index_offset
+            self.counts[:, start : start + other.counts.shape[1]] += other.counts
+        self.zero_counts += other.zero_counts
+        self.nan_counts += other.nan_counts
+        return self
+
+    def _bucket_values(self) -> np.ndarray:
+        """Representative value of each bucket, with the zero bucket first."""
+        indexes = self.index_offset + np.arange(self.counts.shape[1])
+        bucket_values = 2 * self.gamma ** indexes.astype(np.float64) / (self.gamma + 1)
+        return np.concatenate([[0.0], bucket_values])
+
+    def _all_counts(self) -> np.ndarray:
+        return np.concatenate([self.zero_counts[:, None], self.counts], axis=1)
+
+    def _invalid_columns(self) -> np.ndarray:
+        # Como `np.median`, colunas com NaN (ou vazias) resultam em NaN
+        return (self.nan_counts > 0) | (self.total_counts <= 0)
+
+    def quantile(self, q: float) -> np.ndarray:
+        """Approximate q-quantile of each column, shape (n_columns,)."""
+        bucket_values = np.broadcast_to(self._bucket_values(), (self.n_columns, self.counts.shape[1] + 1))
+        result = _weighted_quantile(bucket_values, self._all_counts(), q)
+        result[self._invalid_columns()] = np.nan
+        return result
+
+    def median(self) -> np.ndarray:
+        return self.quantile(0.5)
+
+    def mad(self, medians: np.ndarray = None) -> np.ndarray:
+        """Approximate median absolute deviation of each column.
+
+        The deviations are taken between the bucket values and the sketch median, so the
+        error is bounded by `relative_error * (median + MAD)`.
+        """
+        if medians is None:
+            medians = self.median()
+        deviations = np.abs(self._bucket_values()[None, :] - medians[:, None])
+        order = np.argsort(deviations, axis=1)
+        result = _weighted_quantile(
+            np.take_along_axis(deviations, order, axis=1),
+            np.take_along_axis(self._all_counts(), order, axis=1),
+            0.5,
+        )
+        result[self._invalid_columns()] = np.nan
+        return result
+
+
+def _weighted_quantile(sorted_values: np.ndarray, counts: np.ndarray, q: float) -> np.ndarray:
+    """q-quantile of each row given its sorted values and their counts."""
+    cumulative_counts = np.cumsum(counts, axis=1)
+    ranks = q * (cumulative_counts[:, -1] - 1)
+    positions = np.argmax(cumulative_counts > ranks[:, None], axis=1)
+    return np.take_along_axis(sorted_values, positions[:, None], axis=1)[:, 0].astype(np.float64)
+
+
+def sketch_mad_thresholds(
+    sketch: QuantileSketch, outlier_scale_factor: float, dtype=np.float64
+) -> np.ndarray:
+    """MAD thresholds (median + outlier_scale_factor * MAD) from a sketch."""
+    medians = sketch.median()
+    return (sketch.mad(medians) * outlier_scale_factor + medians).astype(dtype)
+
+
+def build_sketch(chunks, relative_error: float = 0.01) -> QuantileSketch:
+    """Build a sketch from an iterable of arrays of shape (n, n_columns), one chunk at a time."""
+    sketch = None
+    for values in chunks:
+        if sketch is None:
+            sketch = QuantileSketch(values.shape[1], relative_error=relative_error)
+        sketch.update(values)
+    return sketch
+
+
+def get_mad_thresholds(
+    values: np.ndarray,
+    outlier_scale_factor: float,
+    method: str = "median",
+    relative_error: float = 0.01,
+) -> np.ndarray:
+    """Compute the MAD outlier threshold of each column of `values` (n, n_columns).
+
+    Parameters
+    -------
+    values: ndarray of shape (n, n_columns)
+        Distances (or velocities) from which the thresholds are computed.
+
+    outlier_scale_factor: float
+        Multiplier of the MAD added to the median.
+
+    method: str, default="median"
+        "median" uses `np.median` (full sort), "partition" uses `partition_median` (same
+        values, average O(n)) and "sketch" uses a `QuantileSketch` (approximate, bounded
+        memory).
+
+    relative_error: float, default=0.01
+        Error bound of the "sketch" method.
+
+    Returns
+    -------
+    thresholds: ndarray of shape (n_columns,)
+    """
+    if method == "median":
+        medians = np.median(values, axis=0)
+        MADs = np.median(np.abs(values - medians[None, :]), axis=0)
+    elif method == "partition":
+        medians = partition_median(values)
+        MADs = partition_median(np.abs(values - medians[None, :]))
+    elif method == "sketch":
+        sketch = QuantileSketch(values.shape[1], relative_error=relative_error)
+        sketch.update(values)
+        return sketch_mad_thresholds(sketch, outlier_scale_factor, dtype=values.dtype)
+    else:
+        raise ValueError(f"Unknown threshold method '{method}', expected one of {THRESHOLD_METHODS}")
+    return MADs * outlier_scale_factor + medians
@@ -0,0 +1,243 @@
+import io
+import os
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+from utils.find_medoid_distance_outliers import (
+    DEFAULT_DETECTION_PARAMS,
+    OUTLIER_DETECTORS,
+    count_pair_outliers_per_keypoint,
+    get_chunk_outlier_values,
+    get_pair_incidence,
+    iter_chunks,
+    pair_values_to_square,
+)
+from utils.mad_thresholds import QuantileSketch, sketch_mad_thresholds
+from utils.precision import get_precision_dtype
+
+DEFAULT_WINDOW_SIZE = 9000  # 5 minutos a 30 fps
+
+
+class RollingValues:
+    """Ring buffer with the last `window_size` rows of values of one detector, mirrored in a
+    `QuantileSketch` (rows leaving the buffer are removed from the sketch)."""
+
+    def __init__(self, n_columns: int, window_size: int, relative_error: float, dtype):
+        self.values = np.empty((window_size, n_columns), dtype=dtype)
+        self.sketch = QuantileSketch(n_columns, relative_error=relative_error)
+        self.window_size = window_size
+        self.position = 0
+        self.n_rows = 0
+
+    def extend(self, rows: np.ndarray):
+        """Add `rows` (at most `window_size`), dropping the oldest rows if the buffer is full."""
+        n_new = len(rows)
+        indexes = (self.position + np.arange(n_new)) % self.window_size
+        n_dropped = max(self.n_rows + n_new - self.window_size, 0)
+        if n_dropped:
+            # As linhas mais antigas estão logo após a última escrita
+            oldest = (self.position - self.n_rows + np.arange(n_dropped)) % self.window_size
+            self.sketch.update(self.values[oldest], weight=-1)
+        self.values[indexes] = rows
+        self.sketch.update(rows)
+        self.position = (self.position + n_new) % self.window_size
+        self.n_rows = min(self.n_rows + n_new, self.window_size)
+
+
+class OnlineOutlierDetector:
+    """Incremental version of `find_outliers` for recordings that keep growing.
+
+    The MAD thresholds of each detector come from the values of the last `window_size`
+    frames, kept in a ring buffer and in a `QuantileSketch` from which the values leaving the
+    window are removed. Each call to `append` only computes the detector values of the new
+    frames, updates the sketches and thresholds the new frames, so its cost is proportional
+    to the number of new frames and the memory used is bounded by the window.
+
+    Frames are flagged when they arrive, with the thresholds of the window ending at them,
+    so the masks are causal and differ from those of `find_outliers` on the full recording
+    (whose thresholds use every frame).
+
+    Parameters
+    -------
+    n_keypoints: int
+
+    window_size: int, default=9000
+        Number of frames from which the thresholds are computed.
+
+    fps: float, default=30.0
+        Frame rate, used to scale the velocities.
+
+    outlier_sketch_relative_error: float, default=0.01
+        Error bound of the sketches (see `QuantileSketch`).
+
+    chunk_size: int, default=4096
+        Maximum number of frames thresholded at once; larger appends are split.
+
+    dtype: numpy dtype, optional
+        Dtype of the pair distances; defaults to the dtype of the appended coordinates.
+
+    **detection_params
+        Detectors and scale factors, as in `DEFAULT_DETECTION_PARAMS`.
+    """
+
+    def __init__(
+        self,
+        n_keypoints: int,
+        window_size: int = DEFAULT_WINDOW_SIZE,
+        fps: float = 30.0,
+        outlier_sketch_relative_error: float = 0.01,
+        chunk_size: int = 4096,
+        dtype=None,
+        **detection_params,
+    ):
+        params = {**DEFAULT_DETECTION_PARAMS, **detection_params}
+        self.n_keypoints = n_keypoints
+        self.window_size = window_size
+        self.fps = fps
+        self.relative_error = outlier_sketch_relative_error
+        self.chunk_size = min(chunk_size, window_size)
+        self.dtype = dtype
+        self.detectors = tuple(d for d in OUTLIER_DETECTORS if params[f"use_{d}_outliers"])
+        self.scale_factors = {d: params[f"{d}_outlier_scale_factor"] for d in OUTLIER_DETECTORS}
+        self.min_outlier_count = params["keypoint_distance_outlier_threshold_percentage"] * (n_keypoints - 1)
+        self.incidence = get_pair_incidence(n_keypoints)
+        self.rolling = {}
+        self.last_frame = None
+        self.n_frames = 0
+
+    def append(self, coordinates: np.ndarray) -> dict:
+        """Detect the outliers of the new frames `coordinates` (n_new_frames, n_keypoints, dim).
+
+        Returns a dict like `find_outliers` for the new frames only: "mask", and for each
+        enabled detector "{detector}_outliers" (with "mask" and the current "thresholds") and
+        "{detector}_thresholds".
+        """
+        results = [self._append_chunk(coordinates[frames]) for frames in iter_chunks(len(coordinates), self.chunk_size)]
+        if not results:
+            return self._empty_result()
+
+        result = {"mask": np.concatenate([r["mask"] for r in results])}
+        for detector in self.detectors:
+            key = f"{detector}_outliers"
+            result[key] = {
+                **results[-1][key],
+                "mask": np.concatenate([r[key]["mask"] for r in results]),
+            }
+            result[f"{detector}_thresholds"] = results[-1][f"{detector}_thresholds"]
+        return result
+
+    def _append_chunk(self, chunk: np.ndarray) -> dict:
+        n_new = len(chunk)
+        if self.last_frame is None:
+            coordinates, frames = chunk, slice(0, n_new)
+        else:
+            # O frame anterior entra só para a velocidade do primeiro frame novo
+            coordinates, frames = np.concatenate([self.last_frame, chunk]), slice(1, n_new + 1)
+        values = get_chunk_outlier_values(coordinates, frames, self.detectors, self.fps, self.dtype)
+
+        result = {}
+        combined_mask = np.zeros((n_new, self.n_keypoints), dtype=bool)
+        for detector, detector_values in values.items():
+            if detector not in self.rolling:
+                self.rolling[detector] = RollingValues(
+                    detector_values.shape[1], self.window_size, self.relative_error, detector_values.dtype
+                )
+            rolling = self.rolling[detector]
+            if len(detector_values):
+                rolling.extend(detector_values)
+            thresholds = sketch_mad_thresholds(
+                rolling.sketch, self.scale_factors[detector], dtype=detector_values.dtype
+            )
+            value_mask = detector_values > thresholds[None, :]
+
+            if detector == "velocity":
+                # Alinhado aos frames como em `find_outliers`: o primeiro frame não tem velocidade
+                mask = np.zeros((n_new, self.n_keypoints), dtype=bool)
+                mask[n_new - len(value_mask) :] = value_mask
+            elif detector == "keypoint_distance":
+                outlier_counts = count_pair_outliers_per_keypoint(value_mask, self.incidence)
+                mask = outlier_counts >= self.min_outlier_count
+                thresholds = pair_values_to_square(thresholds, self.n_keypoints)
+            else:
+                mask = value_mask
+
+            result[f"{detector}_outliers"] = {"mask": mask, "thresholds": thresholds}
+            result[f"{detector}_thresholds"] = thresholds
+            combined_mask |= mask
+
+        result["mask"] = combined_mask
+        self.last_frame = chunk[-1:].copy()
+        self.n_frames += n_new
+        return result
+
+    def _empty_result(self) -> dict:
+        result = {"mask": np.zeros((0, self.n_keypoints), dtype=bool)}
+        for detector in self.detectors:
+            result[f"{detector}_outliers"] = {"mask": np.zeros((0, self.n_keypoints), dtype=bool)}
+        return result
+
+
+class GrowingDLCFile:
+    """Reads only the rows appended to a DeepLabCut CSV since the last call.
+
+    Keeps the byte offset of the last complete line read, so each call costs the size of
+    the new rows. Partial lines (still being written) are left for the next call.
+    """
+
+    def __init__(self, path: str, n_header_lines: int = 3):
+        self.path = path
+        self.n_header_lines = n_header_lines
+        self.offset = 0
+
+    def read_new_frames(self) -> tuple[np.ndarray, np.ndarray]:
+        """Returns the coordinates (n_new_frames, n_keypoints, 2) and confidences
+        (n_new_frames, n_keypoints) of the rows added since the last call."""
+        if not os.path.exists(self.path) or os.path.getsize(self.path) <= self.offset:
+            return np.zeros((0, 0, 2)), np.zeros((0, 0))
+
+        with open(self.path, "rb") as f:
+            f.seek(self.offset)
+            if self.offset == 0:
+                for _ in range(self.n_header_lines):
+                    f.readline()
+            start = f.tell()
+            new_bytes = f.read()
+
+        # Só linhas completas; uma linha ainda sendo escrita fica para a próxima leitura
+        complete = new_bytes.rfind(b"\n") + 1
+        if complete == 0:
+            return np.zeros((0, 0, 2)), np.zeros((0, 0))
+        self.offset = start + complete
+
+        rows = pd.read_csv(io.BytesIO(new_bytes[:complete]), header=None, index_col=0).to_numpy(np.float64)
+        rows = rows.reshape(len(rows), -1, 3)
+        return rows[:, :, :2], rows[:, :, 2]
+
+
+def detect_outliers_online(
+    dlc_file: GrowingDLCFile,
+    detector: Optional[OnlineOutlierDetector],
+    config: dict,
+) -> tuple[Optional[OnlineOutlierDetector], Optional[dict]]:
+    """Read the new frames of `dlc_file` and detect their outliers.
+
+    Creates the detector on the first frames, from the detection parameters, `fps`,
+    `outlier_sketch_relative_error` and `outlier_online_window` (window in frames) of
+    config.yml; the frames are detected in the dtype of `precision`. Returns the detector (to be passed to the next call) and the result of
+    `OnlineOutlierDetector.append` (None if there were no new frames).
+    """
+    coordinates, _ = dlc_file.read_new_frames()
+    if len(coordinates) == 0:
+        return detector, None
+
+    if detector is None:
+        detector = OnlineOutlierDetector(
+            coordinates.shape[1],
+            window_size=config.get("outlier_online_window", DEFAULT_WINDOW_SIZE),
+            fps=config.get("fps", 30.0),
+            outlier_sketch_relative_error=config.get("outlier_sketch_relative_error", 0.01),
+            **{key: config[key] for key in DEFAULT_DETECTION_PARAMS if key in config},
+        )
+    return detector, detector.append(coordinates.astype(get_precision_dtype(config), copy=False))
@@ -0,0 +1,181 @@
+import hashlib
+import json
+import os
+import time
+from typing import Optional
+
+import h5py
+import numpy as np
+
+CACHE_FILENAME = "outlier_masks_cache.h5"
+DEFAULT_MAX_BYTES = 2 * 1024**3
+# Ao passar do limite, as entradas são removidas até essa fração dele, para não remover a cada gravação salva
+EVICTION_TARGET_FRACTION = 0.9
+
+
+def hash_arrays(*arrays: np.ndarray, params: Optional[dict] = None) -> str:
+    """Fast content hash (blake2b) of the arrays (values, dtype and shape) and of `params`."""
+    hasher = hashlib.blake2b(digest_size=16)
+    for array in arrays:
+        array = np.ascontiguousarray(array)
+        hasher.update(f"{array.dtype.str}{array.shape}".encode())
+        hasher.update(array.data)
+    if params is not None:
+        hasher.update(json.dumps(params, sort_keys=True, default=str).encode())
+    return hasher.hexdigest()
+
+
+def _checksum(group: h5py.Group) -> str:
+    hasher = hashlib.blake2b(digest_size=16)
+    for name in sorted(group):
+        hasher.update(name.encode())
+        hasher.update(np.ascontiguousarray(group[name][()]).data)
+    return hasher.hexdigest()
+
+
+class OutlierCache:
+    """Content-addressed HDF5 cache of the outlier detection results.
+
+    Each entry is a group named by its key (see `hash_arrays`) holding the cached arrays,
+    with attributes for an integrity checksum, its size in bytes and its last access time.
+    Entries whose checksum does not match (or that cannot be read) count as misses and are
+    dropped. Lookups only read the file, so other processes can read it at the same time;
+    the access times of the hits and the corrupted entries are kept in memory and written by
+    the next `save` or by `record_stats`, the only calls that write the file. When the entries exceed `max_bytes` the least recently used ones are evicted
+    down to `EVICTION_TARGET_FRACTION` of it. HDF5 does not give deleted space back, so the
+    file is rewritten once, by `record_stats` at the end of the session, if anything was
+    deleted; until then it can grow past the cap by the deleted entries.
+
+    Parameters
+    -------
+    project_dir: str
+        Directory of the project; the cache lives in `{project_dir}/outlier_masks_cache.h5`.
+
+    max_bytes: int, default=2 GiB
+        Size cap of the stored entries.
+    """
+
+    def __init__(self, project_dir: str, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.path = os.path.join(project_dir, CACHE_FILENAME)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.corrupted = 0
+        self.reclaimable = False
+        self.access_times = {}
+        self.corrupted_keys = set()
+
+    def load(self, key: str) -> Optional[dict]:
+        """Return the arrays stored under `key`, or None on a miss."""
+        if not os.path.exists(self.path):
+            self.misses += 1
+            return None
+
+        try:
+            with h5py.File(self.path, "r") as f:
+                if key not in f or key in self.corrupted_keys:
+                    self.misses += 1
+                    return None
+
+                group = f[key]
+                if group.attrs.get("checksum") != _checksum(group):
+                    print(f"  Cache entry {key} is corrupted, discarding it")
+                    self.corrupted_keys.add(key)
+                    self.corrupted += 1
+                    self.misses += 1
+                    return None
+
+                self.access_times[key] = time.time()
+                self.hits += 1
+                return {name: group[name][()] for name in group}
+        except OSError as e:
+            print(f"  Could not read the outlier cache {self.path} ({e}), ignoring it")
+            self.corrupted += 1
+            self.misses += 1
+            return None
+
+    def save(self, key: str, arrays: dict) -> None:
+        """Store `arrays` under `key` and evict old entries if the cap is exceeded."""
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+
+        with h5py.File(self.path, "a") as f:
+            self._write_pending(f)
+            if key in f:
+                del f[key]
+
+            group = f.create_group(key)
+            for name, array in arrays.items():
+                group.create_dataset(name, data=array, compression="gzip", shuffle=True)
+            group.attrs["checksum"] = _checksum(group)
+            group.attrs["nbytes"] = sum(group[name].id.get_storage_size() for name in group)
+            group.attrs["last_access"] = time.time()
+
+            self._evict(f, protected_key=key)
+
+    def _write_pending(self, f: h5py.File) -> None:
+        """Write the access times of the hits and drop the corrupted entries found by `load`."""
+        for key in self.corrupted_keys:
+            if key in f:
+                del f[key]
+                self.reclaimable = True
+        for key, last_access in self.access_times.items():
+            if key in f:
+                f[key].attrs["last_access"] = max(f[key].attrs.get("last_access", 0.0), last_access)
+        self.corrupted_keys.clear()
+        self.access_times.clear()
+
+    def _evict(self, f: h5py.File, protected_key: str) -> None:
+        # Entradas sem atributos (ex. do cache antigo) têm last_access 0 e saem primeiro
+        entries = sorted(
+            (group.attrs.get("last_access", 0.0), group.attrs.get("nbytes", 0), key)
+            for key, group in f.items()
+        )
+        total_bytes = sum(nbytes for _, nbytes, _ in entries)
+        if total_bytes <= self.max_bytes:
+            return
+        for _, nbytes, key in entries:
+            if total_bytes <= EVICTION_TARGET_FRACTION * self.max_bytes:
+                break
+            if key == protected_key:
+                continue
+            del f[key]
+            total_bytes -= nbytes
+            self.evictions += 1
+            self.reclaimable = True
+
+    def _compact(self) -> None:
+        tmp_path = self.path + ".tmp"
+        with h5py.File(self.path, "r") as src, h5py.File(tmp_path, "w") as dst:
+            for key in src:
+                src.copy(src[key], dst, name=key)
+            for name, value in src.attrs.items():
+                dst.attrs[name] = value
+        os.replace(tmp_path, self.path)
+
+    def size_bytes(self) -> int:
+        if not os.path.exists(self.path):
+            return 0
+        return os.path.getsize(self.path)
+
+    def record_stats(self) -> None:
+        """Add the hit/miss counters of this session to the totals stored in the file, and
+        rewrite the file if entries were deleted during the session."""
+        if not os.path.exists(self.path):
+            return
+        with h5py.File(self.path, "a") as f:
+            self._write_pending(f)
+            for name in ("hits", "misses", "evictions", "corrupted"):
+                f.attrs[name] = int(f.attrs.get(name, 0)) + getattr(self, name)
+        if self.reclaimable:
+            self._compact()
+            self.reclaimable = False
+        self.access_times = {}
+        self.corrupted_keys = set()
+
+    def summary(self) -> str:
+        return (
+            f"Outlier cache: {self.hits} hits, {self.misses} misses, "
+            f"{self.evictions} evicted, {self.corrupted} corrupted, "
+            f"{self.size_bytes() / 1024**2:.1f} MB of {self.max_bytes / 1024**2:.0f} MB"
+        )
@@ -0,0 +1,151 @@
+import os
+from typing import Optional
+
+import h5py
+import numpy as np
+import pandas as pd
+
+from utils.interpolation import find_outlier_runs
+
+SUMMARY_FILENAME = "outlier_summary.h5"
+SUMMARY_COLUMNS = {
+    "recording": object,
+    "keypoint": object,
+    "detector": object,
+    "n_frames": np.int64,
+    "n_outliers": np.int64,
+    "outlier_percentage": np.float64,
+    "longest_run": np.int64,
+}
+
+
+def get_longest_runs(mask: np.ndarray) -> np.ndarray:
+    """Length of the longest run of consecutive outlier frames of each keypoint."""
+    _, keypoints, starts, ends = find_outlier_runs([mask])
+    longest_runs = np.zeros(mask.shape[1], dtype=np.int64)
+    np.maximum.at(longest_runs, keypoints, ends - starts)
+    return longest_runs
+
+
+def summarize_outliers(
+    recording_name: str, combined_outliers: dict, bodyparts: Optional[list[str]] = None
+) -> dict:
+    """Outlier statistics of one recording, one row per keypoint and detector.
+
+    Parameters
+    -------
+    recording_name: str
+
+    combined_outliers: dict
+        Result of `find_outliers` (or of the cache); every detector present is summarized,
+        plus the combined mask as detector "combined".
+
+    bodyparts: list of str, optional
+        Names of the keypoints; defaults to their indexes.
+
+    Returns
+    -------
+    columns: dict
+        Arrays of length n_keypoints * n_detectors, one per column of `SUMMARY_COLUMNS`.
+    """
+    masks = {
+        key[: -len("_outliers")]: value["mask"]
+        for key, value in combined_outliers.items()
+        if key.endswith("_outliers")
+    }
+    masks["combined"] = combined_outliers["mask"]
+
+    n_frames, n_keypoints = combined_outliers["mask"].shape
+    if bodyparts is None:
+        bodyparts = [str(i) for i in range(n_keypoints)]
+
+    # Todas as máscaras (n_detectors, n_frames, n_keypoints) contadas de uma vez
+    stacked = np.stack(list(masks.values()))
+    n_outliers = stacked.sum(axis=1).ravel()
+    longest_runs = get_longest_runs(stacked.transpose(1, 0, 2).reshape(n_frames, -1))
+
+    n_detectors = len(masks)
+    return {
+        "recording": np.full(n_detectors * n_keypoints, recording_name, dtype=object),
+        "keypoint": np.tile(np.asarray(bodyparts, dtype=object), n_detectors),
+        "detector": np.repeat(np.asarray(list(masks), dtype=object), n_keypoints),
+        "n_frames": np.full(n_detectors * n_keypoints, n_frames, dtype=np.int64),
+        "n_outliers": n_outliers.astype(np.int64),
+        "outlier_percentage": n_outliers / max(n_frames, 1) * 100,
+        "longest_run": longest_runs,
+    }
+
+
+def _empty_columns() -> dict:
+    return {column: np.array([], dtype=dtype) for column, dtype in SUMMARY_COLUMNS.items()}
+
+
+class OutlierSummaryTable:
+    """Project-wide table of outlier statistics (see `summarize_outliers`).
+
+    Stored as one HDF5 dataset per column in `{project_dir}/outlier_summary.h5`, with the
+    input key (see `hash_arrays`) of each recording, so the rows of a recording are only
+    recomputed when its coordinates or the detection parameters change.
+    """
+
+    def __init__(self, project_dir: str):
+        self.path = os.path.join(project_dir, SUMMARY_FILENAME)
+        self.columns = _empty_columns()
+        self.keys = {}
+        self.updated = []
+        if os.path.exists(self.path):
+            self._load()
+
+    def _load(self):
+        try:
+            with h5py.File(self.path, "r") as f:
+                self.columns = {
+                    column: f[column].asstr()[()].astype(object) if dtype is object else f[column][()]
+                    for column, dtype in SUMMARY_COLUMNS.items()
+                }
+                self.keys = dict(f["keys"].attrs)
+        except (OSError, KeyError) as e:
+            print(f"Could not read the outlier summary {self.path} ({e}), rebuilding it")
+            self.columns = _empty_columns()
+            self.keys = {}
+
+    def is_current(self, recording_name: str, key: str) -> bool:
+        return self.keys.get(recording_name) == key
+
+    def update(self, recording_name: str, key: str, columns: dict):
+        """Replace the rows of `recording_name` with `columns` (see `summarize_outliers`)."""
+        keep = self.columns["recording"] != recording_name
+        self.columns = {
+            column: np.concatenate([self.columns[column][keep], columns[column]])
+            for column in SUMMARY_COLUMNS
+        }
+        self.keys[recording_name] = key
+        self.updated.append(recording_name)
+
+    def rows(self, recording_name: str) -> pd.DataFrame:
+        summary = self.to_dataframe()
+        return summary[summary["recording"] == recording_name]
+
+    def to_dataframe(self) -> pd.DataFrame:
+        return pd.DataFrame(self.columns)
+
+    def save(self, recording_names: Optional[list[str]] = None):
+        """Write the table; recordings not in `recording_names` (removed from the project) are dropped."""
+        if recording_names is not None:
+            keep = np.isin(self.columns["recording"], list(recording_names))
+            self.columns = {column: values[keep] for column, values in self.columns.items()}
+            self.keys = {name: key for name, key in self.keys.items() if name in recording_names}
+
+        string_dtype = h5py.string_dtype()
+        tmp_path = self.path + ".tmp"
+        with h5py.File(tmp_path, "w") as f:
+            for column, dtype in SUMMARY_COLUMNS.items():
+                values = self.columns[column]
+                if dtype is object:
+                    f.create_dataset(column, data=values.astype(str).astype(object), dtype=string_dtype)
+                else:
+                    f.create_dataset(column, data=values.astype(dtype))
+            keys = f.create_group("keys")
+            for name, key in self.keys.items():
+                keys.attrs[name] = key
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,61 @@
+import tracemalloc
+
+import numpy as np
+
+# `precision` no config.yml: dtype das coordenadas, confidências e valores derivados no pré-processamento
+PRECISIONS = {"float64": np.float64, "float32": np.float32}
+DEFAULT_PRECISION = "float64"
+
+# Diferenças aceitas entre float32 e float64 (ver `compare_precision`)
+MASK_TOLERANCE = 1e-3  # fração dos keypoints x frames com máscara diferente
+SIGMASQ_LOC_TOLERANCE = 1e-3  # erro relativo
+
+
+def get_precision_dtype(config: dict) -> type:
+    """Dtype of the preprocessing pipeline, from `precision` in config.yml (float64 or float32)."""
+    precision = config.get("precision", DEFAULT_PRECISION)
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown precision {precision!r} in config.yml, use one of {list(PRECISIONS)}")
+    return PRECISIONS[precision]
+
+
+def _detect_with_peak_memory(coordinates: np.ndarray, config: dict, detection_params: dict) -> tuple[dict, int]:
+    # Importado aqui: `detect_outliers` usa `get_precision_dtype` deste módulo
+    from utils.find_medoid_distance_outliers import detect_outliers
+
+    tracemalloc.start()
+    try:
+        outliers = detect_outliers(coordinates, config, **detection_params)
+        return outliers, tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def compare_outlier_masks(coordinates: np.ndarray, config: dict, dtype=np.float32) -> tuple[dict, dict]:
+    """Run the outlier detection of one recording in float64 and in `dtype`.
+
+    Each run goes through `detect_outliers` with `precision` set to its dtype, so the
+    reference computes every value (pair distances and thresholds included) in float64.
+
+    Returns the fraction of keypoints x frames whose mask differs (combined mask and each
+    enabled detector) and the peak memory allocated by each run (bytes, from tracemalloc).
+    """
+    from utils.find_medoid_distance_outliers import get_outlier_detection_params
+
+    detection_params = get_outlier_detection_params(config)
+    reference, reference_peak = _detect_with_peak_memory(
+        coordinates.astype(np.float64), {**config, "precision": "float64"}, detection_params
+    )
+    result, result_peak = _detect_with_peak_memory(
+        coordinates.astype(dtype), {**config, "precision": np.dtype(dtype).name}, detection_params
+    )
+
+    n_values = max(reference["mask"].size, 1)
+    differences = {"combined": np.count_nonzero(reference["mask"] != result["mask"]) / n_values}
+    for key, value in reference.items():
+        if key.endswith("_outliers"):
+            differences[key[: -len("_outliers")]] = (
+                np.count_nonzero(value["mask"] != result[key]["mask"]) / n_values
+            )
+    peak_bytes = {np.dtype(np.float64).name: reference_peak, np.dtype(dtype).name: result_peak}
+    return differences, peak_bytes
@@ -0,0 +1,112 @@
+from functools import cached_property
+from typing import Optional
+
+from utils.formatted_data import load_formatted_data
+from utils.ingestion import ingest_recordings
+from utils.load_data_and_config import load_config, load_keypoints
+from utils.print_legal import print_legal
+from utils.video_frame_indexes import FrameWindows
+
+
+class ProjectContext:
+    """Data of a project, loaded on first use and kept for the rest of the command.
+
+    Each piece (config, raw keypoints, clean keypoints, formatted data) is a cached property
+    computed only when a command reads it, so a command that only needs the config never
+    parses the DeepLabCut files, and one that only needs the coordinates never formats them.
+
+    Parameters
+    -------
+    project_dir: str
+
+    video_dir: str or list of str, optional
+        Defaults to `video_dir` of config.yml.
+
+    remove_outliers: bool, default=True
+        Whether `coordinates` and `confidences` have their outliers removed.
+
+    config_overrides: dict, optional
+        Applied on top of config.yml before anything is loaded.
+
+    build_indexes: bool, default=True
+        False reads config.yml without keypoint-moseq (see `load_config`), so a command that
+        does not use the model never imports JAX; `data` and `metadata` still import it.
+    """
+
+    def __init__(
+        self,
+        project_dir: str,
+        video_dir=None,
+        remove_outliers: bool = True,
+        config_overrides: Optional[dict] = None,
+        build_indexes: bool = True,
+    ):
+        self.project_dir = project_dir
+        self.video_dir = video_dir
+        self.remove_outliers = remove_outliers
+        self.config_overrides = config_overrides or {}
+        self.build_indexes = build_indexes
+
+    @cached_property
+    def config(self) -> dict:
+        config = load_config(self.project_dir, build_indexes=self.build_indexes)
+        config.update(self.config_overrides)
+        return config
+
+    @cached_property
+    def frame_windows(self) -> FrameWindows:
+        """Trims of each recording (see `FrameWindows`)."""
+        return FrameWindows.from_config(self.config)
+
+    @cached_property
+    def raw_keypoints(self) -> tuple[dict, dict, list]:
+        """Coordinates, confidences and bodyparts as in the DeepLabCut files (no trim, no filter)."""
+        return load_keypoints(self.project_dir, self.video_dir, config=self.config)
+
+    @cached_property
+    def _ingested(self) -> tuple[dict, dict, list, dict]:
+        print_legal(f"Carregando keypoints do DLC de: {self.project_dir}")
+        return ingest_recordings(
+            self.project_dir, self.config, video_dir=self.video_dir, remove_outliers=self.remove_outliers
+        )
+
+    @property
+    def coordinates(self) -> dict:
+        """Trimmed coordinates, without outliers if `remove_outliers`."""
+        return self._ingested[0]
+
+    @property
+    def confidences(self) -> dict:
+        return self._ingested[1]
+
+    @property
+    def bodyparts(self) -> list:
+        return self._ingested[2]
+
+    @property
+    def video_frame_indexes(self) -> dict:
+        """Video frames kept for each recording, as `range`s."""
+        return self._ingested[3]
+
+    @cached_property
+    def _formatted(self) -> tuple[dict, tuple, Optional[str]]:
+        if self.config.get("cache_formatted_data", True):
+            return load_formatted_data(self.project_dir, self.coordinates, self.confidences, self.config)
+        import keypoint_moseq as kpms  # type: ignore
+
+        return (*kpms.format_data(self.coordinates, self.confidences, **self.config), None)
+
+    @property
+    def data(self) -> dict:
+        """Data formatted for the model (`kpms.format_data`, memory-mapped from
+        `{project_dir}/formatted_data` when the inputs did not change)."""
+        return self._formatted[0]
+
+    @property
+    def metadata(self) -> tuple:
+        return self._formatted[1]
+
+    @property
+    def formatted_data_dir(self) -> Optional[str]:
+        """Directory of the memory-mapped formatted data (None if `cache_formatted_data` is off)."""
+        return self._formatted[2]
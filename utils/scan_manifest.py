@@ -0,0 +1,80 @@
+import json
+import multiprocessing
+import os
+import time
+from typing import Optional
+
+import h5py
+
+MANIFEST_VERSION = 1
+
+
+def get_last_checkpoint_iter(project_dir: str, model_name: str) -> Optional[int]:
+    """Iteration of the latest snapshot in `{project_dir}/{model_name}/checkpoint.h5` (None if there is none)."""
+    path = os.path.join(project_dir, model_name, "checkpoint.h5")
+    if not os.path.exists(path):
+        return None
+    with h5py.File(path, "r") as f:
+        iterations = [int(i) for i in f["model_snapshots"]] if "model_snapshots" in f else []
+    return max(iterations) if iterations else None
+
+
+class ScanManifest:
+    """Progress of each model of a kappa scan, in `{project_dir}/{prefix}_manifest.json`.
+
+    Each model has an entry with its kappa, `status` ("running", "done" or "failed"), the
+    iteration at which its AR fit ended (`ar_end_iter`, None while it is in the AR fit), the
+    last iteration it finished (`last_iter`) and the iterations asked for. A scan interrupted
+    halfway (OOM, reboot) leaves its models "running"; `resume_point` tells a rerun to skip the
+    finished models and where to resume the others from their latest checkpoint.
+
+    Entries are updated by the scan processes themselves, so every update re-reads the file
+    under a lock shared with the processes (it must reach them at creation, e.g. through the
+    `initargs` of the pool).
+    """
+
+    def __init__(self, project_dir: str, prefix: str):
+        self.project_dir = project_dir
+        self.path = os.path.join(project_dir, f"{prefix}_manifest.json")
+        self.lock = multiprocessing.get_context("spawn").Lock()
+
+    def _load(self) -> dict:
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                manifest = json.load(f)
+            if manifest.get("version") == MANIFEST_VERSION:
+                return manifest
+        return {"version": MANIFEST_VERSION, "models": {}}
+
+    def entry(self, model_name: str) -> Optional[dict]:
+        with self.lock:
+            return self._load()["models"].get(model_name)
+
+    def update(self, model_name: str, **fields):
+        with self.lock:
+            manifest = self._load()
+            entry = manifest["models"].setdefault(model_name, {"ar_end_iter": None, "last_iter": None})
+            entry.update(fields, updated=time.strftime("%Y-%m-%d %H:%M:%S"))
+            with open(self.path + ".tmp", "w") as f:
+                json.dump(manifest, f, indent=2)
+            os.replace(self.path + ".tmp", self.path)
+
+    def resume_point(self, model_name: str, num_ar_iters: int, num_iters: int) -> Optional[tuple[str, int]]:
+        """Where the fit of `model_name` should continue.
+
+        Returns None to start from scratch (no entry or no checkpoint), ("done", iteration) if
+        it already finished with the same numbers of iterations, otherwise ("ar", iteration) or
+        ("full", iteration) with the phase and the iteration of its latest checkpoint.
+        """
+        entry = self.entry(model_name)
+        if entry is None:
+            return None
+        if entry["status"] == "done" and (entry["num_ar_iters"], entry["num_iters"]) == (num_ar_iters, num_iters):
+            return "done", entry["last_iter"]
+
+        last_iter = get_last_checkpoint_iter(self.project_dir, model_name)
+        if last_iter is None:
+            return None
+        if entry["ar_end_iter"] is None:
+            return "ar", last_iter
+        return "full", max(last_iter, entry["ar_end_iter"])
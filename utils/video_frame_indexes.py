@@ -1,15 +1,77 @@
+import os
+
 import numpy as np
+import yaml
 
+# Padrões dos cortes; podem ser mudados no config.yml (`start_frames_to_skip`, `end_frames_to_skip`)
+# e por gravação (`frame_trims: {nome_da_gravação: [início, fim]}`)
 start_frames_to_skip = 120
 end_frames_to_skip = 0
 
-def get_video_frame_indexes(coordinates, confidences):
-  bounds = {k: (start_frames_to_skip, len(coords) - end_frames_to_skip) for k,coords in coordinates.items()}
 
-  coordinates = {k: coords[bounds[k][0]:bounds[k][1]] for k,coords in coordinates.items()}
-  confidences = {k: confs[bounds[k][0]:bounds[k][1]] for k,confs in confidences.items()}
-  video_frame_indexes = {k : np.arange(bounds[k][0], bounds[k][1]) for k in bounds}
-  return coordinates, confidences, video_frame_indexes
+class FrameWindows:
+    """Registry of the frame window of each recording, the only place where trims are applied.
+
+    Each recording keeps the frames `[start, n_frames - end)` of its video, with `start` and
+    `end` taken from `trims[recording_name]` or the project defaults. Windows are slices (views
+    of the arrays, no copy) and frame indexes are `range`s, which support `len`, indexing and
+    slicing like the `np.arange` that kpms expects.
+
+    Parameters
+    -------
+    start: int, default=120
+        Frames skipped at the start of every recording.
+
+    end: int, default=0
+        Frames skipped at the end of every recording.
+
+    trims: dict, optional
+        {recording_name: (start, end)} overriding the defaults.
+    """
+
+    def __init__(self, start: int = start_frames_to_skip, end: int = end_frames_to_skip, trims: dict = None):
+        self.start = int(start)
+        self.end = int(end)
+        self.trims = {name: (int(s), int(e)) for name, (s, e) in (trims or {}).items()}
+
+    @classmethod
+    def from_config(cls, config: dict) -> "FrameWindows":
+        return cls(
+            config.get("start_frames_to_skip", start_frames_to_skip),
+            config.get("end_frames_to_skip", end_frames_to_skip),
+            config.get("frame_trims"),
+        )
+
+    @classmethod
+    def from_project(cls, project_dir: str) -> "FrameWindows":
+        """Read the trims straight from `{project_dir}/config.yml` (for the scripts)."""
+        with open(os.path.join(project_dir, "config.yml")) as f:
+            return cls.from_config(yaml.safe_load(f) or {})
+
+    def trim(self, recording_name: str) -> tuple[int, int]:
+        return self.trims.get(recording_name, (self.start, self.end))
+
+    def frame_range(self, recording_name: str, n_frames: int) -> range:
+        """Video frames kept for a recording with `n_frames` frames."""
+        start, end = self.trim(recording_name)
+        return range(min(start, n_frames), max(n_frames - end, min(start, n_frames)))
+
+    def window(self, recording_name: str, array: np.ndarray) -> np.ndarray:
+        """View of the frames of `array` (first axis = video frames) kept for the recording."""
+        frames = self.frame_range(recording_name, len(array))
+        return array[frames.start : frames.stop]
+
+    def params(self) -> dict:
+        """Default trims, for cache keys (a per-recording trim already changes the data of the
+        recording itself)."""
+        return {"start_frames_to_skip": self.start, "end_frames_to_skip": self.end}
+
 
-def skip_frames_in_array(array):
-  return array[start_frames_to_skip:len(array) - end_frames_to_skip]
\ No newline at end of file
+def get_video_frame_indexes(coordinates, confidences, frame_windows=None):
+    """Corta as gravações (views) e devolve os índices dos frames do vídeo de cada uma (ranges)."""
+    if frame_windows is None:
+        frame_windows = FrameWindows()
+    video_frame_indexes = {k: frame_windows.frame_range(k, len(coords)) for k, coords in coordinates.items()}
+    coordinates = {k: frame_windows.window(k, coords) for k, coords in coordinates.items()}
+    confidences = {k: frame_windows.window(k, confs) for k, confs in confidences.items()}
+    return coordinates, confidences, video_frame_indexes
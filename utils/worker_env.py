@@ -0,0 +1,59 @@
+import os
+from contextlib import contextmanager
+
+# Variáveis lidas pelas bibliotecas de BLAS/OpenMP quando são carregadas
+THREAD_ENV_VARS = ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS", "NUMEXPR_NUM_THREADS")
+
+
+def get_threads_per_worker(n_workers: int, threads_per_worker: int = None) -> int:
+    """Threads of each worker process: `threads_per_worker`, or the CPUs split evenly."""
+    if threads_per_worker:
+        return threads_per_worker
+    return max(1, (os.cpu_count() or 1) // max(n_workers, 1))
+
+
+def get_gpu_memory_env(n_workers: int) -> dict:
+    """Environment variables giving each process an equal share of the GPU memory: the
+    `n_workers` worker processes and the parent, which also holds the data and the models.
+
+    They are read when JAX starts its backend, so in the parent they must be set before its
+    first use of JAX (see `main.py`).
+    """
+    return {
+        # Sem isso cada processo reserva 75% da GPU
+        "XLA_PYTHON_CLIENT_PREALLOCATE": "false",
+        "XLA_PYTHON_CLIENT_MEM_FRACTION": f"{0.9 / (max(n_workers, 1) + 1):.3f}",
+    }
+
+
+def get_worker_env(n_workers: int, threads_per_worker: int) -> dict:
+    """Environment variables capping the CPU threads and the GPU memory share of one of
+    `n_workers` worker processes.
+
+    XLA has no flag for the size of its CPU thread pool, so its operations run single-threaded
+    in each worker (`--xla_cpu_multi_thread_eigen=false`); `threads_per_worker` caps the
+    BLAS and OpenMP threads.
+    """
+    xla_flags = os.environ.get("XLA_FLAGS", "")
+    if "--xla_cpu_multi_thread_eigen" not in xla_flags:
+        xla_flags += " --xla_cpu_multi_thread_eigen=false"
+    env = {name: str(threads_per_worker) for name in THREAD_ENV_VARS}
+    env["XLA_FLAGS"] = xla_flags.strip()
+    env.update(get_gpu_memory_env(n_workers))
+    return env
+
+
+@contextmanager
+def worker_environment(env: dict):
+    """Set `env` while the worker processes are spawned (they inherit it) and restore the
+    environment of this process afterwards."""
+    previous = {name: os.environ.get(name) for name in env}
+    os.environ.update(env)
+    try:
+        yield
+    finally:
+        for name, value in previous.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value